@@ -0,0 +1,452 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from remote_simulator import simulator_url
+
+GIT_AUTO_PATH = Path(__file__).resolve().parents[1] / "gitAutoCommit.py"
+FAKE_NMCLI_DIRECTORY = Path(__file__).resolve().parent / "fake-nmcli"
+SCALES = {
+    "1k": {"files": 1_000, "depth": 2, "fanout": 16},
+    "100k": {"files": 100_000, "depth": 3, "fanout": 32},
+    "deep": {"files": 2_000, "depth": 12, "fanout": 2},
+    "binaries": {
+        "files": 200,
+        "depth": 1,
+        "fanout": 8,
+        "binary_files": 20,
+        "binary_size": 5 * 1024 * 1024,
+    },
+    "untracked": {"files": 1_000, "depth": 2, "fanout": 16, "ignored_files": 20_000},
+    "history": {"files": 1_000, "depth": 2, "fanout": 16, "history": 5_000},
+}
+DEFAULT_SCALES = ["1k", "deep", "binaries", "untracked", "history"]
+SCENARIOS = [
+    "clean-synced",
+    "dirty",
+    "local-ahead",
+    "remote-ahead-rebase",
+    "staged-takeover",
+]
+SIMULATED_REMOTE_SCENARIOS = ["push-race", "read-only-remote"]
+DIRTY_FILES = 10
+STAGED_TAKEOVER_ARGS = ["--staged-wait-seconds", "1", "--staged-poll-seconds", "0.25"]
+REGRESSION_THRESHOLD = 0.10
+RANDOM_SEED = 20260618
+COMMIT_TIMESTAMP = 1_700_000_000
+
+
+def git(repo_path, *args, **kwargs):
+    return subprocess.run(
+        ["git", "-C", str(repo_path), *args],
+        capture_output=True,
+        check=True,
+        text=True,
+        **kwargs,
+    )
+
+
+def tracked_file_path(file_index, depth, fanout):
+    directories = [
+        f"dir{(file_index // fanout**level) % fanout}" for level in range(depth)
+    ]
+    return "/".join([*directories, f"file{file_index}.txt"])
+
+
+def fast_import_data(content):
+    return b"data %d\n" % len(content) + content + b"\n"
+
+
+def fast_import_commit(mark, parent_mark, message, file_changes):
+    commit = [
+        b"commit refs/heads/master\n",
+        b"mark :%d\n" % mark,
+        b"author Benchmark <bench@example.com> %d +0000\n" % (COMMIT_TIMESTAMP + mark),
+        b"committer Benchmark <bench@example.com> %d +0000\n"
+        % (COMMIT_TIMESTAMP + mark),
+        fast_import_data(message.encode()),
+    ]
+    if parent_mark is not None:
+        commit.append(b"from :%d\n" % parent_mark)
+    for file_path, content in file_changes:
+        commit.append(b"M 644 inline " + file_path.encode() + b"\n")
+        commit.append(fast_import_data(content))
+    return b"".join(commit) + b"\n"
+
+
+def initial_file_changes(scale):
+    generator = random.Random(RANDOM_SEED)
+    file_changes = [(".gitignore", b"*.tmp\n")]
+    for file_index in range(scale["files"]):
+        file_changes.append(
+            (
+                tracked_file_path(file_index, scale["depth"], scale["fanout"]),
+                f"file {file_index}\n".encode() * (1 + file_index % 8),
+            )
+        )
+    for binary_index in range(scale.get("binary_files", 0)):
+        file_changes.append(
+            (
+                f"binaries/blob{binary_index}.bin",
+                generator.randbytes(scale["binary_size"]),
+            )
+        )
+    return file_changes
+
+
+def create_remote(bare_path, scale):
+    git(bare_path.parent, "init", "--quiet", "--bare", str(bare_path))
+    fast_import = subprocess.Popen(
+        ["git", "-C", str(bare_path), "fast-import", "--quiet"],
+        stdin=subprocess.PIPE,
+    )
+    fast_import.stdin.write(
+        fast_import_commit(1, None, "initial", initial_file_changes(scale))
+    )
+    for history_index in range(scale.get("history", 0)):
+        file_index = history_index % scale["files"]
+        fast_import.stdin.write(
+            fast_import_commit(
+                history_index + 2,
+                history_index + 1,
+                f"history {history_index}",
+                [
+                    (
+                        tracked_file_path(file_index, scale["depth"], scale["fanout"]),
+                        f"history {history_index}\n".encode(),
+                    )
+                ],
+            )
+        )
+    fast_import.stdin.close()
+    if fast_import.wait() != 0:
+        raise RuntimeError(f"git fast-import failed for {bare_path}")
+
+
+def clone_remote(bare_path, clone_path, scale, remote_url=None):
+    git(clone_path.parent, "clone", "--quiet", str(bare_path), str(clone_path))
+    if remote_url:
+        git(clone_path, "remote", "set-url", "origin", remote_url)
+    for ignored_index in range(scale.get("ignored_files", 0)):
+        ignored_path = (
+            clone_path / "scratch" / f"d{ignored_index % 64}" / f"{ignored_index}.tmp"
+        )
+        ignored_path.parent.mkdir(parents=True, exist_ok=True)
+        ignored_path.write_text(f"scratch {ignored_index}\n", encoding="utf-8")
+
+
+def run_git_auto(repo_path, environment, *args):
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, str(GIT_AUTO_PATH), "-p", str(repo_path), *args],
+        capture_output=True,
+        env=environment,
+        text=True,
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"gitAutoCommit.py failed in {repo_path} with status {result.returncode}:\n"
+            + result.stderr
+        )
+    return elapsed
+
+
+def edit_tracked_files(repo_path, scale, sample_name, file_count):
+    for file_index in range(file_count):
+        file_path = repo_path / tracked_file_path(
+            file_index, scale["depth"], scale["fanout"]
+        )
+        with open(file_path, "a", encoding="utf-8") as tracked_file:
+            tracked_file.write(f"{sample_name}\n")
+
+
+def prepare_scenario(scenario, bench, sample_name):
+    scale = bench["scale"]
+    repo_path = bench["work_dir"] / sample_name
+    remote_url = (
+        bench["read_only_url"] if scenario == "read-only-remote" else bench["remote_url"]
+    )
+    clone_remote(bench["bare_path"], repo_path, scale, remote_url)
+    run_git_auto(repo_path, bench["environment"])
+
+    if scenario == "clean-synced":
+        return repo_path, []
+    if scenario == "dirty":
+        edit_tracked_files(repo_path, scale, sample_name, DIRTY_FILES)
+        (repo_path / f"{sample_name}.txt").write_text("new file\n", encoding="utf-8")
+        return repo_path, []
+    if scenario == "local-ahead":
+        edit_tracked_files(repo_path, scale, sample_name, 1)
+        git(repo_path, "commit", "--quiet", "-am", sample_name)
+        return repo_path, []
+    if scenario == "remote-ahead-rebase":
+        other_path = bench["other_path"]
+        git(other_path, "pull", "--quiet", "--rebase")
+        (other_path / "other.txt").write_text(f"{sample_name}\n", encoding="utf-8")
+        git(other_path, "add", "other.txt")
+        git(other_path, "commit", "--quiet", "-m", f"other {sample_name}")
+        git(other_path, "push", "--quiet")
+        edit_tracked_files(repo_path, scale, sample_name, 1)
+        return repo_path, []
+    if scenario in ("push-race", "read-only-remote"):
+        if scenario == "push-race":
+            bench["race_file"].write_text("1\n", encoding="utf-8")
+        edit_tracked_files(repo_path, scale, sample_name, DIRTY_FILES)
+        return repo_path, []
+    if scenario == "staged-takeover":
+        edit_tracked_files(repo_path, scale, sample_name, DIRTY_FILES)
+        git(repo_path, "add", "--all")
+        return repo_path, STAGED_TAKEOVER_ARGS
+    raise ValueError(f"Unknown scenario {scenario!r}")
+
+
+def prepare_scale(scale_name, work_dir, args):
+    scale = SCALES[scale_name]
+    scale_dir = work_dir / scale_name
+    scale_dir.mkdir(parents=True)
+    global_config = scale_dir / "gitconfig"
+    global_config.write_text(
+        "[user]\n\tname = Benchmark\n\temail = bench@example.com\n"
+        "[init]\n\tdefaultBranch = master\n"
+        '[protocol "ext"]\n\tallow = always\n',
+        encoding="utf-8",
+    )
+    environment = {
+        **os.environ,
+        "GIT_CONFIG_GLOBAL": str(global_config),
+        "GIT_CONFIG_NOSYSTEM": "1",
+        "GIT_AUTO_STATE_DIR": str(scale_dir / "state"),
+        "GIT_AUTO_ERROR_INBOX_PATH": os.devnull,
+    }
+    if args.remote == "simulated":
+        environment.update(
+            {
+                "PATH": f"{FAKE_NMCLI_DIRECTORY}{os.pathsep}{os.environ['PATH']}",
+                "GIT_AUTO_CONNECTIVITY_BACKEND": "nmcli",
+                "GIT_AUTO_FAKE_NMCLI_DELAY_MS": str(args.nmcli_delay_ms),
+            }
+        )
+    os.environ["GIT_CONFIG_GLOBAL"] = str(global_config)
+    os.environ["GIT_CONFIG_NOSYSTEM"] = "1"
+
+    bare_path = scale_dir / "remote.git"
+    create_remote(bare_path, scale)
+    race_file = scale_dir / "race"
+    race_file.write_text("0\n", encoding="utf-8")
+    bench = {
+        "scale": scale,
+        "work_dir": scale_dir,
+        "bare_path": bare_path,
+        "other_path": scale_dir / "other",
+        "environment": environment,
+        "race_file": race_file,
+        "remote_url": None,
+        "read_only_url": None,
+    }
+    if args.remote == "simulated":
+        bench["remote_url"] = simulator_url(
+            bare_path, args.latency_ms, args.bandwidth_kbps, race_file=race_file
+        )
+        bench["read_only_url"] = simulator_url(
+            bare_path, args.latency_ms, args.bandwidth_kbps, deny_push=True
+        )
+    clone_remote(bare_path, bench["other_path"], scale)
+
+    priming_path = scale_dir / "priming"
+    clone_remote(bare_path, priming_path, scale, bench["remote_url"])
+    (priming_path / "priming.txt").write_text("prime caches\n", encoding="utf-8")
+    run_git_auto(priming_path, environment)
+    shutil.rmtree(priming_path)
+    return bench
+
+
+def run_benchmarks(args):
+    scenarios = args.scenario or SCENARIOS + (
+        SIMULATED_REMOTE_SCENARIOS if args.remote == "simulated" else []
+    )
+    if args.remote != "simulated" and set(scenarios) & set(SIMULATED_REMOTE_SCENARIOS):
+        sys.exit(
+            f"Scenarios {', '.join(SIMULATED_REMOTE_SCENARIOS)} need --remote simulated"
+        )
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="git-auto-bench-"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    results = {}
+    try:
+        for scale_name in args.scale or DEFAULT_SCALES:
+            print(f"Preparing {scale_name} repositories in {work_dir}", file=sys.stderr)
+            bench = prepare_scale(scale_name, work_dir, args)
+            for scenario in scenarios:
+                samples = []
+                for sample_index in range(args.repeat):
+                    sample_name = f"{scenario}-{sample_index}"
+                    repo_path, extra_args = prepare_scenario(scenario, bench, sample_name)
+                    samples.append(
+                        run_git_auto(repo_path, bench["environment"], *extra_args)
+                    )
+                    shutil.rmtree(repo_path)
+                results[f"{scale_name}/{scenario}"] = {
+                    "samples": samples,
+                    "median": statistics.median(samples),
+                    "min": min(samples),
+                    "max": max(samples),
+                }
+                print(
+                    f"{scale_name}/{scenario}: median {statistics.median(samples):.3f}s "
+                    f"over {len(samples)} runs",
+                    file=sys.stderr,
+                )
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "created_at": time.time(),
+        "git_version": git(".", "--version").stdout.strip(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "git_auto_commit": git(GIT_AUTO_PATH.parent, "rev-parse", "HEAD").stdout.strip(),
+        "repeat": args.repeat,
+        "remote": {
+            "kind": args.remote,
+            "latency_ms": args.latency_ms,
+            "bandwidth_kbps": args.bandwidth_kbps,
+            "nmcli_delay_ms": args.nmcli_delay_ms,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2, sort_keys=True)
+        output_file.write("\n")
+    print(f"Wrote benchmark results to {args.output}", file=sys.stderr)
+
+
+def compare_results(baseline, current, threshold):
+    rows = []
+    regressions = []
+    for benchmark_name in sorted(set(baseline["results"]) | set(current["results"])):
+        baseline_result = baseline["results"].get(benchmark_name)
+        current_result = current["results"].get(benchmark_name)
+        if baseline_result is None or current_result is None:
+            rows.append((benchmark_name, baseline_result, current_result, None, "missing"))
+            continue
+        change = current_result["median"] / baseline_result["median"] - 1
+        status = ""
+        if change > threshold:
+            status = "REGRESSION"
+            regressions.append(benchmark_name)
+        elif change < -threshold:
+            status = "improved"
+        rows.append((benchmark_name, baseline_result, current_result, change, status))
+    return rows, regressions
+
+
+def compare_benchmarks(args):
+    with open(args.baseline, encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(args.current, encoding="utf-8") as current_file:
+        current = json.load(current_file)
+
+    rows, regressions = compare_results(baseline, current, args.threshold)
+    print(f"{'benchmark':<36} {'baseline':>10} {'current':>10} {'change':>8}")
+    for benchmark_name, baseline_result, current_result, change, status in rows:
+        baseline_median = "-" if baseline_result is None else f"{baseline_result['median']:.3f}s"
+        current_median = "-" if current_result is None else f"{current_result['median']:.3f}s"
+        change_text = "-" if change is None else f"{change:+.1%}"
+        print(
+            f"{benchmark_name:<36} {baseline_median:>10} {current_median:>10} "
+            f"{change_text:>8} {status}".rstrip()
+        )
+    if regressions:
+        print(
+            f"{len(regressions)} benchmark(s) slower than the baseline by more than "
+            f"{args.threshold:.0%}: {', '.join(regressions)}"
+        )
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time gitAutoCommit.py scenarios on synthetic local repositories"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmark scenarios")
+    run_parser.add_argument(
+        "--scale",
+        action="append",
+        choices=sorted(SCALES),
+        help=f"Repository scale to benchmark; repeatable (default: {', '.join(DEFAULT_SCALES)})",
+    )
+    run_parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=SCENARIOS + SIMULATED_REMOTE_SCENARIOS,
+        help="Scenario to time; repeatable (default: all that apply to --remote)",
+    )
+    run_parser.add_argument(
+        "--remote",
+        choices=["local", "simulated"],
+        default="local",
+        help="Push to the bare repository directly or through remote_simulator.py",
+    )
+    run_parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=40,
+        help="One-way latency of the simulated remote",
+    )
+    run_parser.add_argument(
+        "--bandwidth-kbps",
+        type=float,
+        default=0,
+        help="Bandwidth limit of the simulated remote (0 for unlimited)",
+    )
+    run_parser.add_argument(
+        "--nmcli-delay-ms",
+        type=float,
+        default=0,
+        help="Delay added to each fake nmcli connectivity query",
+    )
+    run_parser.add_argument(
+        "--repeat", type=int, default=5, help="Timed runs per scenario"
+    )
+    run_parser.add_argument(
+        "--work-dir", help="Directory for generated repositories (default: a temporary directory)"
+    )
+    run_parser.add_argument(
+        "--keep", action="store_true", help="Keep generated repositories after the run"
+    )
+    run_parser.add_argument(
+        "--output", default="benchmark-results.json", help="Where to write the JSON results"
+    )
+    run_parser.set_defaults(handler=run_benchmarks)
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="Compare two result files and flag regressions"
+    )
+    compare_parser.add_argument("baseline", help="Saved baseline results")
+    compare_parser.add_argument("current", help="Results to check against the baseline")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=REGRESSION_THRESHOLD,
+        help="Relative median slowdown reported as a regression",
+    )
+    compare_parser.set_defaults(handler=compare_benchmarks)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Stand-in network remote for benchmarks, used through Git's ext:: transport.
+
+    ext::python3 remote_simulator.py [options] %S /path/to/remote.git
+
+Git runs this script instead of connecting to a server. It starts the real
+upload-pack or receive-pack on the local bare repository and relays the
+protocol stream with the configured latency and bandwidth. It can also
+deny pushes the way hosting services do, or move the remote branch just
+before a push so the push is rejected as non-fast-forward. The remote must
+be allowed with `protocol.ext.allow=always`.
+"""
+
+import argparse
+import fcntl
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+CHUNK_SIZE = 64 * 1024
+
+
+def simulator_url(
+    remote_path, latency_ms=0, bandwidth_kbps=0, deny_push=False, race_file=None
+):
+    command = [sys.executable, os.path.abspath(__file__)]
+    if latency_ms:
+        command.extend(["--latency-ms", str(latency_ms)])
+    if bandwidth_kbps:
+        command.extend(["--bandwidth-kbps", str(bandwidth_kbps)])
+    if deny_push:
+        command.append("--deny-push")
+    if race_file:
+        command.extend(["--race-file", str(race_file)])
+    command.extend(["%S", str(remote_path)])
+    for part in command:
+        if " " in part:
+            raise ValueError(f"ext:: remote arguments cannot contain spaces: {part}")
+    return "ext::" + " ".join(command)
+
+
+def relay(source_fd, destination_fd, delay_seconds, bytes_per_second):
+    chunks = queue.Queue()
+
+    def read_chunks():
+        while True:
+            chunk = os.read(source_fd, CHUNK_SIZE)
+            chunks.put((time.monotonic() + delay_seconds, chunk))
+            if not chunk:
+                return
+
+    reader = threading.Thread(target=read_chunks, daemon=True)
+    reader.start()
+    while True:
+        deliver_at, chunk = chunks.get()
+        time.sleep(max(0, deliver_at - time.monotonic()))
+        if not chunk:
+            return
+        if bytes_per_second:
+            time.sleep(len(chunk) / bytes_per_second)
+        try:
+            os.write(destination_fd, chunk)
+        except BrokenPipeError:
+            return
+
+
+def take_race(race_file):
+    try:
+        with open(race_file, "r+", encoding="utf-8") as race_state:
+            fcntl.flock(race_state, fcntl.LOCK_EX)
+            remaining = int(race_state.read().strip() or 0)
+            if remaining <= 0:
+                return False
+            race_state.seek(0)
+            race_state.truncate()
+            race_state.write(f"{remaining - 1}\n")
+            return True
+    except FileNotFoundError:
+        return False
+
+
+def advance_remote_branch(remote_path):
+    def git(*args):
+        return subprocess.run(
+            ["git", f"--git-dir={remote_path}", *args],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+
+    branch_ref = git("symbolic-ref", "HEAD")
+    tip = git("rev-parse", branch_ref)
+    environment = {
+        **os.environ,
+        "GIT_AUTHOR_NAME": "Remote Simulator",
+        "GIT_AUTHOR_EMAIL": "simulator@example.com",
+        "GIT_COMMITTER_NAME": "Remote Simulator",
+        "GIT_COMMITTER_EMAIL": "simulator@example.com",
+    }
+    racing_commit = subprocess.run(
+        [
+            "git",
+            f"--git-dir={remote_path}",
+            "commit-tree",
+            f"{tip}^{{tree}}",
+            "-p",
+            tip,
+            "-m",
+            "Concurrent push",
+        ],
+        capture_output=True,
+        check=True,
+        env=environment,
+        text=True,
+    ).stdout.strip()
+    git("update-ref", branch_ref, racing_commit, tip)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--latency-ms", type=float, default=0, help="One-way delay added to every chunk"
+    )
+    parser.add_argument(
+        "--bandwidth-kbps",
+        type=float,
+        default=0,
+        help="Bandwidth limit per direction in kilobytes per second",
+    )
+    parser.add_argument(
+        "--connect-rtts",
+        type=float,
+        default=3,
+        help="Round trips spent setting up the connection",
+    )
+    parser.add_argument(
+        "--deny-push",
+        action="store_true",
+        help="Reject receive-pack with a permission error",
+    )
+    parser.add_argument(
+        "--race-file",
+        help="File holding how many future pushes should lose a race to a concurrent push",
+    )
+    parser.add_argument(
+        "service", help="git-upload-pack or git-receive-pack (%%S in the ext:: URL)"
+    )
+    parser.add_argument(
+        "remote_path", help="Local bare repository behind the simulated remote"
+    )
+    args = parser.parse_args()
+
+    one_way_delay_seconds = args.latency_ms / 1000
+    time.sleep(2 * one_way_delay_seconds * args.connect_rtts)
+
+    if args.service == "git-receive-pack":
+        if args.deny_push:
+            print(
+                "ERROR: Permission to simulated/remote.git denied to benchmark.\n"
+                "fatal: Could not read from remote repository.\n\n"
+                "Please make sure you have the correct access rights\n"
+                "and the repository exists.",
+                file=sys.stderr,
+            )
+            sys.exit(128)
+        if args.race_file and take_race(args.race_file):
+            advance_remote_branch(args.remote_path)
+
+    service = subprocess.Popen(
+        ["git", args.service.removeprefix("git-"), args.remote_path],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+    bytes_per_second = args.bandwidth_kbps * 1024
+
+    def relay_requests():
+        relay(
+            sys.stdin.fileno(),
+            service.stdin.fileno(),
+            one_way_delay_seconds,
+            bytes_per_second,
+        )
+        service.stdin.close()
+
+    threading.Thread(target=relay_requests, daemon=True).start()
+    relay(
+        service.stdout.fileno(),
+        sys.stdout.fileno(),
+        one_way_delay_seconds,
+        bytes_per_second,
+    )
+    sys.exit(service.wait())
+
+
+if __name__ == "__main__":
+    main()
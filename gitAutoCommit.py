@@ -1,12 +1,27 @@
 import subprocess
-import re
 import argparse
+import ctypes
+import ctypes.util
 import fcntl
+import functools
 import hashlib
+import json
 import os
+import re
+import select
 import shlex
+import shutil
+import sqlite3
+import struct
 import time
 import sys
+import tempfile
+import threading
+import urllib.parse
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from os import path
 from pathlib import Path
 
@@ -20,17 +35,115 @@ AUTO_COMMIT_LOCK_FILENAME = "git_auto_commit.lock"
 AUTO_COMMIT_STATE_FILENAME = "git_auto_commit.pending"
 AUTO_COMMIT_PAUSE_FILENAME = "git_auto_commit.pause"
 REMOTE_PERMISSION_CACHE_FILENAME = "git_auto_commit.remote_write"
+CLEAN_FINGERPRINT_FILENAME = "git_auto_commit.fingerprint"
+TUNING_STATE_FILENAME = "git_auto_commit.tuning"
+TUNE_MANY_FILES_THRESHOLD = 10000
+CLEAN_FINGERPRINT_VERSION = 1
+CLEAN_FINGERPRINT_RACY_SECONDS = 2
 AUTO_COMMIT_PAUSE_SECONDS = 14 * 24 * 60 * 60
 PUSH_RECONCILE_ATTEMPTS = 2
+PUSH_MAX_AGE_SECONDS = 0
+PUSH_MAX_COMMITS = 0
+MERGE_TREE_MERGE_BASE_GIT_VERSION = (2, 40)
 COMMIT_ATTEMPTS = 3
 COMMIT_RETRY_DELAY_SECONDS = 2
+AUTO_COMMIT_TRAILER_KEY = "Auto-Committed-By"
+AUTO_COMMIT_TRAILER_VALUE = "git-auto"
+COMMIT_MESSAGE_MAX_NAMES = 50
+COMMIT_MESSAGE_MAX_GROUPS = 10
+COMMIT_MESSAGE_READ_SIZE = 64 * 1024
+BATCH_JOBS = 8
+STAGE_PATHSPEC_LIMIT = 1000
+WATCH_DEBOUNCE_SECONDS = 5
+WATCH_MAX_DELAY_SECONDS = 60
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")
+WATCH_WORKTREE_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_ONLYDIR
+)
+WATCH_GIT_DIR_MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+WATCHED_GIT_DIR_NAMES = ("index.lock", "HEAD", "packed-refs")
 NETWORKMANAGER_CONNECTED_STATE = "full"
+NETWORKMANAGER_CONNECTIVITY_STATES = {
+    0: "unknown",
+    1: "none",
+    2: "portal",
+    3: "limited",
+    4: "full",
+}
+NETWORKMANAGER_DBUS_NAME = "org.freedesktop.NetworkManager"
+NETWORKMANAGER_DBUS_PATH = "/org/freedesktop/NetworkManager"
+CONNECTIVITY_BACKEND = os.environ.get("GIT_AUTO_CONNECTIVITY_BACKEND", "auto")
+CONNECTIVITY_CACHE_FILENAME = "connectivity.json"
+CONNECTIVITY_CACHE_SECONDS = 30
+PUSH_TIMEOUT_SECONDS = 120
+FETCH_TIMEOUT_SECONDS = 120
+PERMISSION_PROBE_TIMEOUT_SECONDS = 60
+HOST_FAILURE_THRESHOLD = 3
+HOST_COOLDOWN_SECONDS = 10 * 60
+HOST_HEALTH_FILENAME = "host-health.json"
+REMOTE_PERMISSIONS_FILENAME = "remote-permissions.json"
+REMOTE_WRITABLE_CACHE_SECONDS = int(
+    os.environ.get("GIT_AUTO_WRITABLE_CACHE_SECONDS", 7 * 24 * 60 * 60)
+)
+REMOTE_READ_ONLY_CACHE_SECONDS = int(
+    os.environ.get("GIT_AUTO_READ_ONLY_CACHE_SECONDS", 24 * 60 * 60)
+)
+SSH_CONTROL_PERSIST_SECONDS = 5 * 60
+UNREACHABLE_REMOTE_MESSAGES = (
+    "could not resolve hostname",
+    "could not resolve host",
+    "connection timed out",
+    "operation timed out",
+    "connection refused",
+    "network is unreachable",
+    "no route to host",
+    "connection reset by peer",
+    "connection closed by remote host",
+    "kex_exchange_identification",
+    "failed to connect to",
+)
 ERROR_INBOX_PATH = Path(
     os.environ.get(
         "GIT_AUTO_ERROR_INBOX_PATH",
         Path.home() / "notes/inbox-index.md",
     )
 )
+STATE_DIR = Path(
+    os.environ.get(
+        "GIT_AUTO_STATE_DIR",
+        Path.home() / ".cache/git-auto",
+    )
+)
+DISCOVERY_INDEX_FILENAME = "discovery-index.json"
+DISCOVERY_INDEX_VERSION = 1
+RUN_STATE_FILENAME = "run-state.sqlite3"
+ADAPTIVE_BASE_INTERVAL_SECONDS = 5 * 60
+ADAPTIVE_MAX_INTERVAL_SECONDS = 12 * 60 * 60
+MAINTENANCE_COMMIT_BUDGET = 50
+MAINTENANCE_INTERVAL_SECONDS = 24 * 60 * 60
+MAINTENANCE_TASKS = ("loose-objects", "incremental-repack", "commit-graph", "pack-refs")
+METRICS_STATE_FILENAME = "metrics.json"
+PHASE_DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
 PRODUCER_PATH = Path(__file__).resolve()
 def getAbsPathFromScript(relPath):
     basepath = path.dirname(__file__)
@@ -62,36 +175,141 @@ def getAbsPathFromPWD(relPath):
     return fullPath
 
 
-def git_dir_path(repoAbsPath):
-    result = subprocess.run(
-        ["git", "rev-parse", "--git-dir"],
-        capture_output=True,
-        text=True,
-        check=True,
-    )
-    git_dir = result.stdout.strip()
-    if os.path.isabs(git_dir):
-        return git_dir
-    return os.path.abspath(os.path.join(repoAbsPath, git_dir))
+@dataclass(eq=False)
+class RepoContext:
+    path: str
+    ssh_control_directory: str | None = None
+    phase_durations: dict = field(default_factory=dict)
+    spans: list = field(default_factory=list)
+    commits_made: int = 0
+
+    @functools.cached_property
+    def git_paths(self):
+        result = run_command(
+            [
+                "git",
+                "rev-parse",
+                "--path-format=absolute",
+                "--git-dir",
+                "--git-common-dir",
+                "--show-toplevel",
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=self.path,
+        )
+        return result.stdout.splitlines()
 
+    @property
+    def git_dir(self):
+        return self.git_paths[0]
 
-def generate_commit_message():
-    result = subprocess.run(
-        ["git", "diff", "--name-only", "--cached"], capture_output=True, text=True
-    )
-    commit_message = result.stdout.strip()
-    commit_message = "\n".join(
-        [
-            re.sub(r"^.*/", "", line)
-            for line in commit_message.split("\n")
-            if not re.search(r"(^\.)|(\/\.)", line)
-        ]
-    )
-    # test
-    if not commit_message:
-        commit_message = "Commit involves changes in hidden files or directories only"
+    @property
+    def common_dir(self):
+        return self.git_paths[1]
+
+    @property
+    def worktree_root(self):
+        return self.git_paths[2]
+
+    @functools.cached_property
+    def real_path(self):
+        return os.path.realpath(self.path)
+
+    @functools.cached_property
+    def real_git_dir(self):
+        return os.path.realpath(self.git_dir)
+
+    @functools.cached_property
+    def state(self):
+        return read_repo_state(self)
+
+    @functools.cached_property
+    def git_config(self):
+        return read_git_config(self)
 
-    return commit_message
+    @functools.cached_property
+    def network_environment(self):
+        return ssh_multiplexing_environment(self.ssh_control_directory, self.git_config)
+
+    @functools.cached_property
+    def push_remote(self):
+        return push_remote_name(self.state.branch, self.git_config)
+
+    @functools.cached_property
+    def push_url(self):
+        return remote_push_url(self.push_remote, self.git_config, self)
+
+    @property
+    def upstream(self):
+        return upstream_name(self.state)
+
+    def invalidate(self):
+        self.__dict__.pop("state", None)
+
+
+def diff_paths(ctx, diff_arguments):
+    with tempfile.TemporaryFile() as output:
+        run_command(
+            ["git", "diff", "--name-only", "-z", *diff_arguments],
+            stdout=output,
+            cwd=ctx.path,
+        )
+        output.seek(0)
+        pending = b""
+        while True:
+            chunk = output.read(COMMIT_MESSAGE_READ_SIZE)
+            if not chunk:
+                break
+            *paths, pending = (pending + chunk).split(b"\0")
+            yield from paths
+        if pending:
+            yield pending
+
+
+def display_path(path):
+    return path.decode("utf-8", errors="backslashreplace")
+
+
+def format_path_counts(label, counts):
+    groups = [
+        f"{display_path(name)} ({count})"
+        for name, count in counts.most_common(COMMIT_MESSAGE_MAX_GROUPS)
+    ]
+    if len(counts) > COMMIT_MESSAGE_MAX_GROUPS:
+        groups.append(f"{len(counts) - COMMIT_MESSAGE_MAX_GROUPS} more")
+    return f"{label}: {', '.join(groups)}"
+
+
+def generate_commit_message(ctx, diff_arguments=("--cached",)):
+    names = []
+    file_count = 0
+    directory_counts = Counter()
+    extension_counts = Counter()
+    for path in diff_paths(ctx, diff_arguments):
+        if path.startswith(b".") or b"/." in path:
+            continue
+        file_count += 1
+        directory, _separator, name = path.rpartition(b"/")
+        if len(names) < COMMIT_MESSAGE_MAX_NAMES:
+            names.append(display_path(name))
+        directory_counts[directory.split(b"/", 1)[0] if directory else b"."] += 1
+        extension_counts[os.path.splitext(name)[1] or b"(none)"] += 1
+
+    if not names:
+        return "Commit involves changes in hidden files or directories only"
+
+    commit_message_lines = names
+    if file_count > len(names):
+        commit_message_lines.extend(
+            [
+                f"... and {file_count - len(names)} more files",
+                format_path_counts("Directories", directory_counts),
+                format_path_counts("Extensions", extension_counts),
+            ]
+        )
+    return "\n".join(commit_message_lines)
 
 
 def append_error_to_inbox(message, repoAbsPath):
@@ -133,24 +351,126 @@ def command_failure_message(command, returncode, stdout="", stderr=""):
     return "\n".join(message_parts)
 
 
-def called_process_error_message(error):
-    return command_failure_message(
-        error.cmd,
-        error.returncode,
-        error.stdout or "",
-        error.stderr or "",
+command_trace = None
+
+
+def start_command_trace():
+    global command_trace
+    command_trace = []
+
+
+def output_size(output):
+    if output is None:
+        return 0
+    return len(output.encode() if isinstance(output, str) else output)
+
+
+def record_trace_event(category, name, started_at, finished_at, details):
+    if command_trace is None:
+        return
+    command_trace.append(
+        {
+            "category": category,
+            "name": name,
+            "start": started_at,
+            "end": finished_at,
+            "thread": threading.current_thread().name,
+            "args": details,
+        }
+    )
+
+
+def run_command(command, **kwargs):
+    if command_trace is None:
+        return subprocess.run(command, **kwargs)
+
+    started_at = time.time()
+    returncode = None
+    stdout = stderr = None
+    try:
+        result = subprocess.run(command, **kwargs)
+        returncode, stdout, stderr = result.returncode, result.stdout, result.stderr
+        return result
+    except subprocess.TimeoutExpired as error:
+        stdout, stderr = error.stdout, error.stderr
+        raise
+    finally:
+        record_trace_event(
+            "command",
+            " ".join(str(part) for part in command[:2]),
+            started_at,
+            time.time(),
+            {
+                "argv": [str(part) for part in command],
+                "cwd": str(kwargs.get("cwd") or os.getcwd()),
+                "returncode": returncode,
+                "stdout_bytes": output_size(stdout),
+                "stderr_bytes": output_size(stderr),
+            },
+        )
+
+
+def record_repo_trace(ctx, outcome, started_at, finished_at):
+    if command_trace is None:
+        return
+    record_trace_event("repo", ctx.path, started_at, finished_at, {"outcome": outcome})
+    for span in ctx.spans:
+        record_trace_event(
+            "phase",
+            span["phase"],
+            span["start"],
+            span["start"] + span["duration"],
+            {"repo": ctx.path},
+        )
+
+
+def write_chrome_trace(trace_path):
+    process_id = os.getpid()
+    thread_ids = {}
+    trace_events = []
+    for event in sorted(command_trace, key=lambda event: event["start"]):
+        thread_id = thread_ids.setdefault(event["thread"], len(thread_ids))
+        trace_events.append(
+            {
+                "name": event["name"],
+                "cat": event["category"],
+                "ph": "X",
+                "ts": event["start"] * 1e6,
+                "dur": (event["end"] - event["start"]) * 1e6,
+                "pid": process_id,
+                "tid": thread_id,
+                "args": event["args"],
+            }
+        )
+    trace_events.extend(
+        {
+            "name": "thread_name",
+            "ph": "M",
+            "pid": process_id,
+            "tid": thread_id,
+            "args": {"name": thread_name},
+        }
+        for thread_name, thread_id in thread_ids.items()
+    )
+    with open(trace_path, "w", encoding="utf-8") as trace_file:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, trace_file)
+
+    commands = [event for event in command_trace if event["category"] == "command"]
+    logger.info(
+        f"Wrote trace of {len(commands)} commands "
+        f"({sum(event['end'] - event['start'] for event in commands):.2f}s) to {trace_path}."
     )
 
 
-def run_checked(command, failure_message, repoAbsPath):
-    result = subprocess.run(command, capture_output=True, text=True)
+def run_checked(command, failure_message, ctx):
+    result = run_command(command, capture_output=True, text=True, cwd=ctx.path)
     if result.returncode != 0:
         failure_details = command_failure_message(
             command, result.returncode, result.stdout, result.stderr
         )
         exit_with_error(
             f"{failure_message}: {failure_details}",
-            repoAbsPath,
+            ctx.path,
         )
     return result
 
@@ -165,20 +485,30 @@ def is_gitguardian_dns_failure(result):
 
 def commit_with_dns_retry(
     commit_message,
-    repoAbsPath,
+    ctx,
     attempts=COMMIT_ATTEMPTS,
     retry_delay_seconds=COMMIT_RETRY_DELAY_SECONDS,
+    squashable=True,
 ):
     command = ["git", "commit", "-m", commit_message]
+    # Commits with a user-written message are not marked, so
+    # --squash-auto-commits never replaces that message.
+    if squashable:
+        command.extend(
+            ["--trailer", f"{AUTO_COMMIT_TRAILER_KEY}: {AUTO_COMMIT_TRAILER_VALUE}"]
+        )
     for attempt in range(1, attempts + 1):
-        result = subprocess.run(command, capture_output=True, text=True)
+        with timed_phase(ctx, "commit_attempt"):
+            result = run_command(
+                command, capture_output=True, text=True, cwd=ctx.path
+            )
         if result.returncode == 0:
             return result
         if not is_gitguardian_dns_failure(result) or attempt == attempts:
             failure_details = command_failure_message(
                 command, result.returncode, result.stdout, result.stderr
             )
-            exit_with_error(f"Commit failed: {failure_details}", repoAbsPath)
+            exit_with_error(f"Commit failed: {failure_details}", ctx.path)
 
         logger.warning(
             "GitGuardian DNS resolution failed during commit "
@@ -189,9 +519,9 @@ def commit_with_dns_retry(
     raise AssertionError("Commit retry loop exited unexpectedly")
 
 
-def acquire_auto_commit_lock(repoAbsPath):
+def acquire_auto_commit_lock(ctx):
     lock_file = open(
-        os.path.join(git_dir_path(repoAbsPath), AUTO_COMMIT_LOCK_FILENAME),
+        os.path.join(ctx.git_dir, AUTO_COMMIT_LOCK_FILENAME),
         "w",
         encoding="utf-8",
     )
@@ -199,51 +529,88 @@ def acquire_auto_commit_lock(repoAbsPath):
         fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
     except BlockingIOError:
         logger.warning(
-            f"Another git auto-commit is running in repo {repoAbsPath}. Waiting."
+            f"Another git auto-commit is running in repo {ctx.path}. Waiting."
         )
         fcntl.flock(lock_file, fcntl.LOCK_EX)
     return lock_file
 
 
-def auto_commit_state_path(repoAbsPath):
-    return os.path.join(git_dir_path(repoAbsPath), AUTO_COMMIT_STATE_FILENAME)
+def auto_commit_state_path(ctx):
+    return os.path.join(ctx.git_dir, AUTO_COMMIT_STATE_FILENAME)
 
 
-def auto_commit_pause_path(repoAbsPath):
-    return os.path.join(git_dir_path(repoAbsPath), AUTO_COMMIT_PAUSE_FILENAME)
+def auto_commit_pause_path(ctx):
+    return os.path.join(ctx.git_dir, AUTO_COMMIT_PAUSE_FILENAME)
 
 
-def auto_commit_pause_remaining_seconds(repoAbsPath):
+def auto_commit_pause_remaining_seconds(ctx):
     try:
-        created_at = os.path.getmtime(auto_commit_pause_path(repoAbsPath))
+        created_at = os.path.getmtime(auto_commit_pause_path(ctx))
     except FileNotFoundError:
         return None
     return max(0, AUTO_COMMIT_PAUSE_SECONDS - (time.time() - created_at))
 
 
-def clear_auto_commit_pause(repoAbsPath):
+def clear_auto_commit_pause(ctx):
     try:
-        os.remove(auto_commit_pause_path(repoAbsPath))
+        os.remove(auto_commit_pause_path(ctx))
     except FileNotFoundError:
         return
-    logger.info(f"Removed expired auto-commit pause in repo {repoAbsPath}.")
+    logger.info(f"Removed expired auto-commit pause in repo {ctx.path}.")
 
 
-def mark_auto_commit_started(repoAbsPath):
-    state_path = auto_commit_state_path(repoAbsPath)
+def mark_auto_commit_started(ctx):
+    state_path = auto_commit_state_path(ctx)
     with open(state_path, "w", encoding="utf-8") as state_file:
         state_file.write(f"pid={os.getpid()}\nstarted_at={time.time()}\n")
 
 
-def clear_auto_commit_state(repoAbsPath):
+def clear_auto_commit_state(ctx):
     try:
-        os.remove(auto_commit_state_path(repoAbsPath))
+        os.remove(auto_commit_state_path(ctx))
     except FileNotFoundError:
         pass
 
 
-def has_staged_changes():
-    result = subprocess.run(["git", "diff", "--cached", "--quiet", "--"])
+def stage_changes(ctx):
+    unstaged_paths = ctx.state.unstaged_paths
+    if (
+        os.path.realpath(ctx.worktree_root) != ctx.real_path
+        or len(unstaged_paths) > STAGE_PATHSPEC_LIMIT
+    ):
+        run_checked(["git", "add", "."], "Git add failed", ctx)
+        return
+    if not unstaged_paths:
+        return
+
+    result = run_command(
+        [
+            "git",
+            "--literal-pathspecs",
+            "add",
+            "--pathspec-from-file=-",
+            "--pathspec-file-nul",
+        ],
+        input=b"\0".join(os.fsencode(unstaged_path) for unstaged_path in unstaged_paths),
+        capture_output=True,
+        cwd=ctx.path,
+    )
+    if result.returncode != 0:
+        logger.warning(
+            f"Staging the {len(unstaged_paths)} changed paths failed in repo {ctx.path}; "
+            "falling back to git add .: "
+            + command_failure_message(
+                result.args,
+                result.returncode,
+                os.fsdecode(result.stdout),
+                os.fsdecode(result.stderr),
+            )
+        )
+        run_checked(["git", "add", "."], "Git add failed", ctx)
+
+
+def has_staged_changes(ctx):
+    result = run_command(["git", "diff", "--cached", "--quiet", "--"], cwd=ctx.path)
     if result.returncode == 0:
         return False
     if result.returncode == 1:
@@ -251,97 +618,251 @@ def has_staged_changes():
     raise subprocess.CalledProcessError(result.returncode, result.args)
 
 
-def staged_diff_snapshot():
-    result = subprocess.run(
-        ["git", "diff", "--cached", "--binary"],
-        capture_output=True,
-        check=True,
-    )
-    return result.stdout
+def staged_tree_snapshot(ctx):
+    # git write-tree takes index.lock, which would make a concurrent
+    # git add or commit fail, so it runs against a private copy of the index.
+    with tempfile.TemporaryDirectory(prefix="git-auto-index-") as index_directory:
+        index_copy_path = os.path.join(index_directory, "index")
+        try:
+            shutil.copyfile(os.path.join(ctx.git_dir, "index"), index_copy_path)
+        except FileNotFoundError:
+            pass
+        result = run_command(
+            ["git", "write-tree"],
+            capture_output=True,
+            text=True,
+            cwd=ctx.path,
+            env={**os.environ, "GIT_INDEX_FILE": index_copy_path},
+        )
+    if result.returncode == 0:
+        return result.stdout.strip()
+    return index_checksum_snapshot(ctx)
+
+
+def index_checksum_snapshot(ctx):
+    index_path = os.path.join(ctx.git_dir, "index")
+    with open(index_path, "rb") as index_file:
+        index_file.seek(-min(32, os.fstat(index_file.fileno()).st_size), os.SEEK_END)
+        index_checksum = index_file.read().hex()
+    return index_checksum, stat_signature(index_path)
 
 
-def process_is_git_in_repo(pid, repoAbsPath):
+def process_is_git_in_repo(pid, ctx):
     if pid == os.getpid():
         return False
 
     proc_path = f"/proc/{pid}"
     try:
-        with open(os.path.join(proc_path, "cmdline"), "rb") as cmdline_file:
-            command_parts = [
-                part.decode(errors="replace")
-                for part in cmdline_file.read().split(b"\0")
-                if part
-            ]
+        with open(os.path.join(proc_path, "comm"), "rb") as comm_file:
+            if comm_file.read().strip() != b"git":
+                return False
         process_cwd = os.path.realpath(os.readlink(os.path.join(proc_path, "cwd")))
-    except (FileNotFoundError, ProcessLookupError, PermissionError, OSError):
-        return False
-
-    if not command_parts:
-        return False
-
-    executable_name = os.path.basename(command_parts[0])
-    if executable_name != "git":
+    except OSError:
         return False
 
-    repo_real_path = os.path.realpath(repoAbsPath)
-    git_real_path = os.path.realpath(git_dir_path(repoAbsPath))
-    return process_cwd == repo_real_path or process_cwd.startswith(
-        repo_real_path + os.sep
-    ) or process_cwd == git_real_path or process_cwd.startswith(git_real_path + os.sep)
+    return process_cwd == ctx.real_path or process_cwd.startswith(
+        ctx.real_path + os.sep
+    ) or process_cwd == ctx.real_git_dir or process_cwd.startswith(
+        ctx.real_git_dir + os.sep
+    )
 
 
-def git_processes_in_repo(repoAbsPath):
+def git_processes_in_repo(ctx):
     pids = []
     for pid_name in os.listdir("/proc"):
         if not pid_name.isdigit():
             continue
         pid = int(pid_name)
-        if process_is_git_in_repo(pid, repoAbsPath):
+        if process_is_git_in_repo(pid, ctx):
             pids.append(pid)
     return pids
 
 
-def upstream_name():
-    result = subprocess.run(
-        ["git", "rev-parse", "--abbrev-ref", "--symbolic-full-name", "@{u}"],
-        capture_output=True,
-        text=True,
+@contextmanager
+def timed_phase(ctx, phase):
+    started_at = time.time()
+    started_monotonic = time.monotonic()
+    try:
+        yield
+    finally:
+        duration = time.monotonic() - started_monotonic
+        ctx.phase_durations[phase] = ctx.phase_durations.get(phase, 0) + duration
+        ctx.spans.append({"phase": phase, "start": started_at, "duration": duration})
+
+
+@dataclass(frozen=True)
+class RepoState:
+    branch: str | None
+    upstream: str | None
+    ahead: int
+    behind: int
+    changed_paths: tuple[str, ...]
+    unstaged_paths: tuple[str, ...]
+
+
+def parse_status_porcelain_v2(output):
+    branch = None
+    upstream = None
+    divergence = None
+    changed_paths = []
+    unstaged_paths = []
+    records = iter(output.split(b"\0"))
+    for record in records:
+        if not record:
+            continue
+        if record.startswith(b"# "):
+            header_name, _separator, header_value = (
+                os.fsdecode(record[2:]).partition(" ")
+            )
+            if header_name == "branch.head" and header_value != "(detached)":
+                branch = header_value
+            elif header_name == "branch.upstream":
+                upstream = header_value
+            elif header_name == "branch.ab":
+                ahead, behind = header_value.split()
+                divergence = (int(ahead), -int(behind))
+            continue
+
+        entry_type = record[:1]
+        # The second XY column is the worktree side; "." means the change is
+        # already staged and there is nothing for git add to pick up.
+        worktree_changed = record[3:4] != b"."
+        if entry_type == b"1":
+            path = os.fsdecode(record.split(b" ", 8)[8])
+            changed_paths.append(path)
+            if worktree_changed:
+                unstaged_paths.append(path)
+        elif entry_type == b"2":
+            path = os.fsdecode(record.split(b" ", 9)[9])
+            changed_paths.extend([path, os.fsdecode(next(records))])
+            if worktree_changed:
+                unstaged_paths.append(path)
+        elif entry_type == b"u":
+            path = os.fsdecode(record.split(b" ", 10)[10])
+            changed_paths.append(path)
+            unstaged_paths.append(path)
+        elif entry_type == b"?":
+            path = os.fsdecode(record[2:])
+            changed_paths.append(path)
+            unstaged_paths.append(path)
+
+    if divergence is None:
+        upstream = None
+        divergence = (0, 0)
+    return RepoState(
+        branch, upstream, *divergence, tuple(changed_paths), tuple(unstaged_paths)
     )
-    if result.returncode != 0:
-        return None
-    return result.stdout.strip()
 
 
-def push_remote_name(repoAbsPath):
-    push_ref_result = subprocess.run(
-        [
-            "git",
-            "rev-parse",
-            "--abbrev-ref",
-            "--symbolic-full-name",
-            "@{push}",
-        ],
+def read_repo_state(ctx):
+    result = run_command(
+        ["git", "status", "--porcelain=v2", "--branch", "-z"],
         capture_output=True,
-        text=True,
+        cwd=ctx.path,
     )
-    if push_ref_result.returncode == 0:
-        return push_ref_result.stdout.strip().split("/", 1)[0]
+    if result.returncode != 0:
+        exit_with_error(
+            "Could not inspect repository state: "
+            + command_failure_message(
+                result.args,
+                result.returncode,
+                os.fsdecode(result.stdout),
+                os.fsdecode(result.stderr),
+            ),
+            ctx.path,
+        )
+    return parse_status_porcelain_v2(result.stdout)
 
-    push_default_result = subprocess.run(
-        ["git", "config", "--get", "remote.pushDefault"],
-        capture_output=True,
-        text=True,
+
+def parse_git_config_list(output):
+    git_config = {}
+    for entry in output.split("\0"):
+        if entry:
+            key, _separator, value = entry.partition("\n")
+            git_config.setdefault(key, []).append(value)
+    return git_config
+
+
+def read_git_config(ctx):
+    return parse_git_config_list(
+        run_checked(
+            ["git", "config", "-z", "--list"],
+            "Could not read Git configuration",
+            ctx,
+        ).stdout
     )
-    return push_default_result.stdout.strip() or "origin"
 
 
-def remote_push_url(remote_name, repoAbsPath):
+def first_config_value(git_config, key):
+    values = git_config.get(key)
+    return values[0] if values else None
+
+
+def last_config_value(git_config, key):
+    values = git_config.get(key)
+    return values[-1] if values else None
+
+
+def config_is_true(git_config, key):
+    value = last_config_value(git_config, key)
+    return value is not None and value.lower() in ("", "true", "yes", "on", "1")
+
+
+def upstream_name(repo_state):
+    return repo_state.upstream
+
+
+def push_remote_name(branch, git_config):
+    branch_keys = (
+        [f"branch.{branch}.pushremote", "remote.pushdefault", f"branch.{branch}.remote"]
+        if branch
+        else ["remote.pushdefault"]
+    )
+    for key in branch_keys:
+        remote_name = last_config_value(git_config, key)
+        if remote_name:
+            return remote_name
+    return "origin"
+
+
+def rewrite_remote_url(url, git_config, for_push):
+    rewrite_suffixes = (".pushinsteadof", ".insteadof") if for_push else (".insteadof",)
+    for rewrite_suffix in rewrite_suffixes:
+        longest_prefix = ""
+        replacement_base = None
+        for key, prefixes in git_config.items():
+            if not (key.startswith("url.") and key.endswith(rewrite_suffix)):
+                continue
+            for prefix in prefixes:
+                if url.startswith(prefix) and len(prefix) > len(longest_prefix):
+                    longest_prefix = prefix
+                    replacement_base = key[len("url.") : -len(rewrite_suffix)]
+        if replacement_base is not None:
+            return replacement_base + url[len(longest_prefix) :]
+    return url
+
+
+def configured_push_url(remote_name, git_config):
+    # Like git remote get-url --push, report the first of several push URLs.
+    push_url = first_config_value(git_config, f"remote.{remote_name}.pushurl")
+    if push_url:
+        return rewrite_remote_url(push_url, git_config, for_push=False)
+    fetch_url = last_config_value(git_config, f"remote.{remote_name}.url")
+    if fetch_url:
+        return rewrite_remote_url(fetch_url, git_config, for_push=True)
+    return None
+
+
+def remote_push_url(remote_name, git_config, ctx):
     if remote_name == ".":
-        return repoAbsPath
+        return ctx.path
+    push_url = configured_push_url(remote_name, git_config)
+    if push_url:
+        return push_url
     return run_checked(
         ["git", "remote", "get-url", "--push", remote_name],
         f"Could not resolve push URL for remote {remote_name}",
-        repoAbsPath,
+        ctx,
     ).stdout.strip()
 
 
@@ -351,43 +872,323 @@ def remote_requires_internet(push_url):
     )
 
 
-def remote_has_internet_connectivity(push_url, repoAbsPath):
-    if not remote_requires_internet(push_url):
-        return True
+def connectivity_backend():
+    if CONNECTIVITY_BACKEND != "auto":
+        return CONNECTIVITY_BACKEND
+    return "dbus" if shutil.which("busctl") else "nmcli"
+
 
-    command = ["nmcli", "-g", "CONNECTIVITY", "general"]
+def query_connectivity_command(command, parse_state):
     try:
-        result = subprocess.run(command, capture_output=True, text=True)
+        result = run_command(command, capture_output=True, text=True)
     except OSError as error:
-        logger.warning(
-            "Skipping network Git operations because NetworkManager connectivity "
-            f"could not be checked: {error} in repo {repoAbsPath}."
-        )
-        return False
+        return None, f"could not be checked: {error}"
 
-    connectivity_state = result.stdout.strip()
+    connectivity_state = parse_state(result.stdout.strip())
     if result.returncode != 0 or not connectivity_state:
+        return None, (
+            "could not be determined: "
+            + command_failure_message(
+                command, result.returncode, result.stdout, result.stderr
+            )
+        )
+    return connectivity_state, None
+
+
+def networkmanager_dbus_state(property_output):
+    value_type, _separator, value = property_output.partition(" ")
+    if value_type != "u" or not value.isdigit():
+        return None
+    return NETWORKMANAGER_CONNECTIVITY_STATES.get(int(value))
+
+
+def query_connectivity(backend):
+    if backend == "dbus":
+        return query_connectivity_command(
+            [
+                "busctl",
+                "--system",
+                "get-property",
+                NETWORKMANAGER_DBUS_NAME,
+                NETWORKMANAGER_DBUS_PATH,
+                NETWORKMANAGER_DBUS_NAME,
+                "Connectivity",
+            ],
+            networkmanager_dbus_state,
+        )
+    if backend == "nmcli":
+        return query_connectivity_command(
+            ["nmcli", "-g", "CONNECTIVITY", "general"], lambda state: state
+        )
+    if backend == "stub":
+        stub_state = os.environ.get("GIT_AUTO_CONNECTIVITY_STUB", "").strip()
+        if not stub_state:
+            return None, "could not be determined: GIT_AUTO_CONNECTIVITY_STUB is not set"
+        return stub_state, None
+    return None, f"could not be checked: unknown connectivity backend {backend!r}"
+
+
+def connectivity_cache_path():
+    return STATE_DIR / CONNECTIVITY_CACHE_FILENAME
+
+
+def shared_connectivity_state():
+    backend = connectivity_backend()
+    cache_path = connectivity_cache_path()
+    with locked_state_file(cache_path):
+        cached_state = read_json_state(cache_path)
+        if (
+            cached_state.get("backend") == backend
+            and 0
+            <= time.time() - cached_state.get("checked_at", 0)
+            < CONNECTIVITY_CACHE_SECONDS
+        ):
+            return cached_state["state"], None
+
+        connectivity_state, problem = query_connectivity(backend)
+        if connectivity_state is not None:
+            write_json_state(
+                cache_path,
+                {
+                    "backend": backend,
+                    "checked_at": time.time(),
+                    "state": connectivity_state,
+                },
+            )
+    return connectivity_state, problem
+
+
+def forget_connectivity_state():
+    cache_path = connectivity_cache_path()
+    with locked_state_file(cache_path):
+        try:
+            os.remove(cache_path)
+        except FileNotFoundError:
+            pass
+
+
+def remote_has_internet_connectivity(push_url, ctx):
+    if not remote_requires_internet(push_url):
+        return True
+
+    connectivity_state, problem = shared_connectivity_state()
+    if connectivity_state is None:
         logger.warning(
             "Skipping network Git operations because NetworkManager connectivity "
-            f"could not be determined: {command_failure_message(command, result.returncode, result.stdout, result.stderr)} "
-            f"in repo {repoAbsPath}."
+            f"{problem} in repo {ctx.path}."
         )
         return False
     if connectivity_state != NETWORKMANAGER_CONNECTED_STATE:
         logger.info(
             "Skipping network Git operations because NetworkManager reports "
-            f"{connectivity_state} internet connectivity in repo {repoAbsPath}."
+            f"{connectivity_state} internet connectivity in repo {ctx.path}."
+        )
+        return False
+    return True
+
+
+class RemoteHostUnavailable(Exception):
+    def __init__(self, host, details):
+        super().__init__(f"remote host {host} is unreachable: {details}")
+        self.host = host
+        self.details = details
+
+
+class NetworkGitTimeout(Exception):
+    pass
+
+
+def remote_host(push_url):
+    if not remote_requires_internet(push_url):
+        return None
+    if "://" in push_url:
+        return urllib.parse.urlsplit(push_url).hostname
+    if "::" in push_url:
+        return None
+    return push_url.split(":", 1)[0].rpartition("@")[2].lower() or None
+
+
+def host_health_path():
+    return STATE_DIR / HOST_HEALTH_FILENAME
+
+
+def host_cooldown_remaining_seconds(host, now=None):
+    health_path = host_health_path()
+    with locked_state_file(health_path):
+        host_health = read_json_state(health_path).get(host)
+    if not host_health or host_health["failures"] < HOST_FAILURE_THRESHOLD:
+        return 0
+    now = time.time() if now is None else now
+    return max(0, host_health["failed_at"] + HOST_COOLDOWN_SECONDS - now)
+
+
+def record_host_failure(host):
+    health_path = host_health_path()
+    with locked_state_file(health_path):
+        host_states = read_json_state(health_path)
+        failures = host_states.get(host, {}).get("failures", 0) + 1
+        host_states[host] = {"failures": failures, "failed_at": time.time()}
+        write_json_state(health_path, host_states)
+    if failures == HOST_FAILURE_THRESHOLD:
+        logger.warning(
+            f"Remote host {host} failed {failures} times in a row; skipping it for "
+            f"{HOST_COOLDOWN_SECONDS / 60:.0f} minutes."
+        )
+
+
+def record_host_success(host):
+    health_path = host_health_path()
+    with locked_state_file(health_path):
+        host_states = read_json_state(health_path)
+        if host_states.pop(host, None) is not None:
+            write_json_state(health_path, host_states)
+
+
+def remote_host_is_available(push_url, ctx):
+    host = remote_host(push_url)
+    if host is None:
+        return True
+
+    cooldown_remaining_seconds = host_cooldown_remaining_seconds(host)
+    if cooldown_remaining_seconds > 0:
+        logger.info(
+            f"Skipping network Git operations because remote host {host} is "
+            f"unreachable; retrying in {cooldown_remaining_seconds:.0f}s in repo {ctx.path}."
         )
         return False
     return True
 
 
-def remote_permission_cache_path(repoAbsPath):
-    return Path(git_dir_path(repoAbsPath)) / REMOTE_PERMISSION_CACHE_FILENAME
+def ssh_multiplexing_environment(control_directory, git_config):
+    if (
+        control_directory is None
+        or "GIT_SSH_COMMAND" in os.environ
+        or "GIT_SSH" in os.environ
+        or last_config_value(git_config, "core.sshcommand")
+    ):
+        return None
+    return {
+        **os.environ,
+        "GIT_SSH_COMMAND": shlex.join(
+            [
+                "ssh",
+                "-o",
+                "ControlMaster=auto",
+                "-o",
+                f"ControlPath={control_directory}/%C",
+                "-o",
+                f"ControlPersist={SSH_CONTROL_PERSIST_SECONDS}",
+            ]
+        ),
+    }
+
+
+@contextmanager
+def ssh_connection_pool():
+    control_directory = tempfile.mkdtemp(prefix="git-auto-ssh-")
+    try:
+        yield control_directory
+    finally:
+        wait_for_remote_permission_refreshes(PERMISSION_PROBE_TIMEOUT_SECONDS)
+        close_ssh_connection_pool(control_directory)
+
+
+def close_ssh_connection_pool(control_directory):
+    for socket_name in os.listdir(control_directory):
+        try:
+            run_command(
+                [
+                    "ssh",
+                    "-o",
+                    f"ControlPath={os.path.join(control_directory, socket_name)}",
+                    "-O",
+                    "exit",
+                    "git-auto",
+                ],
+                capture_output=True,
+                timeout=10,
+            )
+        except (OSError, subprocess.TimeoutExpired) as error:
+            logger.warning(f"Could not close shared SSH connection {socket_name}: {error}")
+    shutil.rmtree(control_directory, ignore_errors=True)
+
+
+def remote_was_unreachable(result):
+    output = f"{result.stdout}\n{result.stderr}".lower()
+    return any(message in output for message in UNREACHABLE_REMOTE_MESSAGES)
+
+
+def run_network_git(command, timeout_seconds, ctx):
+    host = remote_host(ctx.push_url)
+    try:
+        result = run_command(
+            command,
+            capture_output=True,
+            text=True,
+            cwd=ctx.path,
+            env=ctx.network_environment,
+            timeout=timeout_seconds,
+        )
+    except subprocess.TimeoutExpired as error:
+        timeout_details = f"{shlex.join(command)} timed out after {timeout_seconds}s"
+        if host is None:
+            raise NetworkGitTimeout(timeout_details) from error
+        record_host_failure(host)
+        raise RemoteHostUnavailable(host, timeout_details) from error
+
+    if host is not None:
+        if result.returncode != 0 and remote_was_unreachable(result):
+            record_host_failure(host)
+            raise RemoteHostUnavailable(host, push_failure_message(result))
+        record_host_success(host)
+    return result
+
+
+def remote_permission_cache_path():
+    return STATE_DIR / REMOTE_PERMISSIONS_FILENAME
+
+
+def remote_permission_key(push_url):
+    return hashlib.sha256(push_url.encode()).hexdigest()
+
+
+def remote_permission_expired(entry, now=None):
+    now = time.time() if now is None else now
+    cache_seconds = (
+        REMOTE_WRITABLE_CACHE_SECONDS
+        if entry["writable"]
+        else REMOTE_READ_ONLY_CACHE_SECONDS
+    )
+    return not 0 <= now - entry["checked_at"] < cache_seconds
+
+
+def read_remote_permissions():
+    cache_path = remote_permission_cache_path()
+    with locked_state_file(cache_path):
+        return read_json_state(cache_path)
 
 
-def cached_remote_write_permission(push_url, repoAbsPath):
-    cache_path = remote_permission_cache_path(repoAbsPath)
+def cached_remote_write_permission(push_url, ctx):
+    entry = read_remote_permissions().get(remote_permission_key(push_url))
+    if entry is None:
+        entry = migrate_legacy_remote_permission(push_url, ctx)
+    if entry is None:
+        return None, False
+    return entry["writable"], remote_permission_expired(entry)
+
+
+def migrate_legacy_remote_permission(push_url, ctx):
+    legacy_cache_path = Path(ctx.git_dir) / REMOTE_PERMISSION_CACHE_FILENAME
+    writable = read_legacy_remote_permission_cache(legacy_cache_path, push_url)
+    if writable is None:
+        return None
+    checked_at = legacy_cache_path.stat().st_mtime
+    cache_remote_write_permission(push_url, writable, checked_at)
+    os.remove(legacy_cache_path)
+    return {"writable": writable, "checked_at": checked_at}
+
+
+def read_legacy_remote_permission_cache(cache_path, push_url):
     try:
         cached_url_hash, cached_permission = cache_path.read_text(
             encoding="utf-8"
@@ -397,7 +1198,7 @@ def cached_remote_write_permission(push_url, repoAbsPath):
     except ValueError as error:
         raise OSError(f"Invalid remote permission cache entry: {cache_path}") from error
 
-    if cached_url_hash != hashlib.sha256(push_url.encode()).hexdigest():
+    if cached_url_hash != remote_permission_key(push_url):
         return None
     if cached_permission == "writable":
         return True
@@ -406,12 +1207,101 @@ def cached_remote_write_permission(push_url, repoAbsPath):
     raise OSError(f"Invalid remote permission cache entry: {cache_path}")
 
 
-def cache_remote_write_permission(push_url, repoAbsPath, writable):
-    cache_path = remote_permission_cache_path(repoAbsPath)
-    push_url_hash = hashlib.sha256(push_url.encode()).hexdigest()
-    cache_path.write_text(
-        f"{push_url_hash} {'writable' if writable else 'read-only'}\n",
-        encoding="utf-8",
+def cache_remote_write_permission(push_url, writable, checked_at=None):
+    cache_path = remote_permission_cache_path()
+    with locked_state_file(cache_path):
+        permissions = read_json_state(cache_path)
+        permissions[remote_permission_key(push_url)] = {
+            "writable": writable,
+            "checked_at": time.time() if checked_at is None else checked_at,
+        }
+        write_json_state(cache_path, permissions)
+
+
+def claim_remote_permission_refresh(push_url):
+    cache_path = remote_permission_cache_path()
+    now = time.time()
+    with locked_state_file(cache_path):
+        permissions = read_json_state(cache_path)
+        entry = permissions.get(remote_permission_key(push_url))
+        if entry is None or (
+            0
+            <= now - entry.get("refreshing_at", 0)
+            < 2 * PERMISSION_PROBE_TIMEOUT_SECONDS
+        ):
+            return False
+        entry["refreshing_at"] = now
+        write_json_state(cache_path, permissions)
+    return True
+
+
+remote_permission_refreshes = []
+remote_permission_refreshes_lock = threading.Lock()
+
+
+def start_remote_permission_refresh(ctx):
+    if not claim_remote_permission_refresh(ctx.push_url):
+        return
+    # Daemon threads so a refresh that outlives its join timeout cannot keep
+    # the process alive after the run has finished.
+    refresh = threading.Thread(
+        target=refresh_remote_write_permission,
+        args=(ctx,),
+        name=f"git-auto-permission-refresh {ctx.path}",
+        daemon=True,
+    )
+    with remote_permission_refreshes_lock:
+        remote_permission_refreshes[:] = [
+            running_refresh
+            for running_refresh in remote_permission_refreshes
+            if running_refresh.is_alive()
+        ]
+        remote_permission_refreshes.append(refresh)
+    refresh.start()
+
+
+def wait_for_remote_permission_refreshes(timeout_seconds=None):
+    with remote_permission_refreshes_lock:
+        refreshes = remote_permission_refreshes[:]
+        remote_permission_refreshes.clear()
+    running_refreshes = [refresh for refresh in refreshes if refresh.is_alive()]
+    if not running_refreshes:
+        return
+    logger.info(
+        f"Waiting for {len(running_refreshes)} background remote permission refreshes."
+    )
+    deadline = None if timeout_seconds is None else time.monotonic() + timeout_seconds
+    for refresh in running_refreshes:
+        refresh.join(
+            None if deadline is None else max(deadline - time.monotonic(), 0)
+        )
+    unfinished_refreshes = [
+        refresh for refresh in running_refreshes if refresh.is_alive()
+    ]
+    if unfinished_refreshes:
+        logger.warning(
+            f"Abandoning {len(unfinished_refreshes)} remote permission refreshes "
+            f"that did not finish within {timeout_seconds}s."
+        )
+
+
+def refresh_remote_write_permission(ctx):
+    try:
+        writable, result = probe_remote_write_permission(ctx)
+        if writable is None:
+            logger.warning(
+                f"Could not refresh write permission for remote {ctx.push_remote}: {push_failure_message(result)}"
+            )
+            return
+        cache_remote_write_permission(ctx.push_url, writable)
+    except (RemoteHostUnavailable, NetworkGitTimeout, OSError) as error:
+        logger.warning(
+            f"Could not refresh write permission for remote {ctx.push_remote}: {error}"
+        )
+        return
+    logger.info(
+        f"Refreshed cached write permission for remote {ctx.push_remote}: "
+        f"{'writable' if writable else 'read-only'}."
     )
 
 
@@ -428,88 +1318,222 @@ def push_permission_was_denied(result):
     ) or ("permission to " in output and " denied to " in output)
 
 
-def remote_allows_writes(remote_name, push_url, repoAbsPath):
-    try:
-        cached_permission = cached_remote_write_permission(push_url, repoAbsPath)
-    except OSError as error:
-        exit_with_error(f"Could not read remote permission cache: {error}", repoAbsPath)
-
-    if cached_permission is not None:
-        if not cached_permission:
-            logger.info(
-                f"Skipping auto-commit and push because remote {remote_name} is cached as read-only."
-            )
-        return cached_permission
-
+def probe_remote_write_permission(ctx):
     probe_ref = (
         "refs/heads/git-auto-permission-check/"
-        f"{hashlib.sha256(push_url.encode()).hexdigest()[:12]}"
+        f"{remote_permission_key(ctx.push_url)[:12]}"
     )
-    result = subprocess.run(
+    result = run_network_git(
         [
             "git",
             "push",
             "--dry-run",
             "--no-verify",
-            remote_name,
+            ctx.push_remote,
             f"HEAD:{probe_ref}",
         ],
-        capture_output=True,
-        text=True,
+        PERMISSION_PROBE_TIMEOUT_SECONDS,
+        ctx,
     )
     if result.returncode == 0:
-        writable = True
-    elif push_permission_was_denied(result):
-        writable = False
-    else:
+        return True, result
+    if push_permission_was_denied(result):
+        return False, result
+    return None, result
+
+
+def remote_allows_writes(ctx):
+    try:
+        cached_permission, cache_expired = cached_remote_write_permission(
+            ctx.push_url, ctx
+        )
+    except OSError as error:
+        exit_with_error(f"Could not read remote permission cache: {error}", ctx.path)
+
+    if cached_permission is not None:
+        if cache_expired:
+            start_remote_permission_refresh(ctx)
+        if not cached_permission:
+            logger.info(
+                f"Skipping auto-commit and push because remote {ctx.push_remote} is cached as read-only."
+            )
+        return cached_permission
+
+    writable, result = probe_remote_write_permission(ctx)
+    if writable is None:
         exit_with_error(
-            f"Could not verify write permission for remote {remote_name}: {push_failure_message(result)}",
-            repoAbsPath,
+            f"Could not verify write permission for remote {ctx.push_remote}: {push_failure_message(result)}",
+            ctx.path,
         )
 
     try:
-        cache_remote_write_permission(push_url, repoAbsPath, writable)
+        cache_remote_write_permission(ctx.push_url, writable)
     except OSError as error:
-        exit_with_error(f"Could not update remote permission cache: {error}", repoAbsPath)
+        exit_with_error(f"Could not update remote permission cache: {error}", ctx.path)
 
     if writable:
-        logger.info(f"Verified and cached write permission for remote {remote_name}.")
+        logger.info(f"Verified and cached write permission for remote {ctx.push_remote}.")
     else:
         logger.info(
-            f"Remote {remote_name} denied write permission; cached as read-only and skipping auto-commit and push."
+            f"Remote {ctx.push_remote} denied write permission; cached as read-only and skipping auto-commit and push."
         )
     return writable
 
 
-def upstream_ahead_count(upstream):
-    _local_ahead, upstream_ahead = branch_divergence(upstream)
+def upstream_ahead_count(ctx):
+    _local_ahead, upstream_ahead = branch_divergence(ctx)
     return upstream_ahead
 
 
-def branch_divergence(upstream):
-    result = subprocess.run(
-        ["git", "rev-list", "--left-right", "--count", f"HEAD...{upstream}"],
+def branch_divergence(ctx):
+    return ctx.state.ahead, ctx.state.behind
+
+
+def has_local_commits_to_push(ctx):
+    if not ctx.upstream:
+        return True
+
+    local_ahead, _upstream_ahead = branch_divergence(ctx)
+    return local_ahead > 0
+
+
+def oldest_local_commit_time(ctx):
+    result = run_checked(
+        ["git", "log", "--format=%ct", f"{ctx.upstream}..HEAD"],
+        "Could not inspect local commits",
+        ctx,
+    )
+    commit_times = result.stdout.split()
+    return int(commit_times[-1]) if commit_times else None
+
+
+def push_is_due(ctx, args):
+    args.push_deadlines.pop(ctx.path, None)
+    if args.flush or not (args.push_max_age or args.push_max_commits):
+        return True
+    if not has_local_commits_to_push(ctx) or not ctx.upstream:
+        return True
+
+    local_ahead, _upstream_ahead = branch_divergence(ctx)
+    if args.push_max_commits and local_ahead >= args.push_max_commits:
+        return True
+    if args.push_max_age:
+        oldest_commit_time = oldest_local_commit_time(ctx)
+        if oldest_commit_time is not None:
+            if time.time() - oldest_commit_time >= args.push_max_age:
+                return True
+            # Watch mode has no later run unless files change, so it reads
+            # this to come back when the age limit is reached.
+            args.push_deadlines[ctx.path] = oldest_commit_time + args.push_max_age
+
+    logger.info(
+        f"Deferring push of {local_ahead} local commits in repo {ctx.path} "
+        "until the push policy is met."
+    )
+    return False
+
+
+def push_tracking_ref(ctx):
+    result = run_command(
+        ["git", "rev-parse", "--verify", "--quiet", "--symbolic-full-name", "@{push}"],
         capture_output=True,
         text=True,
-        check=True,
+        cwd=ctx.path,
+    )
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip() or None
+
+
+def squashable_auto_commits(ctx):
+    if not ctx.upstream:
+        return []
+    pushed_refs = [ctx.upstream]
+    push_ref = push_tracking_ref(ctx)
+    if push_ref:
+        pushed_refs.append(push_ref)
+    elif ctx.push_remote != last_config_value(
+        ctx.git_config, f"branch.{ctx.state.branch}.remote"
+    ):
+        # Commits may already be on the push remote without being upstream,
+        # and squashing them would rewrite published history.
+        logger.info(
+            f"Not squashing auto-commits because what was pushed to remote "
+            f"{ctx.push_remote} is unknown in repo {ctx.path}."
+        )
+        return []
+    result = run_checked(
+        [
+            "git",
+            "log",
+            "-z",
+            f"--format=%H %P%n%(trailers:key={AUTO_COMMIT_TRAILER_KEY},valueonly)",
+            "HEAD",
+            "--not",
+            *pushed_refs,
+        ],
+        "Could not inspect local commits",
+        ctx,
     )
-    local_ahead, upstream_ahead = result.stdout.split()
-    return int(local_ahead), int(upstream_ahead)
+    # Only the newest unbroken run of auto-commits can be squashed without
+    # rewriting a hand-made commit on top of it.
+    commits = []
+    for record in result.stdout.split("\0"):
+        if not record:
+            break
+        commit_line, _newline, trailer_values = record.partition("\n")
+        commit, *parents = commit_line.split()
+        if len(parents) != 1 or AUTO_COMMIT_TRAILER_VALUE not in trailer_values.split("\n"):
+            break
+        commits.append((commit, parents[0]))
+    return commits
 
 
-def has_local_commits_to_push(repoAbsPath):
-    upstream = upstream_name()
-    if not upstream:
-        return True
+def squash_auto_commits(ctx):
+    commits = squashable_auto_commits(ctx)
+    if len(commits) < 2:
+        return
 
-    try:
-        local_ahead, _upstream_ahead = branch_divergence(upstream)
-    except subprocess.CalledProcessError as e:
-        exit_with_error(
-            f"Could not inspect local branch state: {called_process_error_message(e)}",
-            repoAbsPath,
+    head, base = commits[0][0], commits[-1][1]
+    result = run_checked(
+        [
+            "git",
+            "commit-tree",
+            f"{head}^{{tree}}",
+            "-p",
+            base,
+            "-m",
+            generate_commit_message(ctx, (base, head)),
+            "-m",
+            f"{AUTO_COMMIT_TRAILER_KEY}: {AUTO_COMMIT_TRAILER_VALUE}",
+        ],
+        "Could not create squashed auto-commit",
+        ctx,
+    )
+    update_result = run_command(
+        [
+            "git",
+            "update-ref",
+            "-m",
+            f"git-auto: squash {len(commits)} auto-commits",
+            "HEAD",
+            result.stdout.strip(),
+            head,
+        ],
+        capture_output=True,
+        text=True,
+        cwd=ctx.path,
+    )
+    ctx.invalidate()
+    if update_result.returncode != 0:
+        logger.warning(
+            f"Not squashing auto-commits in repo {ctx.path}: "
+            + push_failure_message(update_result)
         )
-    return local_ahead > 0
+        return
+    logger.info(
+        f"Squashed {len(commits)} unpushed auto-commits into one in repo {ctx.path}."
+    )
 
 
 def push_was_rejected_for_remote_updates(result):
@@ -530,127 +1554,455 @@ def push_failure_message(result):
     )
 
 
-def abort_rebase_details():
-    result = subprocess.run(
+def abort_rebase_details(ctx):
+    result = run_command(
         ["git", "rebase", "--abort"],
         capture_output=True,
         text=True,
+        cwd=ctx.path,
     )
     if result.returncode == 0:
         return "Rebase was aborted; local commits were left unapplied to the fetched upstream."
     return "Could not abort failed rebase:\n" + push_failure_message(result)
 
 
-def rebase_onto_upstream(repoAbsPath, upstream):
-    result = subprocess.run(
+@functools.cache
+def git_version():
+    result = run_command(["git", "version"], capture_output=True, text=True)
+    # Vendor builds append suffixes such as "(Apple Git-146)" after the version.
+    match = re.search(r"(\d+)\.(\d+)", result.stdout)
+    if match is None:
+        return ()
+    return tuple(int(part) for part in match.groups())
+
+
+def rebase_conflict_error(ctx, upstream, details):
+    exit_with_error(
+        f"Could not automatically rebase onto {upstream}; manual resolution required.\n{details}",
+        ctx.path,
+    )
+
+
+def replay_commit(ctx, commit, tree, parent):
+    author_name, author_email, author_date, message = run_checked(
+        ["git", "show", "-s", "--date=raw", "--format=%an%x00%ae%x00%ad%x00%B", commit],
+        f"Could not read commit {commit}",
+        ctx,
+    ).stdout.split("\0", 3)
+    result = run_command(
+        ["git", "commit-tree", tree, "-p", parent, "-F", "-"],
+        input=message.rstrip("\n") + "\n",
+        capture_output=True,
+        text=True,
+        cwd=ctx.path,
+        env={
+            **os.environ,
+            "GIT_AUTHOR_NAME": author_name,
+            "GIT_AUTHOR_EMAIL": author_email,
+            "GIT_AUTHOR_DATE": author_date,
+        },
+    )
+    if result.returncode != 0:
+        exit_with_error(
+            f"Could not replay commit {commit}: {push_failure_message(result)}",
+            ctx.path,
+        )
+    return result.stdout.strip()
+
+
+def replay_onto_upstream(ctx, upstream):
+    original_head = run_checked(
+        ["git", "rev-parse", "HEAD"], "Could not read HEAD", ctx
+    ).stdout.strip()
+    commits = run_checked(
+        [
+            "git",
+            "rev-list",
+            "--reverse",
+            "--topo-order",
+            "--right-only",
+            "--cherry-pick",
+            "--parents",
+            f"{upstream}...HEAD",
+        ],
+        "Could not list local commits to rebase",
+        ctx,
+    ).stdout.split("\n")
+    commits = [line.split() for line in commits if line]
+    if any(len(commit) != 2 for commit in commits):
+        logger.info(
+            f"Local commits include merges; rebasing in the worktree in repo {ctx.path}."
+        )
+        return False
+
+    new_head, new_tree = run_checked(
+        ["git", "rev-parse", f"{upstream}^{{commit}}", f"{upstream}^{{tree}}"],
+        f"Could not read {upstream}",
+        ctx,
+    ).stdout.split()
+    for commit, parent in commits:
+        merge = run_command(
+            [
+                "git",
+                "merge-tree",
+                "--write-tree",
+                f"--merge-base={parent}",
+                new_head,
+                commit,
+            ],
+            capture_output=True,
+            text=True,
+            cwd=ctx.path,
+        )
+        if merge.returncode == 1:
+            rebase_conflict_error(
+                ctx,
+                upstream,
+                f"{push_failure_message(merge)}\n"
+                "No changes were made; local commits were left unapplied to the fetched upstream.",
+            )
+        if merge.returncode != 0:
+            exit_with_error(
+                f"Could not replay commit {commit} onto {upstream}: {push_failure_message(merge)}",
+                ctx.path,
+            )
+        tree = merge.stdout.split("\n", 1)[0]
+        # Like git rebase, drop commits whose changes are already upstream.
+        if tree != new_tree:
+            new_head, new_tree = replay_commit(ctx, commit, tree, new_head), tree
+
+    current_head = run_checked(
+        ["git", "rev-parse", "HEAD"], "Could not read HEAD", ctx
+    ).stdout.strip()
+    if current_head != original_head:
+        exit_with_error(
+            f"HEAD moved while local commits were replayed onto {upstream}",
+            ctx.path,
+        )
+    # A single reset moves the branch and updates only the files that differ,
+    # keeping unrelated local edits.
+    result = run_command(
+        ["git", "reset", "--keep", new_head],
+        capture_output=True,
+        text=True,
+        cwd=ctx.path,
+        env={**os.environ, "GIT_REFLOG_ACTION": f"rebase (git-auto) onto {upstream}"},
+    )
+    ctx.invalidate()
+    if result.returncode != 0:
+        rebase_conflict_error(ctx, upstream, push_failure_message(result))
+    logger.info(
+        f"Replayed {len(commits)} local commits onto {upstream} in repo {ctx.path}."
+    )
+    return True
+
+
+def rebase_onto_upstream(ctx, upstream):
+    if git_version() >= MERGE_TREE_MERGE_BASE_GIT_VERSION and replay_onto_upstream(
+        ctx, upstream
+    ):
+        return
+
+    result = run_command(
         ["git", "rebase", upstream],
         capture_output=True,
         text=True,
+        cwd=ctx.path,
     )
+    ctx.invalidate()
     if result.returncode == 0:
-        logger.info(f"Rebased local commits onto {upstream} in repo {repoAbsPath}.")
+        logger.info(f"Rebased local commits onto {upstream} in repo {ctx.path}.")
         return
 
     rebase_failure = push_failure_message(result)
-    abort_details = abort_rebase_details()
-    exit_with_error(
-        f"Could not automatically rebase onto {upstream}; manual resolution required.\n{rebase_failure}\n{abort_details}",
-        repoAbsPath,
-    )
+    abort_details = abort_rebase_details(ctx)
+    rebase_conflict_error(ctx, upstream, f"{rebase_failure}\n{abort_details}")
+
+
+def reconcile_fetch_command(ctx):
+    branch = ctx.state.branch
+    remote_name = last_config_value(ctx.git_config, f"branch.{branch}.remote")
+    merge_ref = last_config_value(ctx.git_config, f"branch.{branch}.merge")
+    if not remote_name or remote_name == "." or not merge_ref:
+        return ["git", "fetch", "--quiet"]
+
+    # Fetching a single ref by name still updates its remote-tracking branch
+    # through the remote's configured fetch refspec.
+    command = ["git", "fetch", "--quiet", "--no-tags", "--negotiation-tip=HEAD"]
+    if config_is_true(ctx.git_config, f"remote.{remote_name}.promisor"):
+        partial_clone_filter = last_config_value(
+            ctx.git_config, f"remote.{remote_name}.partialclonefilter"
+        )
+        command.append(f"--filter={partial_clone_filter or 'blob:none'}")
+    return [*command, remote_name, merge_ref]
 
 
-def reconcile_remote_updates(repoAbsPath, push_result):
-    upstream = upstream_name()
+def reconcile_remote_updates(ctx, push_result):
+    upstream = ctx.upstream
     if not upstream:
         exit_with_error(
             f"Push failed and no upstream branch is configured: {push_failure_message(push_result)}",
-            repoAbsPath,
+            ctx.path,
         )
 
     logger.warning(
         f"Push was rejected because {upstream} changed. Fetching and rebasing local commits."
     )
-    run_checked(
-        ["git", "fetch", "--quiet"],
-        "Could not fetch upstream state after push rejection",
-        repoAbsPath,
+    fetch_result = run_network_git(
+        reconcile_fetch_command(ctx), FETCH_TIMEOUT_SECONDS, ctx
     )
+    if fetch_result.returncode != 0:
+        exit_with_error(
+            "Could not fetch upstream state after push rejection: "
+            + push_failure_message(fetch_result),
+            ctx.path,
+        )
 
-    try:
-        local_ahead, upstream_ahead = branch_divergence(upstream)
-    except subprocess.CalledProcessError as e:
+    ctx.invalidate()
+    if ctx.upstream != upstream:
         exit_with_error(
-            f"Could not inspect fetched upstream state: {called_process_error_message(e)}",
-            repoAbsPath,
+            f"Could not inspect fetched upstream state: {upstream} is no longer available",
+            ctx.path,
         )
+    local_ahead, upstream_ahead = branch_divergence(ctx)
 
     if upstream_ahead == 0:
         exit_with_error(
             f"Push was rejected, but fetched {upstream} is not ahead: {push_failure_message(push_result)}",
-            repoAbsPath,
+            ctx.path,
         )
     if local_ahead == 0:
         logger.info(
-            f"Fetched {upstream}; no local commits remain to push in repo {repoAbsPath}."
+            f"Fetched {upstream}; no local commits remain to push in repo {ctx.path}."
         )
         return
 
-    rebase_onto_upstream(repoAbsPath, upstream)
+    rebase_onto_upstream(ctx, upstream)
 
 
-def push_with_auto_reconcile(repoAbsPath, remote_name, push_url):
+def push_with_auto_reconcile(ctx):
     for reconcile_attempt in range(PUSH_RECONCILE_ATTEMPTS + 1):
-        result = subprocess.run(["git", "push"], capture_output=True, text=True)
+        with timed_phase(ctx, "push_attempt"):
+            result = run_network_git(["git", "push"], PUSH_TIMEOUT_SECONDS, ctx)
         if result.returncode == 0:
-            logger.info(f"Push successful in repo {repoAbsPath}.")
+            logger.info(f"Push successful in repo {ctx.path}.")
             return True
 
         if push_permission_was_denied(result):
             try:
-                cache_remote_write_permission(push_url, repoAbsPath, False)
+                cache_remote_write_permission(ctx.push_url, False)
             except OSError as error:
                 exit_with_error(
                     f"Push permission was denied and the remote permission cache could not be updated: {error}",
-                    repoAbsPath,
+                    ctx.path,
                 )
             logger.info(
-                f"Remote {remote_name} denied write permission; cached as read-only and leaving local commits unpushed."
+                f"Remote {ctx.push_remote} denied write permission; cached as read-only and leaving local commits unpushed."
             )
             return False
 
         if not push_was_rejected_for_remote_updates(result):
-            exit_with_error(f"Push failed: {push_failure_message(result)}", repoAbsPath)
+            exit_with_error(f"Push failed: {push_failure_message(result)}", ctx.path)
 
         if reconcile_attempt == PUSH_RECONCILE_ATTEMPTS:
             exit_with_error(
                 f"Push was repeatedly rejected after automatic reconciliation: {push_failure_message(result)}",
-                repoAbsPath,
+                ctx.path,
             )
 
-        reconcile_remote_updates(repoAbsPath, result)
+        with timed_phase(ctx, "reconcile"):
+            reconcile_remote_updates(ctx, result)
 
     raise AssertionError("Push reconciliation loop exited unexpectedly")
 
 
-def working_tree_has_changes(repoAbsPath):
-    result = run_checked(
-        ["git", "status", "--porcelain"],
-        "Could not inspect working tree",
-        repoAbsPath,
+def working_tree_has_changes(ctx):
+    return bool(ctx.state.changed_paths)
+
+
+def stat_signature(file_path):
+    try:
+        file_stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return [
+        file_stat.st_mtime_ns,
+        file_stat.st_ctime_ns,
+        file_stat.st_size,
+        file_stat.st_ino,
+    ]
+
+
+def git_state_signatures(git_dir, common_dir, upstream_ref):
+    head = read_text_or_none(os.path.join(git_dir, "HEAD"))
+    watched_paths = {
+        "HEAD": os.path.join(git_dir, "HEAD"),
+        "index": os.path.join(git_dir, "index"),
+        "packed-refs": os.path.join(common_dir, "packed-refs"),
+        "config": os.path.join(common_dir, "config"),
+        "upstream": os.path.join(common_dir, upstream_ref),
+    }
+    if head and head.startswith("ref: "):
+        watched_paths["branch"] = os.path.join(common_dir, head[5:].strip())
+    return {
+        "head": head,
+        **{name: stat_signature(file_path) for name, file_path in watched_paths.items()},
+    }
+
+
+def worktree_change_marker(worktree_root, directories):
+    latest_change_ns = 0
+    entry_count = 0
+    for relative_directory in directories:
+        directory_path = os.path.join(worktree_root, relative_directory)
+        try:
+            directory_stat = os.stat(directory_path)
+            with os.scandir(directory_path) as entries:
+                for entry in entries:
+                    if entry.name == ".git":
+                        continue
+                    entry_stat = entry.stat(follow_symlinks=False)
+                    latest_change_ns = max(
+                        latest_change_ns, entry_stat.st_mtime_ns, entry_stat.st_ctime_ns
+                    )
+                    entry_count += 1
+        except OSError:
+            return None
+        latest_change_ns = max(
+            latest_change_ns, directory_stat.st_mtime_ns, directory_stat.st_ctime_ns
+        )
+    return [latest_change_ns, entry_count]
+
+
+def worktree_directories(worktree_root, skip_nested_repos=False):
+    result = run_command(
+        [
+            "git",
+            "ls-files",
+            "-z",
+            "--others",
+            "--ignored",
+            "--exclude-standard",
+            "--directory",
+        ],
+        capture_output=True,
+        check=True,
+        cwd=worktree_root,
+    )
+    ignored_paths = {
+        os.fsdecode(ignored_path).rstrip("/")
+        for ignored_path in result.stdout.split(b"\0")
+        if ignored_path
+    }
+
+    directories = []
+    for directory_path, subdirectory_names, _file_names in os.walk(worktree_root):
+        relative_directory = os.path.relpath(directory_path, worktree_root)
+        if relative_directory == ".":
+            relative_directory = ""
+        elif os.path.lexists(os.path.join(directory_path, ".git")):
+            if not skip_nested_repos:
+                return None
+            subdirectory_names[:] = []
+            continue
+        directories.append(relative_directory)
+        subdirectory_names[:] = [
+            name
+            for name in subdirectory_names
+            if name != ".git"
+            and os.path.join(relative_directory, name) not in ignored_paths
+        ]
+    return directories
+
+
+def clean_fingerprint_matches(ctx):
+    stored_fingerprint = read_json_state(
+        Path(ctx.git_dir) / CLEAN_FINGERPRINT_FILENAME
+    )
+    if (
+        not isinstance(stored_fingerprint, dict)
+        or stored_fingerprint.get("version") != CLEAN_FINGERPRINT_VERSION
+    ):
+        return False
+
+    try:
+        return git_state_signatures(
+            ctx.git_dir, ctx.common_dir, stored_fingerprint["upstream_ref"]
+        ) == stored_fingerprint["git_state"] and worktree_change_marker(
+            ctx.worktree_root, stored_fingerprint["directories"]
+        ) == stored_fingerprint["worktree"]
+    except (KeyError, TypeError, ValueError):
+        logger.warning(f"Ignoring malformed clean fingerprint in repo {ctx.path}.")
+        return False
+
+
+def store_clean_fingerprint(ctx, status_started_ns):
+    upstream_result = run_command(
+        ["git", "rev-parse", "--symbolic-full-name", "@{u}"],
+        capture_output=True,
+        text=True,
+        cwd=ctx.path,
     )
-    return bool(result.stdout)
+    upstream_ref = upstream_result.stdout.strip()
+    if upstream_result.returncode != 0 or not upstream_ref:
+        return
+
+    try:
+        directories = worktree_directories(ctx.worktree_root)
+        if directories is None:
+            return
+        worktree_marker = worktree_change_marker(ctx.worktree_root, directories)
+        racy_after_ns = status_started_ns - CLEAN_FINGERPRINT_RACY_SECONDS * 10**9
+        if worktree_marker is None or worktree_marker[0] >= racy_after_ns:
+            return
+        write_json_state(
+            Path(ctx.git_dir) / CLEAN_FINGERPRINT_FILENAME,
+            {
+                "version": CLEAN_FINGERPRINT_VERSION,
+                "upstream_ref": upstream_ref,
+                "git_state": git_state_signatures(
+                    ctx.git_dir, ctx.common_dir, upstream_ref
+                ),
+                "directories": directories,
+                "worktree": worktree_marker,
+            },
+        )
+    except (OSError, subprocess.CalledProcessError) as error:
+        logger.warning(
+            f"Could not store clean-state fingerprint in repo {ctx.path}: {error}"
+        )
+
+
+def wait_for_index_lock(ctx):
+    lock_file_path = os.path.join(ctx.git_dir, "index.lock")
+    if not os.path.exists(lock_file_path):
+        return
 
+    try:
+        fd = inotify_init()
+    except OSError:
+        fd = None
+    try:
+        if fd is not None:
+            try:
+                inotify_add_watch(fd, ctx.git_dir, IN_DELETE | IN_MOVED_FROM)
+            except OSError:
+                os.close(fd)
+                fd = None
+        wait_for_index_lock_release(ctx, lock_file_path, fd)
+    finally:
+        if fd is not None:
+            os.close(fd)
 
-def wait_for_index_lock(repoAbsPath):
-    lock_file_path = os.path.join(git_dir_path(repoAbsPath), "index.lock")
 
+def wait_for_index_lock_release(ctx, lock_file_path, fd):
     while os.path.exists(lock_file_path):
-        active_git_pids = git_processes_in_repo(repoAbsPath)
+        active_git_pids = git_processes_in_repo(ctx)
         if active_git_pids:
             logger.warning(
-                f"{lock_file_path} exists and git process(es) {active_git_pids} are active in repo {repoAbsPath}. Waiting."
+                f"{lock_file_path} exists and git process(es) {active_git_pids} are active in repo {ctx.path}. Waiting."
             )
-            time.sleep(INDEX_LOCK_POLL_SECONDS)
+            wait_for_lock_removal(fd, INDEX_LOCK_POLL_SECONDS)
             continue
 
         lock_age_seconds = time.time() - os.path.getmtime(lock_file_path)
@@ -659,9 +2011,9 @@ def wait_for_index_lock(repoAbsPath):
                 INDEX_LOCK_POLL_SECONDS, INDEX_LOCK_STALE_SECONDS - lock_age_seconds
             )
             logger.warning(
-                f"{lock_file_path} exists in repo {repoAbsPath}. Waiting before treating it as stale."
+                f"{lock_file_path} exists in repo {ctx.path}. Waiting before treating it as stale."
             )
-            time.sleep(wait_seconds)
+            wait_for_lock_removal(fd, wait_seconds)
             continue
 
         logger.warning(f"Removing stale git index lock {lock_file_path}.")
@@ -671,11 +2023,28 @@ def wait_for_index_lock(repoAbsPath):
             return
 
 
-def wait_for_staged_changes_to_settle(repoAbsPath, wait_seconds, poll_seconds):
+def wait_for_lock_removal(fd, timeout_seconds):
+    if fd is None:
+        time.sleep(timeout_seconds)
+        return
+
+    deadline = time.monotonic() + timeout_seconds
+    while time.monotonic() < deadline:
+        readable, _writable, _errored = select.select(
+            [fd], [], [], max(deadline - time.monotonic(), 0)
+        )
+        if readable and any(
+            name == "index.lock"
+            for _watch_descriptor, _mask, name in read_inotify_events(fd)
+        ):
+            return
+
+
+def wait_for_staged_changes_to_settle(ctx, wait_seconds, poll_seconds):
     logger.warning(
-        f"Pre-existing staged changes found in repo {repoAbsPath}. Waiting up to {wait_seconds:g}s before auto-committing them."
+        f"Pre-existing staged changes found in repo {ctx.path}. Waiting up to {wait_seconds:g}s before auto-committing them."
     )
-    previous_snapshot = staged_diff_snapshot()
+    previous_snapshot = staged_tree_snapshot(ctx)
     deadline = time.monotonic() + wait_seconds
 
     while time.monotonic() < deadline:
@@ -683,147 +2052,1443 @@ def wait_for_staged_changes_to_settle(repoAbsPath, wait_seconds, poll_seconds):
         if remaining_seconds <= 0:
             break
         time.sleep(min(max(poll_seconds, 0.1), remaining_seconds))
-        wait_for_index_lock(repoAbsPath)
+        wait_for_index_lock(ctx)
 
-        if not has_staged_changes():
+        if not has_staged_changes(ctx):
             logger.info(
-                f"Pre-existing staged changes were cleared while waiting in repo {repoAbsPath}."
+                f"Pre-existing staged changes were cleared while waiting in repo {ctx.path}."
             )
             return
 
-        current_snapshot = staged_diff_snapshot()
+        current_snapshot = staged_tree_snapshot(ctx)
         if current_snapshot == previous_snapshot:
             continue
 
         logger.warning(
-            f"Staged changes changed while waiting in repo {repoAbsPath}. Restarting staged-change wait."
+            f"Staged changes changed while waiting in repo {ctx.path}. Restarting staged-change wait."
         )
         previous_snapshot = current_snapshot
         deadline = time.monotonic() + wait_seconds
 
     logger.warning(
-        f"Taking over stable pre-existing staged changes in repo {repoAbsPath}."
+        f"Taking over stable pre-existing staged changes in repo {ctx.path}."
     )
 
 
-def claim_staging_window(repoAbsPath, wait_seconds, poll_seconds):
-    if has_staged_changes():
-        if os.path.exists(auto_commit_state_path(repoAbsPath)):
+def claim_staging_window(ctx, wait_seconds, poll_seconds):
+    if has_staged_changes(ctx):
+        if os.path.exists(auto_commit_state_path(ctx)):
             logger.warning(
-                f"Resuming staged changes from an earlier git auto-commit in repo {repoAbsPath}."
+                f"Resuming staged changes from an earlier git auto-commit in repo {ctx.path}."
             )
         else:
-            wait_for_staged_changes_to_settle(repoAbsPath, wait_seconds, poll_seconds)
+            wait_for_staged_changes_to_settle(ctx, wait_seconds, poll_seconds)
     else:
-        clear_auto_commit_state(repoAbsPath)
+        clear_auto_commit_state(ctx)
 
-    mark_auto_commit_started(repoAbsPath)
+    mark_auto_commit_started(ctx)
 
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "message", help="Custom commit message", nargs="?", default=None
-    )
-    parser.add_argument(
-        "-p", "--path", help="Path to apply the git operations to", default="."
-    )
-    parser.add_argument(
-        "--staged-wait-seconds",
-        type=float,
-        default=STAGED_TAKEOVER_WAIT_SECONDS,
-        help="Seconds a pre-existing staged diff must stay stable before auto-commit takes it over",
-    )
-    parser.add_argument(
-        "--staged-poll-seconds",
-        type=float,
-        default=STAGED_TAKEOVER_POLL_SECONDS,
-        help="Seconds between staged-diff stability checks",
+@contextmanager
+def locked_state_file(state_path):
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(
+        state_path.with_name(f"{state_path.name}.lock"), "w", encoding="utf-8"
+    ) as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def read_json_state(state_path):
+    try:
+        with open(state_path, encoding="utf-8") as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        logger.warning(f"Ignoring unreadable git-auto state file {state_path}.")
+        return {}
+
+
+def write_json_state(state_path, state):
+    temporary_path = state_path.with_name(f"{state_path.name}.{os.getpid()}.tmp")
+    with open(temporary_path, "w", encoding="utf-8") as state_file:
+        json.dump(state, state_file, sort_keys=True)
+    os.replace(temporary_path, state_path)
+
+
+@contextmanager
+def run_state_database():
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    database = sqlite3.connect(STATE_DIR / RUN_STATE_FILENAME, timeout=30)
+    try:
+        with database:
+            database.execute(
+                """
+                CREATE TABLE IF NOT EXISTS repos (
+                    path TEXT PRIMARY KEY,
+                    last_run_at REAL NOT NULL,
+                    last_outcome TEXT NOT NULL,
+                    last_change_at REAL,
+                    last_push_at REAL,
+                    consecutive_failures INTEGER NOT NULL,
+                    idle_runs INTEGER NOT NULL,
+                    pause_until REAL,
+                    next_run_at REAL NOT NULL,
+                    phase_durations TEXT NOT NULL
+                )
+                """
+            )
+            database.execute(
+                """
+                CREATE TABLE IF NOT EXISTS maintenance (
+                    path TEXT PRIMARY KEY,
+                    commits_since INTEGER NOT NULL,
+                    last_maintenance_at REAL NOT NULL
+                )
+                """
+            )
+            yield database
+    finally:
+        database.close()
+
+
+def adaptive_backoff_seconds(streak):
+    return min(
+        ADAPTIVE_BASE_INTERVAL_SECONDS * 2 ** max(streak - 1, 0),
+        ADAPTIVE_MAX_INTERVAL_SECONDS,
     )
-    args = parser.parse_args()
 
-    repoAbsPath = getAbsPathFromPWD(args.path)
 
-    os.chdir(repoAbsPath)
+def repo_run_record(ctx, outcome, started_at, finished_at):
+    return {
+        "repo": ctx.path,
+        "outcome": outcome,
+        "started_at": started_at,
+        "duration": finished_at - started_at,
+        "phases": {**ctx.phase_durations, "total": finished_at - started_at},
+        "spans": ctx.spans,
+    }
+
+
+def append_run_record(metrics_path, record):
+    fd = os.open(metrics_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, (json.dumps(record, sort_keys=True) + "\n").encode())
+    finally:
+        os.close(fd)
+
+
+def prometheus_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus_metrics(metrics):
+    lines = [
+        "# HELP git_auto_phase_duration_seconds Time spent in each git-auto phase per repository run.",
+        "# TYPE git_auto_phase_duration_seconds histogram",
+    ]
+    for phase, histogram in sorted(metrics["phases"].items()):
+        label = f'phase="{prometheus_label(phase)}"'
+        for bound, bucket_count in zip(PHASE_DURATION_BUCKETS, histogram["buckets"]):
+            lines.append(
+                f'git_auto_phase_duration_seconds_bucket{{{label},le="{bound:g}"}} {bucket_count}'
+            )
+        lines.extend(
+            [
+                f'git_auto_phase_duration_seconds_bucket{{{label},le="+Inf"}} {histogram["count"]}',
+                f"git_auto_phase_duration_seconds_sum{{{label}}} {histogram['sum']:.6f}",
+                f"git_auto_phase_duration_seconds_count{{{label}}} {histogram['count']}",
+            ]
+        )
+    lines.extend(
+        [
+            "# HELP git_auto_runs_total Repository runs by outcome.",
+            "# TYPE git_auto_runs_total counter",
+        ]
+    )
+    for outcome, run_count in sorted(metrics["outcomes"].items()):
+        lines.append(f'git_auto_runs_total{{outcome="{prometheus_label(outcome)}"}} {run_count}')
+    return "\n".join(lines) + "\n"
+
+
+def update_metrics_textfile(textfile_path, records):
+    state_path = STATE_DIR / METRICS_STATE_FILENAME
+    with locked_state_file(state_path):
+        metrics = read_json_state(state_path)
+        phases = metrics.setdefault("phases", {})
+        outcomes = metrics.setdefault("outcomes", {})
+        for record in records:
+            outcomes[record["outcome"]] = outcomes.get(record["outcome"], 0) + 1
+            for phase, duration in record["phases"].items():
+                histogram = phases.setdefault(
+                    phase,
+                    {"buckets": [0] * len(PHASE_DURATION_BUCKETS), "sum": 0, "count": 0},
+                )
+                for bucket_index, bound in enumerate(PHASE_DURATION_BUCKETS):
+                    if duration <= bound:
+                        histogram["buckets"][bucket_index] += 1
+                histogram["sum"] += duration
+                histogram["count"] += 1
+        write_json_state(state_path, metrics)
 
-    auto_commit_lock = acquire_auto_commit_lock(repoAbsPath)
-    wait_for_index_lock(repoAbsPath)
+        textfile_path = Path(textfile_path)
+        temporary_path = textfile_path.with_name(f".{textfile_path.name}.{os.getpid()}.tmp")
+        temporary_path.write_text(render_prometheus_metrics(metrics), encoding="utf-8")
+        os.replace(temporary_path, textfile_path)
 
+
+def export_run_record(record, args):
+    args.run_records.append(record)
     try:
-        pause_remaining_seconds = auto_commit_pause_remaining_seconds(repoAbsPath)
+        if args.metrics_jsonl:
+            append_run_record(args.metrics_jsonl, record)
+        if args.metrics_textfile:
+            update_metrics_textfile(args.metrics_textfile, [record])
     except OSError as error:
-        exit_with_error(f"Could not inspect auto-commit pause: {error}", repoAbsPath)
+        logger.warning(f"Could not export run metrics for repo {record['repo']}: {error}")
 
-    if pause_remaining_seconds is not None and pause_remaining_seconds > 0:
+
+def log_timing_summary(records):
+    phase_totals = {}
+    for record in records:
+        for phase, duration in record["phases"].items():
+            run_count, total, slowest, slowest_repo = phase_totals.get(
+                phase, (0, 0, -1, None)
+            )
+            if duration > slowest:
+                slowest, slowest_repo = duration, record["repo"]
+            phase_totals[phase] = (run_count + 1, total + duration, slowest, slowest_repo)
+
+    logger.info(f"Timing summary for {len(records)} repository runs:")
+    for phase, (run_count, total, slowest, slowest_repo) in sorted(
+        phase_totals.items(), key=lambda item: item[1][1], reverse=True
+    ):
         logger.info(
-            "Auto-commit paused for "
-            f"{pause_remaining_seconds / (24 * 60 * 60):.2f} more days in repo {repoAbsPath}."
+            f"  {phase}: {total:.2f}s total over {run_count} runs, "
+            f"{total / run_count:.2f}s mean, {slowest:.2f}s max in {slowest_repo}"
         )
-        auto_commit_lock.close()
-        return
 
-    pause_expired = pause_remaining_seconds == 0
-    if pause_expired:
-        logger.info(f"Auto-commit pause expired in repo {repoAbsPath}; resuming.")
 
-    if not working_tree_has_changes(repoAbsPath) and not has_local_commits_to_push(
-        repoAbsPath
-    ):
-        logger.info(f"No changes or local commits to push in repo {repoAbsPath}.")
-        if pause_expired:
-            clear_auto_commit_pause(repoAbsPath)
-        auto_commit_lock.close()
-        return
+def record_repo_run(ctx, outcome, started_at, finished_at):
+    try:
+        pause_until = None
+        if outcome == "paused":
+            pause_until = finished_at + (auto_commit_pause_remaining_seconds(ctx) or 0)
+        with run_state_database() as database:
+            last_change_at, last_push_at, failures, idle_runs = database.execute(
+                "SELECT last_change_at, last_push_at, consecutive_failures, idle_runs "
+                "FROM repos WHERE path = ?",
+                (ctx.path,),
+            ).fetchone() or (None, None, 0, 0)
+
+            failures = failures + 1 if outcome == "failed" else 0
+            if outcome in ("committed", "pushed"):
+                last_change_at = finished_at
+                idle_runs = 0
+            elif outcome in ("clean", "read-only"):
+                idle_runs += 1
+            if outcome == "pushed":
+                last_push_at = finished_at
+
+            if outcome == "failed":
+                next_run_at = finished_at + adaptive_backoff_seconds(failures)
+            elif outcome == "paused":
+                next_run_at = pause_until
+            elif outcome in ("clean", "read-only"):
+                next_run_at = finished_at + adaptive_backoff_seconds(idle_runs)
+            else:
+                next_run_at = finished_at
+
+            database.execute(
+                "INSERT OR REPLACE INTO repos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    ctx.path,
+                    started_at,
+                    outcome,
+                    last_change_at,
+                    last_push_at,
+                    failures,
+                    idle_runs,
+                    pause_until,
+                    next_run_at,
+                    json.dumps(
+                        repo_run_record(ctx, outcome, started_at, finished_at)[
+                            "phases"
+                        ],
+                        sort_keys=True,
+                    ),
+                ),
+            )
+    except (sqlite3.Error, OSError) as error:
+        logger.warning(f"Could not record run state for repo {ctx.path}: {error}")
 
-    remote_name = push_remote_name(repoAbsPath)
-    push_url = remote_push_url(remote_name, repoAbsPath)
-    if not remote_has_internet_connectivity(push_url, repoAbsPath):
-        auto_commit_lock.close()
-        return
-    if not remote_allows_writes(remote_name, push_url, repoAbsPath):
-        if pause_expired:
-            clear_auto_commit_pause(repoAbsPath)
-        auto_commit_lock.close()
-        return
 
+def due_repo_paths(repo_paths, now=None):
+    now = time.time() if now is None else now
     try:
-        claim_staging_window(
-            repoAbsPath, args.staged_wait_seconds, args.staged_poll_seconds
+        with run_state_database() as database:
+            next_run_times = dict(
+                database.execute("SELECT path, next_run_at FROM repos").fetchall()
+            )
+    except sqlite3.Error as error:
+        logger.warning(f"Could not read run state; processing every repository: {error}")
+        return repo_paths
+    return [
+        repoAbsPath
+        for repoAbsPath in repo_paths
+        if next_run_times.get(repoAbsPath, now) <= now
+    ]
+
+
+def maintenance_is_due(commits_since, last_maintenance_at, now):
+    return commits_since >= MAINTENANCE_COMMIT_BUDGET or (
+        commits_since > 0 and now - last_maintenance_at >= MAINTENANCE_INTERVAL_SECONDS
+    )
+
+
+def run_maintenance(ctx):
+    # Tasks run one at a time so that one failing task (incremental-repack
+    # fails while a repository has no packs yet) does not skip the others.
+    for task in MAINTENANCE_TASKS:
+        result = run_command(
+            ["git", "maintenance", "run", f"--task={task}"],
+            capture_output=True,
+            text=True,
+            cwd=ctx.path,
         )
-    except subprocess.CalledProcessError as e:
-        exit_with_error(f"Could not inspect staged changes: {e}", repoAbsPath)
+        if result.returncode != 0:
+            logger.warning(
+                f"Maintenance task {task} failed in repo {ctx.path}: "
+                + push_failure_message(result)
+            )
+    logger.info(
+        f"Ran incremental maintenance ({', '.join(MAINTENANCE_TASKS)}) in repo {ctx.path}."
+    )
 
-    run_checked(["git", "add", "."], "Git add failed", repoAbsPath)
 
+def maintain_repo_if_due(ctx, now=None):
+    now = time.time() if now is None else now
     try:
-        has_changes_to_commit = has_staged_changes()
-    except subprocess.CalledProcessError as e:
-        exit_with_error(f"Could not inspect staged changes: {e}", repoAbsPath)
+        with run_state_database() as database:
+            commits_since, last_maintenance_at = database.execute(
+                "SELECT commits_since, last_maintenance_at FROM maintenance WHERE path = ?",
+                (ctx.path,),
+            ).fetchone() or (0, now)
+            commits_since += ctx.commits_made
+            if maintenance_is_due(commits_since, last_maintenance_at, now):
+                with timed_phase(ctx, "maintenance"):
+                    run_maintenance(ctx)
+                commits_since, last_maintenance_at = 0, now
+            database.execute(
+                "INSERT OR REPLACE INTO maintenance VALUES (?, ?, ?)",
+                (ctx.path, commits_since, last_maintenance_at),
+            )
+    except sqlite3.Error as error:
+        logger.warning(f"Could not record maintenance state for repo {ctx.path}: {error}")
 
-    if has_changes_to_commit:
-        custom_message = args.message if args.message else generate_commit_message()
-        commit_with_dns_retry(custom_message, repoAbsPath)
-        clear_auto_commit_state(repoAbsPath)
-        logger.info(f"Commit successful in repo {repoAbsPath}. Pushing to remote.")
-    else:
-        clear_auto_commit_state(repoAbsPath)
-        if not has_local_commits_to_push(repoAbsPath):
-            logger.info(f"No changes or local commits to push in repo {repoAbsPath}.")
-            if pause_expired:
-                clear_auto_commit_pause(repoAbsPath)
-            auto_commit_lock.close()
-            return
-        logger.info(f"No changes to commit in repo {repoAbsPath}. Pushing local commits.")
 
-    if not remote_has_internet_connectivity(push_url, repoAbsPath):
-        auto_commit_lock.close()
-        return
-    push_with_auto_reconcile(repoAbsPath, remote_name, push_url)
+def discovery_index_path():
+    return STATE_DIR / DISCOVERY_INDEX_FILENAME
 
-    if pause_expired:
-        clear_auto_commit_pause(repoAbsPath)
 
-    auto_commit_lock.close()
+def worktree_git_dir(worktree_path):
+    dot_git_path = os.path.join(worktree_path, ".git")
+    if os.path.isdir(dot_git_path):
+        return dot_git_path
+    try:
+        with open(dot_git_path, encoding="utf-8") as git_file:
+            git_file_content = git_file.read().strip()
+    except OSError:
+        return None
+    if not git_file_content.startswith("gitdir:"):
+        return None
+    return os.path.normpath(
+        os.path.join(worktree_path, git_file_content.removeprefix("gitdir:").strip())
+    )
+
+
+def git_common_dir(git_dir):
+    try:
+        with open(os.path.join(git_dir, "commondir"), encoding="utf-8") as commondir_file:
+            return os.path.normpath(os.path.join(git_dir, commondir_file.read().strip()))
+    except FileNotFoundError:
+        return git_dir
+
+
+def mtime_ns_or_none(file_path):
+    try:
+        return os.stat(file_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def read_text_or_none(file_path):
+    try:
+        with open(file_path, encoding="utf-8") as text_file:
+            return text_file.read()
+    except FileNotFoundError:
+        return None
+
+
+def scan_discovery_directory(directory_path):
+    is_repo = False
+    subdirectory_names = []
+    with os.scandir(directory_path) as entries:
+        for entry in entries:
+            if entry.name == ".git":
+                is_repo = True
+            elif (
+                not entry.name.startswith(".")
+                and entry.is_dir(follow_symlinks=False)
+            ):
+                subdirectory_names.append(entry.name)
+    return is_repo, sorted(subdirectory_names)
+
+
+def walk_discovery_root(root_path, cached_directories):
+    directories = {}
+    worktree_paths = []
+    pending_paths = [root_path]
+    while pending_paths:
+        directory_path = pending_paths.pop()
+        try:
+            directory_mtime_ns = os.stat(directory_path).st_mtime_ns
+        except OSError:
+            continue
+
+        cached_directory = cached_directories.get(directory_path)
+        if cached_directory and cached_directory["mtime_ns"] == directory_mtime_ns:
+            is_repo = cached_directory["repo"]
+            subdirectory_names = cached_directory["subdirs"]
+        else:
+            try:
+                is_repo, subdirectory_names = scan_discovery_directory(directory_path)
+            except OSError:
+                continue
+        directories[directory_path] = {
+            "mtime_ns": directory_mtime_ns,
+            "repo": is_repo,
+            "subdirs": subdirectory_names,
+        }
+
+        if is_repo:
+            worktree_paths.append(directory_path)
+            continue
+        pending_paths.extend(
+            os.path.join(directory_path, name) for name in reversed(subdirectory_names)
+        )
+    return directories, sorted(worktree_paths)
+
+
+def resolve_discovered_push_url(worktree_path, head):
+    result = run_command(
+        ["git", "config", "-z", "--list"],
+        capture_output=True,
+        text=True,
+        cwd=worktree_path,
+    )
+    if result.returncode != 0:
+        return None, None
+    git_config = parse_git_config_list(result.stdout)
+
+    branch = (
+        head.removeprefix("ref: refs/heads/").strip()
+        if head and head.startswith("ref: refs/heads/")
+        else None
+    )
+    remote_name = push_remote_name(branch, git_config)
+    if remote_name == ".":
+        return remote_name, worktree_path
+    return remote_name, configured_push_url(remote_name, git_config)
+
+
+def discovered_repo_record(worktree_path, cached_record, remote_permissions):
+    git_dir = worktree_git_dir(worktree_path)
+    if git_dir is None:
+        return None
+    config_mtime_ns = mtime_ns_or_none(os.path.join(git_common_dir(git_dir), "config"))
+    head = read_text_or_none(os.path.join(git_dir, "HEAD"))
+
+    if (
+        cached_record
+        and cached_record["git_dir"] == git_dir
+        and cached_record["config_mtime_ns"] == config_mtime_ns
+        and cached_record["head"] == head
+    ):
+        record = dict(cached_record)
+    else:
+        push_remote, push_url = resolve_discovered_push_url(worktree_path, head)
+        record = {
+            "git_dir": git_dir,
+            "config_mtime_ns": config_mtime_ns,
+            "head": head,
+            "push_remote": push_remote,
+            "push_url": push_url,
+        }
+
+    pause_mtime_ns = mtime_ns_or_none(os.path.join(git_dir, AUTO_COMMIT_PAUSE_FILENAME))
+    record["paused_until"] = (
+        None
+        if pause_mtime_ns is None
+        else pause_mtime_ns / 1e9 + AUTO_COMMIT_PAUSE_SECONDS
+    )
+    permission = (
+        None
+        if record["push_url"] is None
+        else remote_permissions.get(remote_permission_key(record["push_url"]))
+    )
+    record["read_only"] = (
+        permission is not None
+        and not permission["writable"]
+        and not remote_permission_expired(permission)
+    )
+    return record
+
+
+def discover_repositories(root_paths):
+    index_path = discovery_index_path()
+    remote_permissions = read_remote_permissions()
+    with locked_state_file(index_path):
+        index = read_json_state(index_path)
+        if index.get("version") != DISCOVERY_INDEX_VERSION:
+            index = {"version": DISCOVERY_INDEX_VERSION, "roots": {}, "repos": {}}
+
+        discovered_records = {}
+        for root_path in root_paths:
+            cached_directories = index["roots"].get(root_path, {})
+            directories, worktree_paths = walk_discovery_root(
+                root_path, cached_directories
+            )
+            index["roots"][root_path] = directories
+            for worktree_path in worktree_paths:
+                record = discovered_repo_record(
+                    worktree_path, index["repos"].get(worktree_path), remote_permissions
+                )
+                if record is not None:
+                    discovered_records[worktree_path] = record
+
+        index["repos"] = {
+            worktree_path: record
+            for worktree_path, record in index["repos"].items()
+            if not any(
+                worktree_path == root_path
+                or worktree_path.startswith(root_path + os.sep)
+                for root_path in root_paths
+            )
+        }
+        index["repos"].update(discovered_records)
+        write_json_state(index_path, index)
+    return discovered_records
+
+
+def discovered_repo_skip_reason(record, now=None):
+    now = time.time() if now is None else now
+    if record["paused_until"] is not None and record["paused_until"] > now:
+        return "auto-commit is paused"
+    if record["read_only"]:
+        return "its push remote is cached as read-only"
+    return None
+
+
+def discovered_repo_paths(root_paths):
+    repo_paths = []
+    for worktree_path, record in discover_repositories(root_paths).items():
+        skip_reason = discovered_repo_skip_reason(record)
+        if skip_reason:
+            logger.info(f"Skipping discovered repo {worktree_path} because {skip_reason}.")
+            continue
+        repo_paths.append(worktree_path)
+    return repo_paths
+
+
+@functools.cache
+def libc():
+    return ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+
+
+def inotify_init():
+    fd = libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        error_number = ctypes.get_errno()
+        raise OSError(error_number, os.strerror(error_number))
+    return fd
+
+
+def inotify_add_watch(fd, watch_path, mask):
+    watch_descriptor = libc().inotify_add_watch(fd, os.fsencode(watch_path), mask)
+    if watch_descriptor < 0:
+        error_number = ctypes.get_errno()
+        raise OSError(error_number, os.strerror(error_number), watch_path)
+    return watch_descriptor
+
+
+def read_inotify_events(fd):
+    events = []
+    while True:
+        try:
+            buffer = os.read(fd, 64 * 1024)
+        except BlockingIOError:
+            return events
+        offset = 0
+        while offset < len(buffer):
+            watch_descriptor, mask, _cookie, name_length = (
+                INOTIFY_EVENT_HEADER.unpack_from(buffer, offset)
+            )
+            offset += INOTIFY_EVENT_HEADER.size
+            name = buffer[offset : offset + name_length].rstrip(b"\0")
+            offset += name_length
+            events.append((watch_descriptor, mask, os.fsdecode(name)))
+
+
+def add_watch(fd, watches, repoAbsPath, directory_path, kind, mask):
+    try:
+        watch_descriptor = inotify_add_watch(fd, directory_path, mask)
+    except OSError as error:
+        if not isinstance(error, FileNotFoundError):
+            logger.warning(f"Could not watch {directory_path} in repo {repoAbsPath}: {error}")
+        return
+    watches[watch_descriptor] = (repoAbsPath, directory_path, kind)
+
+
+def directory_is_ignored(repoAbsPath, directory_path):
+    result = run_command(
+        [
+            "git",
+            "check-ignore",
+            "--quiet",
+            # Directory patterns such as "build/" only match with the slash.
+            os.path.join(os.path.relpath(directory_path, repoAbsPath), ""),
+        ],
+        capture_output=True,
+        cwd=repoAbsPath,
+    )
+    return result.returncode == 0
+
+
+def add_worktree_watches(fd, watches, repoAbsPath, directory_path):
+    if os.path.lexists(os.path.join(directory_path, ".git")):
+        return
+    if directory_is_ignored(repoAbsPath, directory_path):
+        return
+    try:
+        relative_directories = worktree_directories(
+            directory_path, skip_nested_repos=True
+        )
+    except (OSError, subprocess.CalledProcessError) as error:
+        logger.warning(f"Could not watch {directory_path} in repo {repoAbsPath}: {error}")
+        return
+    for relative_directory in relative_directories:
+        add_watch(
+            fd,
+            watches,
+            repoAbsPath,
+            os.path.join(directory_path, relative_directory),
+            "worktree",
+            WATCH_WORKTREE_MASK,
+        )
+
+
+def add_repo_watches(fd, watches, ctx):
+    for relative_directory in worktree_directories(ctx.path, skip_nested_repos=True):
+        add_watch(
+            fd,
+            watches,
+            ctx.path,
+            os.path.join(ctx.path, relative_directory),
+            "worktree",
+            WATCH_WORKTREE_MASK,
+        )
+    add_watch(fd, watches, ctx.path, ctx.git_dir, "git", WATCH_GIT_DIR_MASK)
+    add_watch(
+        fd,
+        watches,
+        ctx.path,
+        os.path.join(ctx.common_dir, "refs", "heads"),
+        "refs",
+        WATCH_GIT_DIR_MASK,
+    )
+
+
+def watch_event_is_relevant(kind, mask, name):
+    if kind == "worktree":
+        return name != ".git"
+    if kind == "git":
+        if name == "index.lock":
+            return bool(mask & (IN_DELETE | IN_MOVED_FROM))
+        return name in WATCHED_GIT_DIR_NAMES
+    return True
+
+
+def mark_repo_changed(pending, repoAbsPath, now):
+    first_event_at, _last_event_at = pending.get(repoAbsPath, (now, now))
+    pending[repoAbsPath] = (first_event_at, now)
+
+
+def record_watch_events(fd, watches, pending, ignored_git_repo=None):
+    now = time.monotonic()
+    for watch_descriptor, mask, name in read_inotify_events(fd):
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("Inotify event queue overflowed; rechecking every watched repo.")
+            for repoAbsPath, _directory_path, _kind in watches.values():
+                mark_repo_changed(pending, repoAbsPath, now)
+            continue
+        if watch_descriptor not in watches:
+            continue
+        if mask & IN_IGNORED:
+            watches.pop(watch_descriptor)
+            continue
+
+        repoAbsPath, directory_path, kind = watches[watch_descriptor]
+        if kind != "worktree" and repoAbsPath == ignored_git_repo:
+            continue
+        if not watch_event_is_relevant(kind, mask, name):
+            continue
+        if kind == "worktree" and mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            add_worktree_watches(
+                fd, watches, repoAbsPath, os.path.join(directory_path, name)
+            )
+        mark_repo_changed(pending, repoAbsPath, now)
+
+
+def due_watched_repos(pending, debounce_seconds, now):
+    return [
+        repoAbsPath
+        for repoAbsPath, (first_event_at, last_event_at) in pending.items()
+        if now - last_event_at >= debounce_seconds
+        or now - first_event_at >= WATCH_MAX_DELAY_SECONDS
+    ]
+
+
+def watch_select_timeout(pending, debounce_seconds, now):
+    if not pending:
+        return None
+    return max(
+        0,
+        min(
+            min(
+                last_event_at + debounce_seconds,
+                first_event_at + WATCH_MAX_DELAY_SECONDS,
+            )
+            - now
+            for first_event_at, last_event_at in pending.values()
+        ),
+    )
+
+
+def push_deadline_timeout(push_deadlines, repo_paths, now):
+    deadlines = [
+        push_deadlines[repoAbsPath]
+        for repoAbsPath in repo_paths
+        if repoAbsPath in push_deadlines
+    ]
+    if not deadlines:
+        return None
+    return max(0, min(deadlines) - now)
+
+
+def mark_due_push_deadlines(pending, push_deadlines, repo_paths, now, monotonic_now):
+    for repoAbsPath in repo_paths:
+        if push_deadlines.get(repoAbsPath, now + 1) <= now:
+            del push_deadlines[repoAbsPath]
+            logger.info(f"Push age limit reached in repo {repoAbsPath}; rechecking.")
+            mark_repo_changed(pending, repoAbsPath, monotonic_now)
+
+
+def start_connectivity_monitor():
+    if CONNECTIVITY_BACKEND == "stub" or not shutil.which("gdbus"):
+        return None
+    try:
+        monitor = subprocess.Popen(
+            [
+                "gdbus",
+                "monitor",
+                "--system",
+                "--dest",
+                NETWORKMANAGER_DBUS_NAME,
+                "--object-path",
+                NETWORKMANAGER_DBUS_PATH,
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+    except OSError as error:
+        logger.warning(f"Could not subscribe to NetworkManager connectivity changes: {error}")
+        return None
+    os.set_blocking(monitor.stdout.fileno(), False)
+    return monitor
+
+
+def read_connectivity_monitor(monitor, pending_output):
+    try:
+        output = os.read(monitor.stdout.fileno(), 64 * 1024)
+    except BlockingIOError:
+        return False, pending_output, True
+    if not output:
+        return False, b"", False
+    *complete_lines, pending_output = (pending_output + output).split(b"\n")
+    return (
+        any(b"'Connectivity'" in line for line in complete_lines),
+        pending_output,
+        True,
+    )
+
+
+def watch_repositories(repo_paths, args):
+    fd = inotify_init()
+    connectivity_monitor = start_connectivity_monitor()
+    monitor_output = b""
+    try:
+        watches = {}
+        pending = {}
+        watched_paths = []
+        for repoAbsPath in repo_paths:
+            try:
+                add_repo_watches(fd, watches, RepoContext(repoAbsPath))
+            except (OSError, subprocess.CalledProcessError) as error:
+                logger.error(f"Could not watch repo {repoAbsPath}: {error}")
+                continue
+            watched_paths.append(repoAbsPath)
+
+        for repoAbsPath in watched_paths:
+            auto_commit_repo_in_batch(repoAbsPath, args)
+            record_watch_events(fd, watches, pending, ignored_git_repo=repoAbsPath)
+        logger.info(
+            f"Watching {len(watched_paths)} repositories with a {args.debounce_seconds:g}s debounce."
+        )
+
+        while True:
+            timeouts = [
+                timeout
+                for timeout in (
+                    watch_select_timeout(
+                        pending, args.debounce_seconds, time.monotonic()
+                    ),
+                    push_deadline_timeout(
+                        args.push_deadlines, watched_paths, time.time()
+                    ),
+                )
+                if timeout is not None
+            ]
+            timeout = min(timeouts) if timeouts else None
+            readable_fds = [fd]
+            if connectivity_monitor is not None:
+                readable_fds.append(connectivity_monitor.stdout.fileno())
+            readable, _writable, _errored = select.select(readable_fds, [], [], timeout)
+            if fd in readable:
+                record_watch_events(fd, watches, pending)
+            if connectivity_monitor is not None and (
+                connectivity_monitor.stdout.fileno() in readable
+            ):
+                connectivity_changed, monitor_output, monitor_alive = (
+                    read_connectivity_monitor(connectivity_monitor, monitor_output)
+                )
+                if connectivity_changed:
+                    logger.info(
+                        "NetworkManager connectivity changed; rechecking watched repositories."
+                    )
+                    forget_connectivity_state()
+                    now = time.monotonic()
+                    for repoAbsPath in watched_paths:
+                        mark_repo_changed(pending, repoAbsPath, now)
+                if not monitor_alive:
+                    logger.warning("NetworkManager connectivity monitor exited.")
+                    connectivity_monitor.wait()
+                    connectivity_monitor = None
+            mark_due_push_deadlines(
+                pending,
+                args.push_deadlines,
+                watched_paths,
+                time.time(),
+                time.monotonic(),
+            )
+            for repoAbsPath in due_watched_repos(
+                pending, args.debounce_seconds, time.monotonic()
+            ):
+                del pending[repoAbsPath]
+                auto_commit_repo_in_batch(repoAbsPath, args)
+                record_watch_events(fd, watches, pending, ignored_git_repo=repoAbsPath)
+    finally:
+        if connectivity_monitor is not None:
+            connectivity_monitor.terminate()
+            connectivity_monitor.wait()
+        os.close(fd)
+
+
+def auto_commit_repo(repoAbsPath, args):
+    ctx = RepoContext(repoAbsPath, args.ssh_control_directory)
+    started_at = time.time()
+    outcome = "failed"
+    try:
+        with timed_phase(ctx, "lock_wait"):
+            auto_commit_lock = acquire_auto_commit_lock(ctx)
+        try:
+            try:
+                outcome = auto_commit_locked_repo(ctx, args)
+            except RemoteHostUnavailable as error:
+                logger.warning(
+                    f"Skipping network Git operations because {error} in repo {ctx.path}."
+                )
+                outcome = "offline"
+            except NetworkGitTimeout as error:
+                exit_with_error(str(error), ctx.path)
+            if args.maintenance:
+                maintain_repo_if_due(ctx)
+        finally:
+            auto_commit_lock.close()
+    finally:
+        finished_at = time.time()
+        record_repo_run(ctx, outcome, started_at, finished_at)
+        record_repo_trace(ctx, outcome, started_at, finished_at)
+        export_run_record(repo_run_record(ctx, outcome, started_at, finished_at), args)
+    return outcome
+
+
+def auto_commit_locked_repo(ctx, args):
+    with timed_phase(ctx, "lock_wait"):
+        wait_for_index_lock(ctx)
+
+    try:
+        pause_remaining_seconds = auto_commit_pause_remaining_seconds(ctx)
+    except OSError as error:
+        exit_with_error(f"Could not inspect auto-commit pause: {error}", ctx.path)
+
+    if pause_remaining_seconds is not None and pause_remaining_seconds > 0:
+        logger.info(
+            "Auto-commit paused for "
+            f"{pause_remaining_seconds / (24 * 60 * 60):.2f} more days in repo {ctx.path}."
+        )
+        return "paused"
+
+    pause_expired = pause_remaining_seconds == 0
+    if pause_expired:
+        logger.info(f"Auto-commit pause expired in repo {ctx.path}; resuming.")
+
+    with timed_phase(ctx, "status"):
+        unchanged_since_clean_run = (
+            args.clean_fingerprint and clean_fingerprint_matches(ctx)
+        )
+    if unchanged_since_clean_run:
+        logger.info(
+            f"No changes or local commits to push in repo {ctx.path} "
+            "(unchanged since the last clean run)."
+        )
+        if pause_expired:
+            clear_auto_commit_pause(ctx)
+        return "clean"
+
+    with timed_phase(ctx, "status"):
+        status_started_ns = time.time_ns()
+        repo_is_clean = not (
+            working_tree_has_changes(ctx) or has_local_commits_to_push(ctx)
+        )
+        if repo_is_clean and args.clean_fingerprint:
+            store_clean_fingerprint(ctx, status_started_ns)
+    if repo_is_clean:
+        logger.info(f"No changes or local commits to push in repo {ctx.path}.")
+        if pause_expired:
+            clear_auto_commit_pause(ctx)
+        return "clean"
+
+    with timed_phase(ctx, "permission"):
+        if not remote_has_internet_connectivity(ctx.push_url, ctx):
+            return "offline"
+        if not remote_host_is_available(ctx.push_url, ctx):
+            return "offline"
+        remote_is_writable = remote_allows_writes(ctx)
+    if not remote_is_writable:
+        if pause_expired:
+            clear_auto_commit_pause(ctx)
+        return "read-only"
+
+    with timed_phase(ctx, "staging"):
+        try:
+            claim_staging_window(
+                ctx, args.staged_wait_seconds, args.staged_poll_seconds
+            )
+        except (subprocess.CalledProcessError, OSError) as e:
+            exit_with_error(f"Could not inspect staged changes: {e}", ctx.path)
+        # The staged-change wait can take a while, so stage from a fresh status.
+        ctx.invalidate()
+
+    with timed_phase(ctx, "add"):
+        stage_changes(ctx)
+
+        try:
+            has_changes_to_commit = has_staged_changes(ctx)
+        except subprocess.CalledProcessError as e:
+            exit_with_error(f"Could not inspect staged changes: {e}", ctx.path)
+
+    if has_changes_to_commit:
+        with timed_phase(ctx, "commit"):
+            custom_message = (
+                args.message if args.message else generate_commit_message(ctx)
+            )
+            commit_with_dns_retry(custom_message, ctx, squashable=not args.message)
+            ctx.commits_made += 1
+            ctx.invalidate()
+            clear_auto_commit_state(ctx)
+        logger.info(f"Commit successful in repo {ctx.path}. Pushing to remote.")
+        deferred_outcome = "committed"
+    else:
+        clear_auto_commit_state(ctx)
+        if not has_local_commits_to_push(ctx):
+            logger.info(f"No changes or local commits to push in repo {ctx.path}.")
+            if pause_expired:
+                clear_auto_commit_pause(ctx)
+            return "clean"
+        logger.info(f"No changes to commit in repo {ctx.path}. Pushing local commits.")
+        deferred_outcome = "offline"
+
+    with timed_phase(ctx, "push"):
+        if not push_is_due(ctx, args):
+            return "committed" if has_changes_to_commit else "deferred"
+        if not remote_has_internet_connectivity(ctx.push_url, ctx):
+            return deferred_outcome
+        if not remote_host_is_available(ctx.push_url, ctx):
+            return deferred_outcome
+        if args.squash_auto_commits:
+            with timed_phase(ctx, "squash"):
+                squash_auto_commits(ctx)
+        pushed = push_with_auto_reconcile(ctx)
+
+    if pause_expired:
+        clear_auto_commit_pause(ctx)
+    return "pushed" if pushed else "read-only"
+
+
+def index_header(ctx):
+    try:
+        with open(os.path.join(ctx.git_dir, "index"), "rb") as index_file:
+            header = index_file.read(12)
+    except FileNotFoundError:
+        return None
+    if len(header) < 12 or header[:4] != b"DIRC":
+        return None
+    return struct.unpack(">II", header[4:])
+
+
+def git_supports_builtin_fsmonitor(ctx):
+    result = run_checked(
+        ["git", "version", "--build-options"], "Could not read Git build options", ctx
+    )
+    return "feature: fsmonitor--daemon" in result.stdout.splitlines()
+
+
+def filesystem_supports_untracked_cache(ctx):
+    result = run_command(
+        ["git", "update-index", "--test-untracked-cache"],
+        capture_output=True,
+        text=True,
+        cwd=ctx.path,
+    )
+    return result.returncode == 0
+
+
+def timed_status_seconds(ctx):
+    started_at = time.monotonic()
+    run_checked(
+        ["git", "status", "--porcelain=v2", "-z"], "Git status failed", ctx
+    )
+    return time.monotonic() - started_at
+
+
+def planned_tuning(ctx):
+    header = index_header(ctx)
+    tracked_files = header[1] if header else 0
+    settings = {}
+    if last_config_value(ctx.git_config, "core.untrackedcache") is None:
+        if filesystem_supports_untracked_cache(ctx):
+            settings["core.untrackedCache"] = "true"
+        else:
+            logger.info(
+                f"Not enabling the untracked cache in repo {ctx.path}: "
+                "the filesystem does not update directory modification times reliably."
+            )
+    if last_config_value(ctx.git_config, "core.fsmonitor") is None:
+        if git_supports_builtin_fsmonitor(ctx):
+            settings["core.fsmonitor"] = "true"
+        else:
+            logger.info(
+                f"Not enabling fsmonitor in repo {ctx.path}: "
+                "this Git build has no built-in fsmonitor daemon."
+            )
+    if (
+        tracked_files >= TUNE_MANY_FILES_THRESHOLD
+        and last_config_value(ctx.git_config, "feature.manyfiles") is None
+    ):
+        settings["feature.manyFiles"] = "true"
+    return settings
+
+
+def tuning_state_path(ctx):
+    return Path(ctx.git_dir) / TUNING_STATE_FILENAME
+
+
+def tune_repo(repoAbsPath, args):
+    ctx = RepoContext(repoAbsPath)
+    auto_commit_lock = acquire_auto_commit_lock(ctx)
+    try:
+        tune_locked_repo(ctx)
+    finally:
+        auto_commit_lock.close()
+
+
+def tune_locked_repo(ctx):
+    settings = planned_tuning(ctx)
+    if not settings:
+        logger.info(f"Nothing to tune in repo {ctx.path}.")
+        return
+
+    status_seconds_before = timed_status_seconds(ctx)
+    tuning_state = read_json_state(tuning_state_path(ctx))
+    changed_settings = tuning_state.setdefault("config", [])
+    for key, value in settings.items():
+        run_checked(
+            ["git", "config", "--local", key, value],
+            f"Could not set {key}",
+            ctx,
+        )
+        changed_settings.append(key)
+        write_json_state(tuning_state_path(ctx), tuning_state)
+
+    header = index_header(ctx)
+    if "feature.manyFiles" in settings and header and header[0] != 4:
+        tuning_state.setdefault("index_version", header[0])
+        run_checked(
+            ["git", "update-index", "--index-version", "4"],
+            "Could not switch the index to version 4",
+            ctx,
+        )
+    if "core.untrackedCache" in settings:
+        run_checked(
+            ["git", "update-index", "--untracked-cache"],
+            "Could not enable the untracked cache",
+            ctx,
+        )
+    tuning_state["tuned_at"] = time.time()
+    write_json_state(tuning_state_path(ctx), tuning_state)
+
+    # The first status after tuning fills the untracked cache and starts the
+    # fsmonitor daemon, so time the second one.
+    timed_status_seconds(ctx)
+    status_seconds_after = timed_status_seconds(ctx)
+    logger.info(
+        f"Tuned repo {ctx.path}: set {', '.join(settings)}. "
+        f"git status took {status_seconds_before:.3f}s before and "
+        f"{status_seconds_after:.3f}s after."
+    )
+
+
+def untune_repo(repoAbsPath, args):
+    ctx = RepoContext(repoAbsPath)
+    auto_commit_lock = acquire_auto_commit_lock(ctx)
+    try:
+        untune_locked_repo(ctx)
+    finally:
+        auto_commit_lock.close()
+
+
+def untune_locked_repo(ctx):
+    state_path = tuning_state_path(ctx)
+    tuning_state = read_json_state(state_path)
+    if not tuning_state:
+        logger.info(f"No tuning recorded in repo {ctx.path}.")
+        return
+
+    changed_settings = tuning_state.get("config", [])
+
+    if "core.fsmonitor" in changed_settings:
+        run_command(
+            ["git", "fsmonitor--daemon", "stop"], capture_output=True, cwd=ctx.path
+        )
+    for key in changed_settings:
+        result = run_command(
+            ["git", "config", "--local", "--unset-all", key],
+            capture_output=True,
+            text=True,
+            cwd=ctx.path,
+        )
+        # Status 5 means the setting was already removed by hand.
+        if result.returncode not in (0, 5):
+            exit_with_error(
+                f"Could not unset {key}: "
+                + command_failure_message(
+                    result.args, result.returncode, result.stdout, result.stderr
+                ),
+                ctx.path,
+            )
+    if "core.untrackedCache" in changed_settings:
+        run_checked(
+            ["git", "update-index", "--no-untracked-cache"],
+            "Could not disable the untracked cache",
+            ctx,
+        )
+    if "index_version" in tuning_state:
+        run_checked(
+            [
+                "git",
+                "update-index",
+                "--index-version",
+                str(tuning_state["index_version"]),
+            ],
+            "Could not restore the index version",
+            ctx,
+        )
+    os.remove(state_path)
+    logger.info(
+        f"Reverted tuning in repo {ctx.path}: unset {', '.join(changed_settings) or 'nothing'}."
+    )
+
+
+def read_paths_file(paths_file):
+    repo_paths = []
+    with open(paths_file, encoding="utf-8") as repo_list:
+        for line in repo_list:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                repo_paths.append(os.path.expanduser(line))
+    return repo_paths
+
+
+def batch_repo_paths(args):
+    repo_paths = list(args.path or [])
+    for paths_file in args.paths_file or []:
+        try:
+            repo_paths.extend(read_paths_file(paths_file))
+        except OSError as error:
+            exit_with_error(f"Could not read repository list: {error}", paths_file)
+    if args.discover:
+        repo_paths.extend(
+            discovered_repo_paths(
+                [getAbsPathFromPWD(os.path.expanduser(root)) for root in args.discover]
+            )
+        )
+    if not repo_paths and not args.paths_file and not args.discover:
+        repo_paths = ["."]
+
+    unique_paths = []
+    for repo_path in repo_paths:
+        repoAbsPath = getAbsPathFromPWD(repo_path)
+        if repoAbsPath not in unique_paths:
+            unique_paths.append(repoAbsPath)
+    return unique_paths
+
+
+def auto_commit_repo_in_batch(repoAbsPath, args, repo_action=auto_commit_repo):
+    try:
+        repo_action(repoAbsPath, args)
+    except SystemExit as exit_error:
+        return exit_error.code in (None, 0)
+    except Exception as error:
+        logger.exception(f"Unexpected auto-commit failure in repo {repoAbsPath}.")
+        report_error(f"Unexpected auto-commit failure: {error!r}", repoAbsPath)
+        return False
+    return True
+
+
+def run_batch(repo_paths, args, repo_action=auto_commit_repo):
+    failed_paths = []
+    with ThreadPoolExecutor(
+        max_workers=max(1, args.jobs), thread_name_prefix="git-auto"
+    ) as executor:
+        futures = {
+            executor.submit(
+                auto_commit_repo_in_batch, repoAbsPath, args, repo_action
+            ): repoAbsPath
+            for repoAbsPath in repo_paths
+        }
+        for future in as_completed(futures):
+            if not future.result():
+                failed_paths.append(futures[future])
+
+    if failed_paths:
+        logger.error(
+            f"Auto-commit failed in {len(failed_paths)} of {len(repo_paths)} repositories: "
+            + ", ".join(sorted(failed_paths))
+        )
+    return not failed_paths
+
+
+def process_repositories(repo_paths, args):
+    try:
+        if args.tune or args.untune:
+            if not run_batch(repo_paths, args, tune_repo if args.tune else untune_repo):
+                sys.exit(1)
+            return
+
+        if args.adaptive and not args.watch:
+            due_paths = due_repo_paths(repo_paths)
+            if len(due_paths) < len(repo_paths):
+                logger.info(
+                    f"Skipping {len(repo_paths) - len(due_paths)} of {len(repo_paths)} "
+                    "repositories that are not due on the adaptive schedule."
+                )
+            repo_paths = due_paths
+            if not repo_paths:
+                return
+
+        if len(repo_paths) == 1 and not args.watch:
+            auto_commit_repo(repo_paths[0], args)
+            return
+
+        with ssh_connection_pool() as args.ssh_control_directory:
+            if args.watch:
+                try:
+                    watch_repositories(repo_paths, args)
+                except OSError as error:
+                    exit_with_error(f"Watch mode failed: {error}", ", ".join(repo_paths))
+                except KeyboardInterrupt:
+                    logger.info("Stopped watching repositories.")
+                return
+
+            if not run_batch(repo_paths, args):
+                sys.exit(1)
+    finally:
+        wait_for_remote_permission_refreshes(PERMISSION_PROBE_TIMEOUT_SECONDS)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "message", help="Custom commit message", nargs="?", default=None
+    )
+    parser.add_argument(
+        "-p",
+        "--path",
+        action="append",
+        help="Path to apply the git operations to; repeat to process several repositories",
+    )
+    parser.add_argument(
+        "--paths-file",
+        action="append",
+        help="File listing one repository path per line; blank lines and # comments are ignored",
+    )
+    parser.add_argument(
+        "--discover",
+        action="append",
+        metavar="ROOT",
+        help="Also process every repository found under ROOT, using the cached discovery index",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=BATCH_JOBS,
+        help="Maximum number of repositories processed concurrently",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Only process repositories that the run-state schedule says are due",
+    )
+    tuning = parser.add_mutually_exclusive_group()
+    tuning.add_argument(
+        "--tune",
+        action="store_true",
+        help="Enable the untracked cache, fsmonitor and many-files settings where supported, then exit",
+    )
+    tuning.add_argument(
+        "--untune",
+        action="store_true",
+        help="Revert the settings changed by --tune, then exit",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and commit repositories shortly after their files change",
+    )
+    parser.add_argument(
+        "--debounce-seconds",
+        type=float,
+        default=WATCH_DEBOUNCE_SECONDS,
+        help="Seconds without further changes before a watched repository is committed",
+    )
+    parser.add_argument(
+        "--no-clean-fingerprint",
+        dest="clean_fingerprint",
+        action="store_false",
+        help="Always run git status instead of trusting the stored clean-state fingerprint",
+    )
+    parser.add_argument(
+        "--no-maintenance",
+        dest="maintenance",
+        action="store_false",
+        help="Never run incremental git maintenance after commits",
+    )
+    parser.add_argument(
+        "--metrics-jsonl",
+        metavar="PATH",
+        help="Append one JSON record with phase timings per repository run to PATH",
+    )
+    parser.add_argument(
+        "--metrics-textfile",
+        metavar="PATH",
+        help="Write cumulative phase histograms and outcome counters for the node_exporter textfile collector",
+    )
+    parser.add_argument(
+        "--timing-summary",
+        action="store_true",
+        help="Log a per-phase timing summary when the run finishes",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="Record every spawned command and write a Chrome trace-event JSON file to PATH",
+    )
+    parser.add_argument(
+        "--push-max-age",
+        type=float,
+        default=PUSH_MAX_AGE_SECONDS,
+        metavar="SECONDS",
+        help="Only push once the oldest unpushed commit is this old (0 pushes every run)",
+    )
+    parser.add_argument(
+        "--push-max-commits",
+        type=int,
+        default=PUSH_MAX_COMMITS,
+        metavar="N",
+        help="Only push once N commits are waiting (0 pushes every run)",
+    )
+    parser.add_argument(
+        "--flush",
+        action="store_true",
+        help="Push waiting commits now, ignoring --push-max-age and --push-max-commits",
+    )
+    parser.add_argument(
+        "--squash-auto-commits",
+        action="store_true",
+        help="Before pushing, squash the newest unpushed auto-commits into one commit",
+    )
+    parser.add_argument(
+        "--staged-wait-seconds",
+        type=float,
+        default=STAGED_TAKEOVER_WAIT_SECONDS,
+        help="Seconds a pre-existing staged diff must stay stable before auto-commit takes it over",
+    )
+    parser.add_argument(
+        "--staged-poll-seconds",
+        type=float,
+        default=STAGED_TAKEOVER_POLL_SECONDS,
+        help="Seconds between staged-diff stability checks",
+    )
+    args = parser.parse_args()
+
+    args.ssh_control_directory = None
+    args.run_records = []
+    args.push_deadlines = {}
+    if args.trace:
+        start_command_trace()
+    try:
+        process_repositories(batch_repo_paths(args), args)
+    finally:
+        if args.timing_summary:
+            log_timing_summary(args.run_records)
+        if args.trace:
+            try:
+                write_chrome_trace(args.trace)
+            except OSError as error:
+                logger.warning(f"Could not write trace to {args.trace}: {error}")
 
 
 if __name__ == "__main__":
@@ -1,16 +1,21 @@
 import importlib.util
+import json
 import os
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import unittest
 from contextlib import contextmanager
 from pathlib import Path
+from types import SimpleNamespace
 from unittest import mock
 
 
 MODULE_PATH = Path(__file__).resolve().parents[1] / "gitAutoCommit.py"
+TEST_STATE_DIRECTORY = tempfile.TemporaryDirectory()
+os.environ["GIT_AUTO_STATE_DIR"] = TEST_STATE_DIRECTORY.name
 spec = importlib.util.spec_from_file_location("gitAutoCommit", MODULE_PATH)
 git_auto_commit = importlib.util.module_from_spec(spec)
 spec.loader.exec_module(git_auto_commit)
@@ -29,6 +34,10 @@ def command_output(*args):
     return subprocess.run(args, capture_output=True, check=True, text=True).stdout
 
 
+def git_result(stdout, returncode=0):
+    return subprocess.CompletedProcess(["git"], returncode, stdout=stdout, stderr="")
+
+
 def configure_test_repo(repo_path):
     git(repo_path, "config", "user.email", "test@example.com")
     git(repo_path, "config", "user.name", "Git Auto Commit Test")
@@ -41,6 +50,7 @@ def run_auto_commit(repo_path, *args, check=True):
     environment = {
         **os.environ,
         "GIT_AUTO_ERROR_INBOX_PATH": "/dev/null",
+        "GIT_AUTO_STATE_DIR": str(Path(repo_path).parent / "git-auto-state"),
     }
     return subprocess.run(
         [
@@ -127,7 +137,7 @@ class GitAutoCommitTests(unittest.TestCase):
         ) as run_command, mock.patch.object(git_auto_commit.time, "sleep") as sleep:
             result = git_auto_commit.commit_with_dns_retry(
                 "inbox-index.md",
-                "/home/pimania/notes",
+                git_auto_commit.RepoContext("/home/pimania/notes"),
                 retry_delay_seconds=0,
             )
 
@@ -218,7 +228,7 @@ class GitAutoCommitTests(unittest.TestCase):
             self.assertTrue(
                 git_auto_commit.remote_has_internet_connectivity(
                     "/tmp/repository.git",
-                    "/tmp/local",
+                    git_auto_commit.RepoContext("/tmp/local"),
                 )
             )
 
@@ -233,17 +243,23 @@ class GitAutoCommitTests(unittest.TestCase):
             stderr="",
         )
 
-        with mock.patch.object(
-            git_auto_commit.subprocess,
-            "run",
-            return_value=disconnected_result,
-        ) as run_command:
-            self.assertFalse(
-                git_auto_commit.remote_has_internet_connectivity(
-                    "git@github.com:distbit0/git-auto.git",
-                    "/home/pimania/dev/git-auto",
+        with (
+            tempfile.TemporaryDirectory() as temporary_directory,
+            mock.patch.object(git_auto_commit, "STATE_DIR", Path(temporary_directory)),
+            mock.patch.object(git_auto_commit, "CONNECTIVITY_BACKEND", "nmcli"),
+            mock.patch.object(
+                git_auto_commit.subprocess,
+                "run",
+                return_value=disconnected_result,
+            ) as run_command,
+        ):
+            for repo_name in ("git-auto", "notes"):
+                self.assertFalse(
+                    git_auto_commit.remote_has_internet_connectivity(
+                        "git@github.com:distbit0/git-auto.git",
+                        git_auto_commit.RepoContext(f"/home/pimania/dev/{repo_name}"),
+                    )
                 )
-            )
 
         run_command.assert_called_once_with(
             connectivity_command,
@@ -251,6 +267,115 @@ class GitAutoCommitTests(unittest.TestCase):
             text=True,
         )
 
+    def test_dbus_connectivity_is_shared_until_it_expires(self):
+        connected_result = subprocess.CompletedProcess(
+            ["busctl"],
+            0,
+            stdout="u 4\n",
+            stderr="",
+        )
+
+        with (
+            tempfile.TemporaryDirectory() as temporary_directory,
+            mock.patch.object(git_auto_commit, "STATE_DIR", Path(temporary_directory)),
+            mock.patch.object(git_auto_commit, "CONNECTIVITY_BACKEND", "dbus"),
+            mock.patch.object(
+                git_auto_commit.subprocess,
+                "run",
+                return_value=connected_result,
+            ) as run_command,
+        ):
+            self.assertEqual(git_auto_commit.shared_connectivity_state(), ("full", None))
+            self.assertEqual(git_auto_commit.shared_connectivity_state(), ("full", None))
+            self.assertEqual(run_command.call_count, 1)
+
+            git_auto_commit.forget_connectivity_state()
+            self.assertEqual(git_auto_commit.shared_connectivity_state(), ("full", None))
+
+        self.assertEqual(run_command.call_count, 2)
+        self.assertEqual(run_command.call_args.args[0][:3], ["busctl", "--system", "get-property"])
+
+    def test_push_timeouts_open_host_circuit_breaker(self):
+        self.assertEqual(
+            git_auto_commit.remote_host("git@GitHub.com:distbit0/git-auto.git"),
+            "github.com",
+        )
+        self.assertIsNone(git_auto_commit.remote_host("/tmp/repository.git"))
+
+        with (
+            tempfile.TemporaryDirectory() as temporary_directory,
+            mock.patch.object(git_auto_commit, "STATE_DIR", Path(temporary_directory)),
+        ):
+            repo_path = Path(temporary_directory) / "repo"
+            repo_path.mkdir()
+            git(repo_path, "init")
+            git(repo_path, "remote", "add", "origin", "ssh://git@example.com/repo.git")
+            repo = git_auto_commit.RepoContext(str(repo_path))
+            self.assertEqual(git_auto_commit.remote_host(repo.push_url), "example.com")
+
+            with mock.patch.object(
+                git_auto_commit.subprocess,
+                "run",
+                side_effect=subprocess.TimeoutExpired(["git", "push"], 120),
+            ):
+                for _attempt in range(git_auto_commit.HOST_FAILURE_THRESHOLD):
+                    self.assertTrue(
+                        git_auto_commit.remote_host_is_available(repo.push_url, repo)
+                    )
+                    with self.assertRaises(git_auto_commit.RemoteHostUnavailable):
+                        git_auto_commit.push_with_auto_reconcile(repo)
+
+            self.assertFalse(git_auto_commit.remote_host_is_available(repo.push_url, repo))
+            self.assertEqual(
+                git_auto_commit.host_cooldown_remaining_seconds(
+                    "example.com",
+                    now=time.time() + git_auto_commit.HOST_COOLDOWN_SECONDS,
+                ),
+                0,
+            )
+
+            git_auto_commit.record_host_success("example.com")
+            self.assertTrue(git_auto_commit.remote_host_is_available(repo.push_url, repo))
+
+            git(repo_path, "remote", "set-url", "origin", str(Path(temporary_directory) / "remote.git"))
+            local_remote_repo = git_auto_commit.RepoContext(str(repo_path))
+            self.assertIsNone(git_auto_commit.remote_host(local_remote_repo.push_url))
+            with mock.patch.object(
+                git_auto_commit.subprocess,
+                "run",
+                side_effect=subprocess.TimeoutExpired(["git", "push"], 120),
+            ), mock.patch.object(git_auto_commit, "report_error") as report_error:
+                with self.assertRaises(git_auto_commit.NetworkGitTimeout):
+                    git_auto_commit.push_with_auto_reconcile(local_remote_repo)
+                git_auto_commit.refresh_remote_write_permission(local_remote_repo)
+            report_error.assert_not_called()
+
+    def test_ssh_connection_pool_is_shared_unless_ssh_is_configured(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("GIT_SSH", None)
+            os.environ.pop("GIT_SSH_COMMAND", None)
+            with git_auto_commit.ssh_connection_pool() as control_directory:
+                environment = git_auto_commit.ssh_multiplexing_environment(
+                    control_directory, {}
+                )
+                self.assertIn(
+                    f"ControlPath={control_directory}/%C",
+                    environment["GIT_SSH_COMMAND"],
+                )
+                self.assertIn("ControlMaster=auto", environment["GIT_SSH_COMMAND"])
+                self.assertIsNone(
+                    git_auto_commit.ssh_multiplexing_environment(
+                        control_directory, {"core.sshcommand": ["ssh -i key"]}
+                    )
+                )
+                os.environ["GIT_SSH_COMMAND"] = "ssh -v"
+                self.assertIsNone(
+                    git_auto_commit.ssh_multiplexing_environment(control_directory, {})
+                )
+
+        self.assertFalse(os.path.exists(control_directory))
+        self.assertIsNone(git_auto_commit.ssh_multiplexing_environment(None, {}))
+
     def test_has_staged_changes_detects_existing_index_work(self):
         with tempfile.TemporaryDirectory() as temporary_directory:
             repo_path = Path(temporary_directory)
@@ -262,14 +387,13 @@ class GitAutoCommitTests(unittest.TestCase):
             git(repo_path, "add", "tracked.txt")
             git(repo_path, "commit", "-m", "initial")
 
-            with working_directory(repo_path):
-                self.assertFalse(git_auto_commit.has_staged_changes())
+            repo = git_auto_commit.RepoContext(str(repo_path))
+            self.assertFalse(git_auto_commit.has_staged_changes(repo))
 
             tracked_file.write_text(git(repo_path, "rev-parse", "HEAD").stdout, encoding="utf-8")
             git(repo_path, "add", "tracked.txt")
 
-            with working_directory(repo_path):
-                self.assertTrue(git_auto_commit.has_staged_changes())
+            self.assertTrue(git_auto_commit.has_staged_changes(repo))
 
     def test_stale_index_lock_is_removed_after_waiting(self):
         with tempfile.TemporaryDirectory() as temporary_directory:
@@ -281,11 +405,33 @@ class GitAutoCommitTests(unittest.TestCase):
             stale_timestamp = 1
             os.utime(lock_path, (stale_timestamp, stale_timestamp))
 
-            with working_directory(repo_path):
-                git_auto_commit.wait_for_index_lock(str(repo_path))
+            git_auto_commit.wait_for_index_lock(
+                git_auto_commit.RepoContext(str(repo_path))
+            )
 
             self.assertFalse(lock_path.exists())
 
+    def test_index_lock_wait_wakes_when_active_git_releases_lock(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            repo_path = Path(temporary_directory)
+            git(repo_path, "init", "-b", "master")
+            repo = git_auto_commit.RepoContext(str(repo_path))
+
+            lock_path = repo_path / ".git" / "index.lock"
+            lock_path.write_text("", encoding="utf-8")
+            release_lock = threading.Timer(0.2, lock_path.unlink)
+            wait_started = time.monotonic()
+            with mock.patch.object(
+                git_auto_commit, "git_processes_in_repo", return_value=[os.getpid()]
+            ):
+                release_lock.start()
+                git_auto_commit.wait_for_index_lock(repo)
+
+            self.assertLess(
+                time.monotonic() - wait_started, git_auto_commit.INDEX_LOCK_POLL_SECONDS
+            )
+            self.assertFalse(lock_path.exists())
+
     def test_auto_commit_state_marks_owned_staged_changes(self):
         with tempfile.TemporaryDirectory() as temporary_directory:
             repo_path = Path(temporary_directory)
@@ -297,13 +443,13 @@ class GitAutoCommitTests(unittest.TestCase):
             git(repo_path, "add", "tracked.txt")
             git(repo_path, "commit", "-m", "initial")
 
-            with working_directory(repo_path):
-                state_path = Path(git_auto_commit.auto_commit_state_path(str(repo_path)))
-                self.assertFalse(state_path.exists())
-                git_auto_commit.mark_auto_commit_started(str(repo_path))
-                self.assertTrue(state_path.exists())
-                git_auto_commit.clear_auto_commit_state(str(repo_path))
-                self.assertFalse(state_path.exists())
+            repo = git_auto_commit.RepoContext(str(repo_path))
+            state_path = Path(git_auto_commit.auto_commit_state_path(repo))
+            self.assertFalse(state_path.exists())
+            git_auto_commit.mark_auto_commit_started(repo)
+            self.assertTrue(state_path.exists())
+            git_auto_commit.clear_auto_commit_state(repo)
+            self.assertFalse(state_path.exists())
 
     def test_active_pause_leaves_dirty_work_and_local_commits_unpushed(self):
         with tempfile.TemporaryDirectory() as temporary_directory:
@@ -429,8 +575,82 @@ class GitAutoCommitTests(unittest.TestCase):
             git(other_path, "push")
 
             git(local_path, "fetch", "--quiet")
-            with working_directory(local_path):
-                self.assertEqual(git_auto_commit.upstream_ahead_count("origin/master"), 1)
+            self.assertEqual(
+                git_auto_commit.upstream_ahead_count(
+                    git_auto_commit.RepoContext(str(local_path))
+                ),
+                1,
+            )
+
+    def test_repo_state_snapshot_reads_branch_divergence_and_changed_paths(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            base_path = Path(temporary_directory)
+            remote_path = base_path / "remote.git"
+            local_path = base_path / "local"
+
+            git(base_path, "init", "--bare", remote_path)
+            git(base_path, "clone", remote_path, local_path)
+            configure_test_repo(local_path)
+
+            tracked_file = local_path / "tracked.txt"
+            tracked_file.write_text(command_output("git", "--version"), encoding="utf-8")
+            git(local_path, "add", "tracked.txt")
+            git(local_path, "commit", "-m", "initial")
+            git(local_path, "push", "-u", "origin", "master")
+
+            git(local_path, "mv", "tracked.txt", "renamed.txt")
+            git(local_path, "commit", "-m", "rename")
+            (local_path / "renamed.txt").write_text("edited", encoding="utf-8")
+            (local_path / "new file.txt").write_text("new", encoding="utf-8")
+
+            repo = git_auto_commit.RepoContext(str(local_path))
+            repo_state = repo.state
+            self.assertEqual(repo.push_remote, "origin")
+            self.assertEqual(repo.push_url, str(remote_path))
+
+        self.assertEqual(repo_state.branch, "master")
+        self.assertEqual(repo.upstream, "origin/master")
+        self.assertEqual(git_auto_commit.branch_divergence(repo), (1, 0))
+        self.assertTrue(git_auto_commit.has_local_commits_to_push(repo))
+        self.assertEqual(
+            set(repo_state.changed_paths),
+            {"renamed.txt", "new file.txt"},
+        )
+
+    def test_push_url_follows_push_remote_and_url_rewrites(self):
+        git_config = git_auto_commit.parse_git_config_list(
+            "remote.origin.url\ngh:distbit0/git-auto.git\0"
+            "remote.fork.url\nhttps://github.com/fork/git-auto.git\0"
+            "remote.mirror.url\nhttps://example.com/mirror.git\0"
+            "remote.mirror.pushurl\nhttps://example.com/first.git\0"
+            "remote.mirror.pushurl\nhttps://example.com/second.git\0"
+            "branch.master.remote\norigin\0"
+            "branch.master.pushremote\nfork\0"
+            "url.git@github.com:.insteadof\ngh:\0"
+            "url.git@github.com:.pushinsteadof\nhttps://github.com/\0"
+        )
+
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            repo = git_auto_commit.RepoContext(temporary_directory)
+            remote_name = git_auto_commit.push_remote_name("master", git_config)
+
+            self.assertEqual(remote_name, "fork")
+            self.assertEqual(
+                git_auto_commit.remote_push_url(remote_name, git_config, repo),
+                "git@github.com:fork/git-auto.git",
+            )
+            self.assertEqual(
+                git_auto_commit.remote_push_url("origin", git_config, repo),
+                "git@github.com:distbit0/git-auto.git",
+            )
+            self.assertEqual(
+                git_auto_commit.remote_push_url("mirror", git_config, repo),
+                "https://example.com/first.git",
+            )
+            self.assertEqual(
+                git_auto_commit.remote_push_url(".", git_config, repo), temporary_directory
+            )
+        self.assertEqual(git_auto_commit.push_remote_name(None, git_config), "origin")
 
     def test_pre_existing_staged_changes_are_committed_after_stable_wait(self):
         with tempfile.TemporaryDirectory() as temporary_directory:
@@ -459,6 +679,200 @@ class GitAutoCommitTests(unittest.TestCase):
                 git(local_path, "rev-parse", "origin/master").stdout,
             )
 
+    def test_files_written_during_staged_wait_are_committed(self):
+        with (
+            tempfile.TemporaryDirectory() as temporary_directory,
+            mock.patch.object(
+                git_auto_commit, "STATE_DIR", Path(temporary_directory) / "state"
+            ),
+        ):
+            base_path = Path(temporary_directory)
+            remote_path = base_path / "remote.git"
+            local_path = base_path / "local"
+
+            git(base_path, "init", "--bare", remote_path)
+            git(base_path, "clone", remote_path, local_path)
+            configure_test_repo(local_path)
+            (local_path / "tracked.txt").write_text("initial\n", encoding="utf-8")
+            git(local_path, "add", "tracked.txt")
+            git(local_path, "commit", "-m", "initial")
+            git(local_path, "push", "-u", "origin", "master")
+            (local_path / "tracked.txt").write_text("changed\n", encoding="utf-8")
+            claim_staging_window = git_auto_commit.claim_staging_window
+
+            def write_during_wait(ctx, wait_seconds, poll_seconds):
+                claim_staging_window(ctx, wait_seconds, poll_seconds)
+                (local_path / "late.txt").write_text("late\n", encoding="utf-8")
+
+            with (
+                mock.patch.object(
+                    git_auto_commit,
+                    "claim_staging_window",
+                    side_effect=write_during_wait,
+                ),
+                mock.patch.object(
+                    sys, "argv", ["gitAutoCommit.py", "--path", str(local_path)]
+                ),
+            ):
+                git_auto_commit.main()
+
+            self.assertEqual(git(local_path, "status", "--short").stdout, "")
+            self.assertEqual(
+                git(local_path, "show", "--format=", "--name-only", "HEAD").stdout.split(),
+                ["late.txt", "tracked.txt"],
+            )
+
+    def test_staged_tree_snapshot_tracks_staged_content(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            repo_path = Path(temporary_directory)
+            git(repo_path, "init")
+            repo = git_auto_commit.RepoContext(str(repo_path))
+            tracked_file = repo_path / "tracked.bin"
+
+            tracked_file.write_bytes(b"\0" * 4096)
+            git(repo_path, "add", "tracked.bin")
+            first_snapshot = git_auto_commit.staged_tree_snapshot(repo)
+            self.assertEqual(first_snapshot, git(repo_path, "write-tree").stdout.strip())
+
+            tracked_file.write_bytes(b"\1" * 4096)
+            self.assertEqual(git_auto_commit.staged_tree_snapshot(repo), first_snapshot)
+            git(repo_path, "add", "tracked.bin")
+            second_snapshot = git_auto_commit.staged_tree_snapshot(repo)
+            self.assertNotEqual(second_snapshot, first_snapshot)
+
+            index_lock_path = repo_path / ".git" / "index.lock"
+            index_lock_path.write_bytes(b"")
+            self.assertEqual(git_auto_commit.staged_tree_snapshot(repo), second_snapshot)
+            self.assertEqual(index_lock_path.read_bytes(), b"")
+
+    def test_stage_changes_adds_only_status_paths_literally(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            repo_path = Path(temporary_directory)
+            git(repo_path, "init", "-b", "master")
+            configure_test_repo(repo_path)
+            for file_name in (
+                "a*",
+                "ab",
+                "gone.txt",
+                "with space.txt",
+                "staged-gone.txt",
+                "old-name.txt",
+                "edited-old-name.txt",
+            ):
+                (repo_path / file_name).write_text(f"{file_name}\n" * 5, encoding="utf-8")
+            git(repo_path, "add", ".")
+            git(repo_path, "commit", "-m", "initial")
+
+            (repo_path / "a*").write_text("changed\n", encoding="utf-8")
+            (repo_path / "with space.txt").write_text("changed\n", encoding="utf-8")
+            (repo_path / "gone.txt").unlink()
+            (repo_path / "new-dir").mkdir()
+            (repo_path / "new-dir" / "note.md").write_text("new\n", encoding="utf-8")
+            git(repo_path, "rm", "--quiet", "staged-gone.txt")
+            git(repo_path, "mv", "old-name.txt", "new-name.txt")
+            git(repo_path, "mv", "edited-old-name.txt", "edited-new-name.txt")
+            with (repo_path / "edited-new-name.txt").open("a", encoding="utf-8") as edited_file:
+                edited_file.write("changed\n")
+            repo = git_auto_commit.RepoContext(str(repo_path))
+
+            with mock.patch.object(
+                git_auto_commit,
+                "run_command",
+                wraps=git_auto_commit.run_command,
+            ) as run_command:
+                git_auto_commit.stage_changes(repo)
+
+            self.assertEqual(run_command.call_args.args[0][:3], ["git", "--literal-pathspecs", "add"])
+            self.assertEqual(
+                set(run_command.call_args.kwargs["input"].split(b"\0")),
+                {b"a*", b"with space.txt", b"gone.txt", b"new-dir/", b"edited-new-name.txt"},
+            )
+            self.assertEqual(
+                git(repo_path, "status", "--porcelain").stdout.splitlines(),
+                [
+                    "M  a*",
+                    "R  edited-old-name.txt -> edited-new-name.txt",
+                    "D  gone.txt",
+                    "A  new-dir/note.md",
+                    "R  old-name.txt -> new-name.txt",
+                    "D  staged-gone.txt",
+                    'M  "with space.txt"',
+                ],
+            )
+
+    def test_tune_records_settings_and_untune_reverts_them(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            repo_path = Path(temporary_directory)
+            git(repo_path, "init", "-b", "master")
+            configure_test_repo(repo_path)
+            (repo_path / "tracked.txt").write_text("initial\n", encoding="utf-8")
+            git(repo_path, "add", ".")
+            git(repo_path, "commit", "-m", "initial")
+
+            def config_value(key):
+                return subprocess.run(
+                    ["git", "-C", str(repo_path), "config", key],
+                    capture_output=True,
+                    text=True,
+                ).stdout
+
+            with mock.patch.object(
+                git_auto_commit, "TUNE_MANY_FILES_THRESHOLD", 1
+            ), mock.patch.object(
+                git_auto_commit, "filesystem_supports_untracked_cache", return_value=True
+            ), mock.patch.object(
+                git_auto_commit, "git_supports_builtin_fsmonitor", return_value=False
+            ):
+                git_auto_commit.tune_repo(str(repo_path), None)
+
+            self.assertEqual(config_value("core.untrackedCache"), "true\n")
+            self.assertEqual(config_value("feature.manyFiles"), "true\n")
+            self.assertEqual(config_value("core.fsmonitor"), "")
+            repo = git_auto_commit.RepoContext(str(repo_path))
+            self.assertEqual(git_auto_commit.index_header(repo), (4, 1))
+            self.assertEqual(
+                json.loads((repo_path / ".git" / "git_auto_commit.tuning").read_text())["config"],
+                ["core.untrackedCache", "feature.manyFiles"],
+            )
+
+            git_auto_commit.untune_repo(str(repo_path), None)
+
+            self.assertEqual(config_value("core.untrackedCache"), "")
+            self.assertEqual(config_value("feature.manyFiles"), "")
+            self.assertEqual(git_auto_commit.index_header(repo), (2, 1))
+            self.assertFalse((repo_path / ".git" / "git_auto_commit.tuning").exists())
+
+    def test_commit_message_caps_names_and_summarizes_bulk_changes(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            repo_path = Path(temporary_directory)
+            git(repo_path, "init", "-b", "master")
+            configure_test_repo(repo_path)
+            (repo_path / "docs").mkdir()
+            (repo_path / "src").mkdir()
+            (repo_path / ".hidden").write_text("hidden\n", encoding="utf-8")
+            (repo_path / "docs" / "guide.md").write_text("guide\n", encoding="utf-8")
+            (repo_path / os.fsdecode(b"caf\xe9.txt")).write_text("latin-1\n", encoding="utf-8")
+            for index in range(3):
+                (repo_path / "src" / f"module{index}.py").write_text("code\n", encoding="utf-8")
+            git(repo_path, "add", ".")
+            repo = git_auto_commit.RepoContext(str(repo_path))
+
+            with mock.patch.object(git_auto_commit, "COMMIT_MESSAGE_MAX_NAMES", 2), mock.patch.object(
+                git_auto_commit, "COMMIT_MESSAGE_MAX_GROUPS", 2
+            ), mock.patch.object(git_auto_commit, "COMMIT_MESSAGE_READ_SIZE", 7):
+                commit_message = git_auto_commit.generate_commit_message(repo)
+
+            self.assertEqual(
+                commit_message.splitlines(),
+                [
+                    "caf\\xe9.txt",
+                    "guide.md",
+                    "... and 3 more files",
+                    "Directories: src (3), . (1), 1 more",
+                    "Extensions: .py (3), .txt (1), 1 more",
+                ],
+            )
+
     def test_clean_synced_repo_skips_push(self):
         with tempfile.TemporaryDirectory() as temporary_directory:
             base_path = Path(temporary_directory)
@@ -503,21 +917,166 @@ class GitAutoCommitTests(unittest.TestCase):
             git(local_path, "fetch", "--quiet")
 
             permission_cache_path = (
-                local_path
-                / ".git"
-                / git_auto_commit.REMOTE_PERMISSION_CACHE_FILENAME
+                base_path
+                / "git-auto-state"
+                / git_auto_commit.REMOTE_PERMISSIONS_FILENAME
             )
+            push_url = git(local_path, "remote", "get-url", "--push", "origin").stdout.strip()
             self.assertIn("Verified and cached write permission", result.stderr)
             self.assertTrue(
-                permission_cache_path.read_text(encoding="utf-8").endswith(
-                    " writable\n"
-                )
+                json.loads(permission_cache_path.read_text(encoding="utf-8"))[
+                    git_auto_commit.remote_permission_key(push_url)
+                ]["writable"]
             )
             self.assertEqual(
                 git(local_path, "rev-parse", "HEAD").stdout,
                 git(local_path, "rev-parse", "origin/master").stdout,
             )
 
+    def test_push_policy_coalesces_commits_until_count_or_flush(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            base_path = Path(temporary_directory)
+            remote_path = base_path / "remote.git"
+            local_path = base_path / "local"
+
+            git(base_path, "init", "--bare", remote_path)
+            git(base_path, "clone", remote_path, local_path)
+            configure_test_repo(local_path)
+
+            tracked_file = local_path / "tracked.txt"
+            tracked_file.write_text("initial\n", encoding="utf-8")
+            git(local_path, "add", "tracked.txt")
+            git(local_path, "commit", "-m", "initial")
+            git(local_path, "push", "-u", "origin", "master")
+
+            def remote_commit_count():
+                return int(git(remote_path, "rev-list", "--count", "master").stdout)
+
+            tracked_file.write_text("first\n", encoding="utf-8")
+            result = run_auto_commit(local_path, "--push-max-commits", "2")
+            self.assertIn("Deferring push of 1 local commits", result.stderr)
+            self.assertEqual(remote_commit_count(), 1)
+
+            tracked_file.write_text("second\n", encoding="utf-8")
+            run_auto_commit(local_path, "--push-max-commits", "2")
+            self.assertEqual(remote_commit_count(), 3)
+
+            tracked_file.write_text("third\n", encoding="utf-8")
+            run_auto_commit(local_path, "--push-max-commits", "5", "--push-max-age", "3600")
+            self.assertEqual(remote_commit_count(), 3)
+
+            run_auto_commit(local_path, "--push-max-commits", "5", "--flush")
+            self.assertEqual(remote_commit_count(), 4)
+
+    def test_squash_combines_only_newest_unpushed_auto_commits(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            base_path = Path(temporary_directory)
+            remote_path = base_path / "remote.git"
+            local_path = base_path / "local"
+
+            git(base_path, "init", "--bare", remote_path)
+            git(base_path, "clone", remote_path, local_path)
+            configure_test_repo(local_path)
+
+            (local_path / "tracked.txt").write_text("initial\n", encoding="utf-8")
+            git(local_path, "add", "tracked.txt")
+            git(local_path, "commit", "-m", "initial")
+            git(local_path, "push", "-u", "origin", "master")
+
+            (local_path / "manual.txt").write_text("manual\n", encoding="utf-8")
+            git(local_path, "add", "manual.txt")
+            git(local_path, "commit", "-m", "manual")
+            manual_commit = git(local_path, "rev-parse", "HEAD").stdout
+
+            (local_path / "first.txt").write_text("first\n", encoding="utf-8")
+            run_auto_commit(local_path, "--push-max-commits", "5")
+            (local_path / "second.txt").write_text("second\n", encoding="utf-8")
+            run_auto_commit(local_path, "--push-max-commits", "5")
+            (local_path / "third.txt").write_text("third\n", encoding="utf-8")
+            result = run_auto_commit(local_path, "--flush", "--squash-auto-commits")
+
+            self.assertIn("Squashed 3 unpushed auto-commits", result.stderr)
+            self.assertEqual(git(remote_path, "rev-list", "--count", "master").stdout, "3\n")
+            self.assertEqual(git(remote_path, "rev-parse", "master~1").stdout, manual_commit)
+            self.assertEqual(
+                git(remote_path, "log", "-1", "--format=%B", "master").stdout,
+                "first.txt\nsecond.txt\nthird.txt\n\nAuto-Committed-By: git-auto\n\n",
+            )
+
+    def test_squash_skips_auto_commits_already_on_a_separate_push_remote(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            base_path = Path(temporary_directory)
+            upstream_path = base_path / "upstream.git"
+            fork_path = base_path / "fork.git"
+            local_path = base_path / "local"
+
+            git(base_path, "init", "--bare", upstream_path)
+            git(base_path, "init", "--bare", fork_path)
+            git(base_path, "clone", upstream_path, local_path)
+            configure_test_repo(local_path)
+
+            (local_path / "tracked.txt").write_text("initial\n", encoding="utf-8")
+            git(local_path, "add", "tracked.txt")
+            git(local_path, "commit", "-m", "initial")
+            git(local_path, "push", "-u", "origin", "master")
+            git(local_path, "remote", "add", "fork", fork_path)
+            git(local_path, "config", "branch.master.pushRemote", "fork")
+            git(local_path, "config", "push.default", "current")
+
+            (local_path / "first.txt").write_text("first\n", encoding="utf-8")
+            run_auto_commit(local_path, "--flush")
+            pushed_commit = git(fork_path, "rev-parse", "master").stdout
+            (local_path / "second.txt").write_text("second\n", encoding="utf-8")
+            run_auto_commit(local_path, "--push-max-commits", "5")
+            (local_path / "third.txt").write_text("third\n", encoding="utf-8")
+            result = run_auto_commit(local_path, "--flush", "--squash-auto-commits")
+
+            self.assertIn("Squashed 2 unpushed auto-commits", result.stderr)
+            self.assertEqual(git(fork_path, "rev-parse", "master~1").stdout, pushed_commit)
+
+            # Without a resolvable @{push} the pushed range is unknown, so
+            # nothing is squashed.
+            git(local_path, "config", "--unset", "push.default")
+            git(local_path, "update-ref", "-d", "refs/remotes/fork/master")
+            (local_path / "fourth.txt").write_text("fourth\n", encoding="utf-8")
+            run_auto_commit(local_path, "--push-max-commits", "5")
+            (local_path / "fifth.txt").write_text("fifth\n", encoding="utf-8")
+            result = run_auto_commit(local_path, "--flush", "--squash-auto-commits")
+
+            self.assertIn("Not squashing auto-commits", result.stderr)
+            self.assertEqual(git(fork_path, "rev-list", "--count", "master").stdout, "5\n")
+
+    def test_squash_keeps_commits_with_custom_messages(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            base_path = Path(temporary_directory)
+            remote_path = base_path / "remote.git"
+            local_path = base_path / "local"
+
+            git(base_path, "init", "--bare", remote_path)
+            git(base_path, "clone", remote_path, local_path)
+            configure_test_repo(local_path)
+
+            (local_path / "tracked.txt").write_text("initial\n", encoding="utf-8")
+            git(local_path, "add", "tracked.txt")
+            git(local_path, "commit", "-m", "initial")
+            git(local_path, "push", "-u", "origin", "master")
+
+            (local_path / "x.txt").write_text("x\n", encoding="utf-8")
+            run_auto_commit(
+                local_path, "Important hand-written message", "--push-max-commits", "5"
+            )
+            (local_path / "y.txt").write_text("y\n", encoding="utf-8")
+            run_auto_commit(local_path, "--push-max-commits", "5")
+            (local_path / "z.txt").write_text("z\n", encoding="utf-8")
+            result = run_auto_commit(local_path, "--flush", "--squash-auto-commits")
+
+            self.assertIn("Squashed 2 unpushed auto-commits", result.stderr)
+            self.assertEqual(git(remote_path, "rev-list", "--count", "master").stdout, "3\n")
+            self.assertEqual(
+                git(remote_path, "log", "-1", "--format=%B", "master~1").stdout,
+                "Important hand-written message\n\n",
+            )
+
     def test_cached_read_only_remote_leaves_dirty_work_untouched(self):
         with tempfile.TemporaryDirectory() as temporary_directory:
             base_path = Path(temporary_directory)
@@ -537,19 +1096,100 @@ class GitAutoCommitTests(unittest.TestCase):
             original_head = git(local_path, "rev-parse", "HEAD").stdout
             tracked_file.write_text(original_head, encoding="utf-8")
             push_url = git(local_path, "remote", "get-url", "--push", "origin").stdout.strip()
-            with working_directory(local_path):
-                git_auto_commit.cache_remote_write_permission(
-                    push_url,
-                    str(local_path),
-                    False,
-                )
+            legacy_cache_path = (
+                local_path / ".git" / git_auto_commit.REMOTE_PERMISSION_CACHE_FILENAME
+            )
+            legacy_cache_path.write_text(
+                f"{git_auto_commit.remote_permission_key(push_url)} read-only\n",
+                encoding="utf-8",
+            )
 
             result = run_auto_commit(local_path)
 
             self.assertIn("cached as read-only", result.stderr)
+            self.assertFalse(legacy_cache_path.exists())
+            self.assertFalse(
+                json.loads(
+                    (
+                        base_path
+                        / "git-auto-state"
+                        / git_auto_commit.REMOTE_PERMISSIONS_FILENAME
+                    ).read_text(encoding="utf-8")
+                )[git_auto_commit.remote_permission_key(push_url)]["writable"]
+            )
             self.assertEqual(git(local_path, "rev-parse", "HEAD").stdout, original_head)
             self.assertIn(" M tracked.txt", git(local_path, "status", "--short").stdout)
 
+    def test_expired_permission_is_served_while_refreshing_in_background(self):
+        with (
+            tempfile.TemporaryDirectory() as temporary_directory,
+            mock.patch.object(git_auto_commit, "STATE_DIR", Path(temporary_directory)),
+        ):
+            repo_path = Path(temporary_directory) / "repo"
+            repo_path.mkdir()
+            git(repo_path, "init")
+            git(repo_path, "remote", "add", "origin", "git@example.com:owner/repo.git")
+            repo = git_auto_commit.RepoContext(str(repo_path))
+            git_auto_commit.cache_remote_write_permission(
+                repo.push_url,
+                True,
+                time.time() - git_auto_commit.REMOTE_WRITABLE_CACHE_SECONDS - 1,
+            )
+
+            with mock.patch.object(
+                git_auto_commit,
+                "probe_remote_write_permission",
+                return_value=(False, None),
+            ) as probe:
+                self.assertTrue(git_auto_commit.remote_allows_writes(repo))
+                git_auto_commit.wait_for_remote_permission_refreshes()
+
+            probe.assert_called_once_with(repo)
+            self.assertEqual(
+                git_auto_commit.cached_remote_write_permission(repo.push_url, repo),
+                (False, False),
+            )
+            self.assertFalse(git_auto_commit.remote_allows_writes(repo))
+
+    def test_hung_permission_refresh_is_abandoned_after_join_timeout(self):
+        with (
+            tempfile.TemporaryDirectory() as temporary_directory,
+            mock.patch.object(git_auto_commit, "STATE_DIR", Path(temporary_directory)),
+        ):
+            repo_path = Path(temporary_directory) / "repo"
+            repo_path.mkdir()
+            git(repo_path, "init")
+            git(repo_path, "remote", "add", "origin", "git@example.com:owner/repo.git")
+            repo = git_auto_commit.RepoContext(str(repo_path))
+            git_auto_commit.cache_remote_write_permission(
+                repo.push_url,
+                True,
+                time.time() - git_auto_commit.REMOTE_WRITABLE_CACHE_SECONDS - 1,
+            )
+            release_probe = threading.Event()
+
+            def hung_probe(ctx):
+                release_probe.wait()
+                return True, None
+
+            with mock.patch.object(
+                git_auto_commit,
+                "probe_remote_write_permission",
+                side_effect=hung_probe,
+            ):
+                git_auto_commit.start_remote_permission_refresh(repo)
+                refresh = git_auto_commit.remote_permission_refreshes[-1]
+                started_at = time.monotonic()
+                git_auto_commit.wait_for_remote_permission_refreshes(0.1)
+
+                self.assertLess(time.monotonic() - started_at, 5)
+                self.assertTrue(refresh.daemon)
+                self.assertTrue(refresh.is_alive())
+                self.assertEqual(git_auto_commit.remote_permission_refreshes, [])
+
+                release_probe.set()
+                refresh.join()
+
     def test_remote_update_is_rebased_and_pushed(self):
         with tempfile.TemporaryDirectory() as temporary_directory:
             base_path = Path(temporary_directory)
@@ -576,19 +1216,571 @@ class GitAutoCommitTests(unittest.TestCase):
             git(other_path, "add", "remote.txt")
             git(other_path, "commit", "-m", "remote update")
             git(other_path, "push")
+            git(other_path, "tag", "remote-tag")
+            git(other_path, "push", "origin", "HEAD:refs/heads/side", "remote-tag")
 
             local_file = local_path / "local.txt"
             local_file.write_text(git(local_path, "rev-parse", "HEAD").stdout, encoding="utf-8")
 
             result = run_auto_commit(local_path)
-            git(local_path, "fetch", "--quiet")
 
             self.assertIn("Fetching and rebasing local commits", result.stderr)
+            self.assertEqual(
+                git(local_path, "for-each-ref", "--format=%(refname)", "refs/remotes", "refs/tags").stdout,
+                "refs/remotes/origin/master\n",
+            )
+            git(local_path, "fetch", "--quiet")
             self.assertEqual(
                 git(local_path, "rev-parse", "HEAD").stdout,
                 git(local_path, "rev-parse", "origin/master").stdout,
             )
 
+    @unittest.skipUnless(
+        git_auto_commit.git_version() >= git_auto_commit.MERGE_TREE_MERGE_BASE_GIT_VERSION,
+        "git merge-tree --merge-base needs Git 2.40",
+    )
+    def test_remote_update_is_replayed_without_worktree_rebase(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            base_path = Path(temporary_directory)
+            remote_path = base_path / "remote.git"
+            local_path = base_path / "local"
+            other_path = base_path / "other"
+
+            git(base_path, "init", "--bare", remote_path)
+            git(base_path, "clone", remote_path, local_path)
+            git(base_path, "clone", remote_path, other_path)
+
+            for repo_path in (local_path, other_path):
+                configure_test_repo(repo_path)
+
+            (local_path / "tracked.txt").write_text("initial\n", encoding="utf-8")
+            git(local_path, "add", "tracked.txt")
+            git(local_path, "commit", "-m", "initial")
+            git(local_path, "push", "-u", "origin", "master")
+
+            git(other_path, "pull", "--ff-only")
+            (other_path / "remote.txt").write_text("remote\n", encoding="utf-8")
+            git(other_path, "add", "remote.txt")
+            git(other_path, "commit", "-m", "remote update")
+            git(other_path, "push")
+
+            (local_path / "local.txt").write_text("local\n", encoding="utf-8")
+            git(local_path, "add", "local.txt")
+            git(local_path, "commit", "-m", "local update")
+            (local_path / "untracked.txt").write_text("untracked\n", encoding="utf-8")
+            git(local_path, "fetch", "--quiet")
+
+            git_auto_commit.rebase_onto_upstream(
+                git_auto_commit.RepoContext(str(local_path)), "origin/master"
+            )
+
+            self.assertEqual(
+                git(local_path, "log", "--format=%s").stdout.splitlines(),
+                ["local update", "remote update", "initial"],
+            )
+            self.assertIn("rebase (git-auto)", git(local_path, "reflog", "-1").stdout)
+            self.assertEqual(git(local_path, "status", "--short").stdout, "?? untracked.txt\n")
+
+    def test_git_version_ignores_vendor_suffixes(self):
+        for version_output, expected_version in (
+            ("git version 2.39.5\n", (2, 39)),
+            ("git version 2.39.3 (Apple Git-146)\n", (2, 39)),
+            ("git version 2.45.2.windows.1\n", (2, 45)),
+        ):
+            with mock.patch.object(
+                git_auto_commit.subprocess,
+                "run",
+                return_value=subprocess.CompletedProcess(
+                    ["git", "version"], 0, stdout=version_output, stderr=""
+                ),
+            ):
+                self.assertEqual(
+                    git_auto_commit.git_version.__wrapped__(), expected_version
+                )
+
+    def test_replay_onto_upstream_rewrites_commits_from_merge_tree_output(self):
+        repo = git_auto_commit.RepoContext("/home/pimania/notes")
+        with mock.patch.object(
+            git_auto_commit.subprocess,
+            "run",
+            side_effect=[
+                git_result("original\n"),
+                git_result("first base\nsecond first\n"),
+                git_result("upstream\nupstream-tree\n"),
+                git_result("first-tree\n"),
+                git_result("A U Thor\x00author@example.com\x001700000000 +0100\x00first\n\nbody\n"),
+                git_result("replayed-first\n"),
+                git_result("first-tree\n"),
+                git_result("original\n"),
+                git_result(""),
+            ],
+        ) as run_command:
+            self.assertTrue(git_auto_commit.replay_onto_upstream(repo, "origin/master"))
+
+        commands = [call.args[0] for call in run_command.call_args_list]
+        self.assertEqual(
+            commands[3],
+            ["git", "merge-tree", "--write-tree", "--merge-base=base", "upstream", "first"],
+        )
+        self.assertEqual(
+            commands[5], ["git", "commit-tree", "first-tree", "-p", "upstream", "-F", "-"]
+        )
+        commit_tree = run_command.call_args_list[5].kwargs
+        self.assertEqual(commit_tree["input"], "first\n\nbody\n")
+        self.assertEqual(commit_tree["env"]["GIT_AUTHOR_NAME"], "A U Thor")
+        self.assertEqual(commit_tree["env"]["GIT_AUTHOR_EMAIL"], "author@example.com")
+        self.assertEqual(commit_tree["env"]["GIT_AUTHOR_DATE"], "1700000000 +0100")
+        # The second commit is already upstream, so it is dropped like git rebase does.
+        self.assertEqual(
+            commands[6],
+            [
+                "git",
+                "merge-tree",
+                "--write-tree",
+                "--merge-base=first",
+                "replayed-first",
+                "second",
+            ],
+        )
+        self.assertEqual(commands[8], ["git", "reset", "--keep", "replayed-first"])
+        self.assertEqual(
+            run_command.call_args_list[8].kwargs["env"]["GIT_REFLOG_ACTION"],
+            "rebase (git-auto) onto origin/master",
+        )
+
+    def test_replay_onto_upstream_reports_conflicts_and_defers_merges(self):
+        repo = git_auto_commit.RepoContext("/home/pimania/notes")
+        with mock.patch.object(
+            git_auto_commit.subprocess,
+            "run",
+            side_effect=[
+                git_result("original\n"),
+                git_result("merge first second\n"),
+            ],
+        ) as run_command:
+            self.assertFalse(git_auto_commit.replay_onto_upstream(repo, "origin/master"))
+        self.assertEqual(run_command.call_count, 2)
+
+        with mock.patch.object(
+            git_auto_commit.subprocess,
+            "run",
+            side_effect=[
+                git_result("original\n"),
+                git_result("first base\n"),
+                git_result("upstream\nupstream-tree\n"),
+                git_result("conflict-tree\nCONFLICT (content): Merge conflict in notes.md\n", 1),
+            ],
+        ) as run_command, mock.patch.object(git_auto_commit, "report_error") as report_error:
+            with self.assertRaises(SystemExit):
+                git_auto_commit.replay_onto_upstream(repo, "origin/master")
+
+        self.assertEqual(run_command.call_count, 4)
+        self.assertIn("Merge conflict in notes.md", report_error.call_args.args[0])
+        self.assertIn("No changes were made", report_error.call_args.args[0])
+
+    def test_batch_mode_commits_each_repo_and_reports_failures(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            base_path = Path(temporary_directory)
+            local_paths = []
+            for name in ("first", "second"):
+                remote_path = base_path / f"{name}.git"
+                local_path = base_path / name
+                git(base_path, "init", "--bare", remote_path)
+                git(base_path, "clone", remote_path, local_path)
+                configure_test_repo(local_path)
+
+                tracked_file = local_path / "tracked.txt"
+                tracked_file.write_text(command_output("git", "--version"), encoding="utf-8")
+                git(local_path, "add", "tracked.txt")
+                git(local_path, "commit", "-m", "initial")
+                git(local_path, "push", "-u", "origin", "master")
+                tracked_file.write_text(name, encoding="utf-8")
+                local_paths.append(local_path)
+
+            broken_path = base_path / "broken"
+            broken_path.mkdir()
+            paths_file = base_path / "repos.txt"
+            paths_file.write_text(
+                f"# managed repositories\n{local_paths[1]}\n\n{broken_path}\n",
+                encoding="utf-8",
+            )
+
+            result = run_auto_commit(
+                local_paths[0],
+                "--paths-file",
+                str(paths_file),
+                "--jobs",
+                "2",
+                check=False,
+            )
+
+            self.assertNotEqual(result.returncode, 0)
+            self.assertIn("failed in 1 of 3 repositories", result.stderr)
+            for local_path in local_paths:
+                self.assertEqual(git(local_path, "status", "--short").stdout, "")
+                self.assertEqual(
+                    git(local_path, "rev-parse", "HEAD").stdout,
+                    git(local_path, "rev-parse", "origin/master").stdout,
+                )
+
+    def test_clean_fingerprint_detects_edits_and_new_untracked_files(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            base_path = Path(temporary_directory)
+            remote_path = base_path / "remote.git"
+            local_path = base_path / "local"
+
+            git(base_path, "init", "--bare", remote_path)
+            git(base_path, "clone", remote_path, local_path)
+            configure_test_repo(local_path)
+
+            tracked_file = local_path / "tracked.txt"
+            tracked_file.write_text(command_output("git", "--version"), encoding="utf-8")
+            (local_path / ".gitignore").write_text("*.o\n", encoding="utf-8")
+            build_path = local_path / "build"
+            build_path.mkdir()
+            (build_path / "main.o").write_text("", encoding="utf-8")
+            git(local_path, "add", "tracked.txt", ".gitignore")
+            git(local_path, "commit", "-m", "initial")
+            git(local_path, "push", "-u", "origin", "master")
+
+            repo = git_auto_commit.RepoContext(str(local_path))
+            with mock.patch.object(git_auto_commit, "CLEAN_FINGERPRINT_RACY_SECONDS", 0):
+                git_auto_commit.store_clean_fingerprint(repo, time.time_ns())
+            self.assertTrue(git_auto_commit.clean_fingerprint_matches(repo))
+
+            result = run_auto_commit(local_path)
+            self.assertIn("unchanged since the last clean run", result.stderr)
+
+            (build_path / "notes.txt").write_text("draft", encoding="utf-8")
+            self.assertFalse(git_auto_commit.clean_fingerprint_matches(repo))
+            (build_path / "notes.txt").unlink()
+
+            original_size = tracked_file.stat().st_size
+            tracked_file.write_text("x" * original_size, encoding="utf-8")
+            self.assertFalse(git_auto_commit.clean_fingerprint_matches(repo))
+
+            run_auto_commit(local_path)
+            self.assertEqual(git(local_path, "status", "--short").stdout, "")
+
+            fingerprint_path = local_path / ".git" / git_auto_commit.CLEAN_FINGERPRINT_FILENAME
+            for malformed_fingerprint in (
+                {"version": git_auto_commit.CLEAN_FINGERPRINT_VERSION},
+                {"version": git_auto_commit.CLEAN_FINGERPRINT_VERSION, "upstream_ref": 1},
+                [],
+            ):
+                fingerprint_path.write_text(json.dumps(malformed_fingerprint), encoding="utf-8")
+                self.assertFalse(git_auto_commit.clean_fingerprint_matches(repo))
+            result = run_auto_commit(local_path)
+            self.assertIn("No changes or local commits to push", result.stderr)
+
+    def test_adaptive_schedule_backs_off_cold_and_failing_repos(self):
+        with (
+            tempfile.TemporaryDirectory() as temporary_directory,
+            mock.patch.object(git_auto_commit, "STATE_DIR", Path(temporary_directory)),
+        ):
+            base_interval = git_auto_commit.ADAPTIVE_BASE_INTERVAL_SECONDS
+            hot_repo = git_auto_commit.RepoContext("/repos/hot")
+            cold_repo = git_auto_commit.RepoContext("/repos/cold")
+            failing_repo = git_auto_commit.RepoContext("/repos/failing")
+            all_paths = ["/repos/hot", "/repos/cold", "/repos/failing", "/repos/new"]
+
+            for _run in range(3):
+                git_auto_commit.record_repo_run(hot_repo, "pushed", 0, 1)
+                git_auto_commit.record_repo_run(cold_repo, "clean", 0, 1)
+                git_auto_commit.record_repo_run(failing_repo, "failed", 0, 1)
+
+            self.assertEqual(
+                git_auto_commit.due_repo_paths(all_paths, now=2),
+                ["/repos/hot", "/repos/new"],
+            )
+            self.assertEqual(
+                git_auto_commit.due_repo_paths(all_paths, now=1 + 4 * base_interval),
+                all_paths,
+            )
+            self.assertNotIn(
+                "/repos/cold",
+                git_auto_commit.due_repo_paths(all_paths, now=4 * base_interval),
+            )
+
+            git_auto_commit.record_repo_run(cold_repo, "committed", 0, 1)
+            self.assertIn("/repos/cold", git_auto_commit.due_repo_paths(all_paths, now=2))
+
+    def test_maintenance_runs_once_the_commit_budget_is_spent(self):
+        with (
+            tempfile.TemporaryDirectory() as temporary_directory,
+            mock.patch.object(git_auto_commit, "STATE_DIR", Path(temporary_directory) / "state"),
+            mock.patch.object(git_auto_commit, "MAINTENANCE_COMMIT_BUDGET", 2),
+        ):
+            repo_path = Path(temporary_directory) / "repo"
+            git(repo_path.parent, "init", "-b", "master", repo_path)
+            configure_test_repo(repo_path)
+            (repo_path / "tracked.txt").write_text("initial\n", encoding="utf-8")
+            git(repo_path, "add", "tracked.txt")
+            git(repo_path, "commit", "-m", "initial")
+            commit_graph_path = (
+                repo_path / ".git" / "objects" / "info" / "commit-graphs" / "commit-graph-chain"
+            )
+
+            repo = git_auto_commit.RepoContext(str(repo_path), commits_made=1)
+            git_auto_commit.maintain_repo_if_due(repo, now=0)
+            self.assertFalse(commit_graph_path.exists())
+            self.assertNotIn("maintenance", repo.phase_durations)
+
+            repo = git_auto_commit.RepoContext(str(repo_path), commits_made=1)
+            git_auto_commit.maintain_repo_if_due(repo, now=1)
+            self.assertTrue(commit_graph_path.exists())
+            self.assertIn("maintenance", repo.phase_durations)
+            self.assertIn("packs: 1\n", git(repo_path, "count-objects", "-v").stdout)
+
+            repo = git_auto_commit.RepoContext(str(repo_path), commits_made=1)
+            with mock.patch.object(git_auto_commit, "run_maintenance") as run_maintenance:
+                git_auto_commit.maintain_repo_if_due(repo, now=2)
+            run_maintenance.assert_not_called()
+
+    def test_phase_timings_are_exported_as_prometheus_histograms(self):
+        with (
+            tempfile.TemporaryDirectory() as temporary_directory,
+            mock.patch.object(git_auto_commit, "STATE_DIR", Path(temporary_directory)),
+        ):
+            repo = git_auto_commit.RepoContext("/repos/slow")
+            with mock.patch.object(git_auto_commit.time, "monotonic", side_effect=[0, 3]):
+                with git_auto_commit.timed_phase(repo, "push_attempt"):
+                    pass
+            record = git_auto_commit.repo_run_record(repo, "pushed", 100, 104)
+            self.assertEqual(record["phases"], {"push_attempt": 3, "total": 4})
+
+            textfile_path = Path(temporary_directory) / "git_auto.prom"
+            git_auto_commit.update_metrics_textfile(textfile_path, [record])
+            git_auto_commit.update_metrics_textfile(textfile_path, [record])
+            metrics = textfile_path.read_text(encoding="utf-8")
+
+        self.assertIn(
+            'git_auto_phase_duration_seconds_bucket{phase="push_attempt",le="2.5"} 0',
+            metrics,
+        )
+        self.assertIn(
+            'git_auto_phase_duration_seconds_bucket{phase="push_attempt",le="5"} 2',
+            metrics,
+        )
+        self.assertIn('git_auto_phase_duration_seconds_count{phase="total"} 2', metrics)
+        self.assertIn('git_auto_runs_total{outcome="pushed"} 2', metrics)
+
+    def test_trace_records_commands_on_per_thread_tracks(self):
+        with (
+            tempfile.TemporaryDirectory() as temporary_directory,
+            mock.patch.object(git_auto_commit, "command_trace", []),
+        ):
+            repo = git_auto_commit.RepoContext(temporary_directory)
+            with git_auto_commit.timed_phase(repo, "status"):
+                git_auto_commit.run_command(
+                    ["git", "--version"], capture_output=True, cwd=temporary_directory
+                )
+            worker = threading.Thread(
+                target=git_auto_commit.run_command,
+                args=(["git", "--version"],),
+                kwargs={"capture_output": True},
+                name="git-auto_1",
+            )
+            worker.start()
+            worker.join()
+            git_auto_commit.record_repo_trace(repo, "clean", 0, 1)
+
+            trace_path = Path(temporary_directory) / "trace.json"
+            git_auto_commit.write_chrome_trace(trace_path)
+            trace_events = json.loads(trace_path.read_text(encoding="utf-8"))[
+                "traceEvents"
+            ]
+
+        commands = [event for event in trace_events if event.get("cat") == "command"]
+        self.assertEqual(len(commands), 2)
+        self.assertEqual(commands[0]["args"]["argv"], ["git", "--version"])
+        self.assertEqual(commands[0]["args"]["cwd"], temporary_directory)
+        self.assertEqual(commands[0]["args"]["returncode"], 0)
+        self.assertGreater(commands[0]["args"]["stdout_bytes"], 0)
+        self.assertNotEqual(commands[0]["tid"], commands[1]["tid"])
+        self.assertEqual(
+            {event["args"]["name"] for event in trace_events if event["ph"] == "M"},
+            {threading.current_thread().name, "git-auto_1"},
+        )
+        self.assertIn(
+            ("phase", "status"),
+            {(event.get("cat"), event["name"]) for event in trace_events},
+        )
+
+    def test_watch_events_mark_changed_repos_and_ignore_own_git_writes(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            repo_path = Path(temporary_directory)
+            git(repo_path, "init", "-b", "master")
+            configure_test_repo(repo_path)
+            tracked_file = repo_path / "notes" / "tracked.txt"
+            tracked_file.parent.mkdir()
+            tracked_file.write_text(command_output("git", "--version"), encoding="utf-8")
+
+            fd = git_auto_commit.inotify_init()
+            try:
+                watches = {}
+                pending = {}
+                git_auto_commit.add_repo_watches(
+                    fd, watches, git_auto_commit.RepoContext(str(repo_path))
+                )
+
+                git(repo_path, "add", "notes/tracked.txt")
+                git(repo_path, "commit", "-m", "initial")
+                git_auto_commit.record_watch_events(
+                    fd, watches, pending, ignored_git_repo=str(repo_path)
+                )
+                self.assertEqual(pending, {})
+
+                new_directory = repo_path / "drafts"
+                new_directory.mkdir()
+                git_auto_commit.record_watch_events(fd, watches, pending)
+                self.assertIn(str(repo_path), pending)
+
+                pending.clear()
+                (new_directory / "idea.txt").write_text("draft", encoding="utf-8")
+                git_auto_commit.record_watch_events(fd, watches, pending)
+                self.assertIn(str(repo_path), pending)
+            finally:
+                os.close(fd)
+
+            first_event_at, last_event_at = pending[str(repo_path)]
+            self.assertEqual(
+                git_auto_commit.due_watched_repos(pending, 5, last_event_at + 1), []
+            )
+            self.assertEqual(
+                git_auto_commit.due_watched_repos(pending, 5, last_event_at + 5),
+                [str(repo_path)],
+            )
+
+    def test_age_deferred_push_is_rescheduled_in_watch_mode(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            base_path = Path(temporary_directory)
+            remote_path = base_path / "remote.git"
+            local_path = base_path / "local"
+
+            git(base_path, "init", "--bare", remote_path)
+            git(base_path, "clone", remote_path, local_path)
+            configure_test_repo(local_path)
+            (local_path / "tracked.txt").write_text("initial\n", encoding="utf-8")
+            git(local_path, "add", "tracked.txt")
+            git(local_path, "commit", "-m", "initial")
+            git(local_path, "push", "-u", "origin", "master")
+            (local_path / "tracked.txt").write_text("local\n", encoding="utf-8")
+            git(local_path, "commit", "-am", "local update")
+            commit_time = int(git(local_path, "log", "-1", "--format=%ct").stdout)
+
+            repo = git_auto_commit.RepoContext(str(local_path))
+            args = SimpleNamespace(
+                flush=False, push_max_age=3600, push_max_commits=0, push_deadlines={}
+            )
+            self.assertFalse(git_auto_commit.push_is_due(repo, args))
+            self.assertEqual(args.push_deadlines, {str(local_path): commit_time + 3600})
+
+            repo_paths = [str(local_path)]
+            self.assertEqual(
+                git_auto_commit.push_deadline_timeout(
+                    args.push_deadlines, repo_paths, commit_time + 3000
+                ),
+                600,
+            )
+            pending = {}
+            git_auto_commit.mark_due_push_deadlines(
+                pending, args.push_deadlines, repo_paths, commit_time + 3599, 10.0
+            )
+            self.assertEqual(pending, {})
+            git_auto_commit.mark_due_push_deadlines(
+                pending, args.push_deadlines, repo_paths, commit_time + 3600, 10.0
+            )
+            self.assertEqual(pending, {str(local_path): (10.0, 10.0)})
+            self.assertEqual(args.push_deadlines, {})
+
+    def test_new_ignored_directories_and_nested_repos_are_not_watched(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            base_path = Path(temporary_directory)
+            repo_path = base_path / "repo"
+            nested_path = base_path / "nested"
+            for path in (repo_path, nested_path):
+                path.mkdir()
+                git(path, "init", "-b", "master")
+            (repo_path / ".gitignore").write_text("build/\n", encoding="utf-8")
+
+            fd = git_auto_commit.inotify_init()
+            try:
+                watches = {}
+                pending = {}
+                git_auto_commit.add_repo_watches(
+                    fd, watches, git_auto_commit.RepoContext(str(repo_path))
+                )
+
+                (repo_path / "build" / "cache").mkdir(parents=True)
+                (repo_path / "drafts" / "cache").mkdir(parents=True)
+                (repo_path / "drafts" / ".gitignore").write_text("cache/\n", encoding="utf-8")
+                os.rename(nested_path, repo_path / "nested")
+                git_auto_commit.record_watch_events(fd, watches, pending)
+                watched_directories = {
+                    directory_path.rstrip("/")
+                    for _repo, directory_path, kind in watches.values()
+                    if kind == "worktree"
+                }
+
+                pending.clear()
+                (repo_path / "build" / "output.o").write_text("object", encoding="utf-8")
+                (repo_path / "nested" / "file.txt").write_text("nested", encoding="utf-8")
+                git_auto_commit.record_watch_events(fd, watches, pending)
+            finally:
+                os.close(fd)
+
+            self.assertIn(str(repo_path / "drafts"), watched_directories)
+            for unwatched_directory in ("build", "build/cache", "drafts/cache", "nested"):
+                self.assertNotIn(str(repo_path / unwatched_directory), watched_directories)
+            self.assertEqual(pending, {})
+
+    def test_discovery_index_rescans_only_changed_directories(self):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            base_path = Path(temporary_directory)
+            root_path = base_path / "dev"
+            active_path = root_path / "group" / "active"
+            paused_path = root_path / "paused"
+            for repo_path in (active_path, paused_path):
+                repo_path.mkdir(parents=True)
+                git(repo_path, "init", "-b", "master")
+            (paused_path / ".git" / git_auto_commit.AUTO_COMMIT_PAUSE_FILENAME).touch()
+
+            with mock.patch.object(git_auto_commit, "STATE_DIR", base_path / "state"):
+                self.assertEqual(
+                    git_auto_commit.discovered_repo_paths([str(root_path)]),
+                    [str(active_path)],
+                )
+
+                with mock.patch.object(
+                    git_auto_commit,
+                    "scan_discovery_directory",
+                    wraps=git_auto_commit.scan_discovery_directory,
+                ) as scan_directory:
+                    records = git_auto_commit.discover_repositories([str(root_path)])
+                scan_directory.assert_not_called()
+                self.assertEqual(
+                    set(records),
+                    {str(active_path), str(paused_path)},
+                )
+
+                added_path = root_path / "group" / "added"
+                added_path.mkdir()
+                git(added_path, "init", "-b", "master")
+                with mock.patch.object(
+                    git_auto_commit,
+                    "scan_discovery_directory",
+                    wraps=git_auto_commit.scan_discovery_directory,
+                ) as scan_directory:
+                    records = git_auto_commit.discover_repositories([str(root_path)])
+
+            scanned_paths = {call.args[0] for call in scan_directory.call_args_list}
+            self.assertEqual(
+                scanned_paths,
+                {str(root_path / "group"), str(added_path)},
+            )
+            self.assertIn(str(added_path), records)
+
     def test_rebase_conflict_aborts_and_reports_manual_resolution(self):
         with tempfile.TemporaryDirectory() as temporary_directory:
             base_path = Path(temporary_directory)